@@ -0,0 +1,118 @@
+# Лічильники на авторах і плейлистах: track_count (кількість треків) і total_duration (сумарна
+# тривалість, секунд). Без них клієнт, щоб показати довжину плейлиста чи дискографію автора,
+# мав би вивантажити всі треки і скласти тривалості сам.
+#
+# Лічильники оновлюються тригерами SQLite в тій самій транзакції, що й зміна треків чи плейлистів,
+# тому вони не розходяться з даними, хоч би звідки прийшла зміна: crud.py, масовий імпорт
+# (executemany), каскадне видалення автора чи користувача. Для інших СУБД тригерів немає -
+# там лічильники треба періодично перераховувати (python aggregates.py).
+#
+# Каскадне видалення: коли видаляється трек, SQLite спершу видаляє його зв'язки з плейлистами,
+# а тригер на playlisttracks вже не бачить тривалості треку. Тому плейлисти оновлює тригер
+# BEFORE DELETE на tracks, а тригер на playlisttracks пропускає зв'язки з уже видаленими треками.
+#
+# repair() перераховує все з нуля одним GROUP BY на таблицю і виправляє лише ті рядки,
+# де лічильники розійшлися. Запуск вручну: python aggregates.py
+
+import logging
+
+from sqlalchemy import text
+
+import cache
+
+logger = logging.getLogger(__name__)
+
+_TRIGGERS = [
+    # Автори
+    "CREATE TRIGGER IF NOT EXISTS tracks_aggregates_ai AFTER INSERT ON tracks BEGIN "
+    "UPDATE authors SET track_count = track_count + 1, total_duration = total_duration + COALESCE(new.duration, 0) "
+    "WHERE id = new.author_id; END",
+
+    "CREATE TRIGGER IF NOT EXISTS tracks_aggregates_au AFTER UPDATE OF duration, author_id ON tracks BEGIN "
+    "UPDATE authors SET track_count = track_count - 1, total_duration = total_duration - COALESCE(old.duration, 0) "
+    "WHERE id = old.author_id; "
+    "UPDATE authors SET track_count = track_count + 1, total_duration = total_duration + COALESCE(new.duration, 0) "
+    "WHERE id = new.author_id; "
+    "UPDATE playlists SET total_duration = total_duration - COALESCE(old.duration, 0) + COALESCE(new.duration, 0) "
+    "WHERE id IN (SELECT playlist_id FROM playlisttracks WHERE track_id = new.id); END",
+
+    # Автори і плейлисти, з яких трек зникне разом з ним
+    "CREATE TRIGGER IF NOT EXISTS tracks_aggregates_bd BEFORE DELETE ON tracks BEGIN "
+    "UPDATE authors SET track_count = track_count - 1, total_duration = total_duration - COALESCE(old.duration, 0) "
+    "WHERE id = old.author_id; "
+    "UPDATE playlists SET track_count = track_count - 1, total_duration = total_duration - COALESCE(old.duration, 0) "
+    "WHERE id IN (SELECT playlist_id FROM playlisttracks WHERE track_id = old.id); END",
+
+    # Плейлисти
+    "CREATE TRIGGER IF NOT EXISTS playlisttracks_aggregates_ai AFTER INSERT ON playlisttracks BEGIN "
+    "UPDATE playlists SET track_count = track_count + 1, "
+    "total_duration = total_duration + COALESCE((SELECT duration FROM tracks WHERE id = new.track_id), 0) "
+    "WHERE id = new.playlist_id; END",
+
+    "CREATE TRIGGER IF NOT EXISTS playlisttracks_aggregates_ad AFTER DELETE ON playlisttracks BEGIN "
+    "UPDATE playlists SET track_count = track_count - 1, "
+    "total_duration = total_duration - COALESCE((SELECT duration FROM tracks WHERE id = old.track_id), 0) "
+    "WHERE id = old.playlist_id AND EXISTS (SELECT 1 FROM tracks WHERE id = old.track_id); END",
+
+    "CREATE TRIGGER IF NOT EXISTS playlisttracks_aggregates_au AFTER UPDATE OF playlist_id, track_id ON playlisttracks BEGIN "
+    "UPDATE playlists SET track_count = track_count - 1, "
+    "total_duration = total_duration - COALESCE((SELECT duration FROM tracks WHERE id = old.track_id), 0) "
+    "WHERE id = old.playlist_id; "
+    "UPDATE playlists SET track_count = track_count + 1, "
+    "total_duration = total_duration + COALESCE((SELECT duration FROM tracks WHERE id = new.track_id), 0) "
+    "WHERE id = new.playlist_id; END",
+]
+
+# Фактичні значення лічильників - по рядку на кожного автора / плейлист (LEFT JOIN - і для порожніх)
+_REPAIR = {
+    "authors": (
+        "SELECT authors.id AS id, COUNT(tracks.id) AS track_count, COALESCE(SUM(tracks.duration), 0) AS total_duration "
+        "FROM authors LEFT JOIN tracks ON tracks.author_id = authors.id GROUP BY authors.id"
+    ),
+    "playlists": (
+        "SELECT playlists.id AS id, COUNT(tracks.id) AS track_count, COALESCE(SUM(tracks.duration), 0) AS total_duration "
+        "FROM playlists LEFT JOIN playlisttracks ON playlisttracks.playlist_id = playlists.id "
+        "LEFT JOIN tracks ON tracks.id = playlisttracks.track_id GROUP BY playlists.id"
+    ),
+}
+
+#-----------------------------------------------------------------------------------------------#
+
+# Тригери видаляються разом з таблицею, тому міграція, яка перебудовує tracks або playlisttracks,
+# має викликати цю функцію ще раз (як і create_search_index).
+def create_aggregate_triggers(connection):
+    if connection.dialect.name != "sqlite":
+        return
+
+    for statement in _TRIGGERS:
+        connection.execute(text(statement))
+
+# Перераховує лічильники і виправляє ті, що розійшлися. Повертає {таблиця: виправлено рядків}.
+# bind - Session або Connection; commit - на викликачеві.
+def repair(bind) -> dict:
+    fixed = {}
+
+    for table, actual in _REPAIR.items():
+        result = bind.execute(text(
+            "UPDATE {t} SET track_count = actual.track_count, total_duration = actual.total_duration "
+            "FROM ({actual}) AS actual "
+            "WHERE {t}.id = actual.id "
+            "AND ({t}.track_count != actual.track_count OR {t}.total_duration != actual.total_duration)".format(t=table, actual=actual)
+        ))
+        fixed[table] = result.rowcount
+
+        if result.rowcount:
+            cache.invalidate_all(table)
+
+    return fixed
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    logging.basicConfig(level=logging.INFO)
+
+    with SessionLocal() as db:
+        fixed = repair(db)
+        db.commit()
+
+    print("Виправлено: %s" % ", ".join("%s - %d" % item for item in fixed.items()))
@@ -0,0 +1,89 @@
+# Асинхронні версії CRUD операцій для маршрутів.
+# Логіка запитів живе лише в crud.py - тут кожна функція виконується через AsyncSession.run_sync,
+# тобто той самий код працює поверх асинхронного з'єднання (aiosqlite) і не блокує event loop.
+# Скрипти та міграції й надалі можуть викликати crud.py напряму зі звичайною Session.
+
+import crud
+import search
+
+from functools import wraps
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+def _run_sync(func):
+    @wraps(func)
+    async def wrapper(db: AsyncSession, *args, **kwargs):
+        return await db.run_sync(func, *args, **kwargs)
+
+    return wrapper
+
+#-----------------------------------------------------------------------------------------------#
+
+get_authors = _run_sync(crud.get_authors)
+get_author_by_id = _run_sync(crud.get_author_by_id)
+get_author_cached = _run_sync(crud.get_author_cached)
+get_author_by_name = _run_sync(crud.get_author_by_name)
+create_author = _run_sync(crud.create_author)
+update_author = _run_sync(crud.update_author)
+delete_author = _run_sync(crud.delete_author)
+
+#-----------------------------------------------------------------------------------------------#
+
+get_tracks = _run_sync(crud.get_tracks)
+get_track = _run_sync(crud.get_track)
+get_track_cached = _run_sync(crud.get_track_cached)
+get_track_by_name = _run_sync(crud.get_track_by_name)
+get_tracks_by_author = _run_sync(crud.get_tracks_by_author)
+get_tracks_by_ids = _run_sync(crud.get_tracks_by_ids)
+create_track = _run_sync(crud.create_track)
+update_track = _run_sync(crud.update_track)
+delete_track = _run_sync(crud.delete_track)
+
+#-----------------------------------------------------------------------------------------------#
+
+get_users = _run_sync(crud.get_users)
+get_user = _run_sync(crud.get_user)
+get_user_cached = _run_sync(crud.get_user_cached)
+get_user_by_login = _run_sync(crud.get_user_by_login)
+create_user = _run_sync(crud.create_user)
+update_user = _run_sync(crud.update_user)
+delete_user = _run_sync(crud.delete_user)
+
+#-----------------------------------------------------------------------------------------------#
+
+get_playlists = _run_sync(crud.get_playlists)
+get_playlist = _run_sync(crud.get_playlist)
+get_playlist_cached = _run_sync(crud.get_playlist_cached)
+get_user_playlists = _run_sync(crud.get_user_playlists)
+get_playlist_tracks = _run_sync(crud.get_playlist_tracks)
+get_playlist_detail = _run_sync(crud.get_playlist_detail)
+create_playlist = _run_sync(crud.create_playlist)
+update_playlist = _run_sync(crud.update_playlist)
+delete_playlist = _run_sync(crud.delete_playlist)
+
+#-----------------------------------------------------------------------------------------------#
+
+add_track_to_playlist = _run_sync(crud.add_track_to_playlist)
+remove_track_from_playlist = _run_sync(crud.remove_track_from_playlist)
+remove_from_playlist = _run_sync(crud.remove_from_playlist)
+apply_playlist_ops = _run_sync(crud.apply_playlist_ops)
+
+#-----------------------------------------------------------------------------------------------#
+
+bulk_create_authors = _run_sync(crud.bulk_create_authors)
+bulk_create_tracks = _run_sync(crud.bulk_create_tracks)
+
+#-----------------------------------------------------------------------------------------------#
+
+create_upload = _run_sync(crud.create_upload)
+get_upload = _run_sync(crud.get_upload)
+delete_upload = _run_sync(crud.delete_upload)
+create_track_from_upload = _run_sync(crud.create_track_from_upload)
+
+#-----------------------------------------------------------------------------------------------#
+
+record_plays = _run_sync(crud.record_plays)
+
+#-----------------------------------------------------------------------------------------------#
+
+search_catalog = _run_sync(search.search)
@@ -0,0 +1,344 @@
+# Метадані аудіофайлів треків: тривалість, бітрейт, частота дискретизації і хеш вмісту.
+# Файл не декодується - читаються лише заголовки (MP3: перший фрейм + Xing/Info або VBRI,
+# WAV: чанки fmt/data, FLAC: блок STREAMINFO). Файл відкривається через mmap, тому з диска
+# реально читаються лише ті сторінки, до яких звертається розбір, і хешування (sha256).
+# Для масового імпорту розбір виконується в пулі процесів, щоб не займати event loop.
+#
+# Заповнити метадані для вже доданих треків: python audio_meta.py
+
+import os
+import asyncio
+import hashlib
+import mmap
+import struct
+import threading
+
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import select, update
+
+import models
+
+from streaming import track_file_path
+
+AUDIO_META_WORKERS = int(os.getenv("AUDIO_META_WORKERS", min(4, os.cpu_count() or 1)))
+
+# Скільки байт від початку файлу шукати перший MP3 фрейм (після ID3v2)
+MP3_SYNC_SEARCH = 64 * 1024
+
+#-----------------------------------------------------------------------------------------------#
+
+# MPEG аудіо. Індекси: версія 3 = MPEG1, 2 = MPEG2, 0 = MPEG2.5; шар 3 = I, 2 = II, 1 = III
+_MP3_BITRATES = {
+    (3, 3): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (3, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (3, 1): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 3): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 1): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MP3_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+def _mp3_frame_header(data, offset: int):
+    if offset + 4 > len(data):
+        return None
+
+    b0, b1, b2, b3 = data[offset], data[offset + 1], data[offset + 2], data[offset + 3]
+
+    if b0 != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+
+    version = (b1 >> 3) & 3
+    layer = (b1 >> 1) & 3
+    bitrate_index = b2 >> 4
+    rate_index = (b2 >> 2) & 3
+
+    if version == 1 or layer == 0 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+
+    bitrate = _MP3_BITRATES[(3 if version == 3 else 2, layer)][bitrate_index] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+    padding = (b2 >> 1) & 1
+
+    if layer == 3:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 576 if layer == 1 and version != 3 else 1152
+        length = samples // 8 * bitrate // sample_rate + padding
+
+    return {
+        "version": version,
+        "layer": layer,
+        "mono": (b3 >> 6) == 3,
+        "bitrate": bitrate,
+        "sample_rate": sample_rate,
+        "samples": samples,
+        "length": length,
+    }
+
+def _id3v2_size(data) -> int:
+    if data[:3] != b"ID3" or len(data) < 10:
+        return 0
+
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    footer = 10 if data[5] & 0x10 else 0
+
+    return 10 + size + footer
+
+# Перший справжній фрейм: за ним має йти ще один фрейм, інакше це випадковий 0xFF в даних
+def _find_mp3_frame(data, start: int):
+    end = min(len(data), start + MP3_SYNC_SEARCH)
+    offset = start
+
+    while offset < end:
+        offset = data.find(b"\xff", offset, end)
+
+        if offset < 0:
+            return None, None
+
+        frame = _mp3_frame_header(data, offset)
+
+        if frame is not None and (
+            offset + frame["length"] >= len(data)
+            or _mp3_frame_header(data, offset + frame["length"]) is not None
+        ):
+            return offset, frame
+
+        offset += 1
+
+    return None, None
+
+def _parse_mp3(data):
+    offset, frame = _find_mp3_frame(data, _id3v2_size(data))
+
+    if frame is None:
+        return None
+
+    audio_bytes = len(data) - offset
+
+    if len(data) >= 128 and data[-128:-125] == b"TAG":
+        audio_bytes -= 128
+
+    sample_rate = frame["sample_rate"]
+    frames = None
+    vbr_bytes = None
+
+    # Xing/Info - після side information першого фрейму
+    if frame["version"] == 3:
+        side_info = 17 if frame["mono"] else 32
+    else:
+        side_info = 9 if frame["mono"] else 17
+
+    xing = offset + 4 + side_info
+
+    if data[xing:xing + 4] in (b"Xing", b"Info"):
+        flags = struct.unpack(">I", data[xing + 4:xing + 8])[0]
+        position = xing + 8
+
+        if flags & 1:
+            frames = struct.unpack(">I", data[position:position + 4])[0]
+            position += 4
+
+        if flags & 2:
+            vbr_bytes = struct.unpack(">I", data[position:position + 4])[0]
+
+    # VBRI (Fraunhofer) - завжди через 32 байти після заголовка фрейму
+    elif data[offset + 36:offset + 40] == b"VBRI":
+        vbr_bytes, frames = struct.unpack(">II", data[offset + 46:offset + 54])
+
+    if frames:
+        duration = frames * frame["samples"] / sample_rate
+        bitrate = (vbr_bytes or audio_bytes) * 8 / duration if duration else frame["bitrate"]
+    else:
+        # CBR: усі фрейми однакового бітрейту
+        duration = audio_bytes * 8 / frame["bitrate"]
+        bitrate = frame["bitrate"]
+
+    return duration, bitrate, sample_rate
+
+#-----------------------------------------------------------------------------------------------#
+
+def _parse_wav(data):
+    if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        return None
+
+    offset = 12
+    byte_rate = sample_rate = data_size = None
+
+    while offset + 8 <= len(data):
+        chunk_id = data[offset:offset + 4]
+        chunk_size = struct.unpack("<I", data[offset + 4:offset + 8])[0]
+
+        if chunk_id == b"fmt ":
+            sample_rate, byte_rate = struct.unpack("<II", data[offset + 12:offset + 20])
+        elif chunk_id == b"data":
+            data_size = min(chunk_size, len(data) - offset - 8)
+            break
+
+        # Чанки вирівняні на 2 байти
+        offset += 8 + chunk_size + (chunk_size & 1)
+
+    if not byte_rate or data_size is None:
+        return None
+
+    return data_size / byte_rate, byte_rate * 8, sample_rate
+
+def _parse_flac(data):
+    offset = _id3v2_size(data)
+
+    if data[offset:offset + 4] != b"fLaC":
+        return None
+
+    # Перший блок метаданих завжди STREAMINFO (тип 0, 34 байти)
+    block = offset + 4
+
+    if data[block] & 0x7F != 0:
+        return None
+
+    info = data[block + 4:block + 4 + 34]
+    packed = int.from_bytes(info[10:18], "big")
+    sample_rate = packed >> 44
+    total_samples = packed & 0xFFFFFFFFF
+
+    if not sample_rate or not total_samples:
+        return None
+
+    # Кінець метаданих - біт "останній блок"
+    position = block
+
+    while position + 4 <= len(data):
+        last = data[position] & 0x80
+        position += 4 + int.from_bytes(data[position + 1:position + 4], "big")
+
+        if last:
+            break
+
+    duration = total_samples / sample_rate
+    return duration, (len(data) - position) * 8 / duration, sample_rate
+
+#-----------------------------------------------------------------------------------------------#
+
+# Тривалість (секунди), бітрейт (кбіт/с), частота (Гц) і sha256 вмісту.
+# None - якщо файл порожній або формат не розпізнано.
+def probe(path: str):
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return None
+
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:4] == b"RIFF":
+                parsed = _parse_wav(data)
+            elif data[:4] == b"fLaC" or (data[:3] == b"ID3" and data[_id3v2_size(data):_id3v2_size(data) + 4] == b"fLaC"):
+                parsed = _parse_flac(data)
+            else:
+                parsed = _parse_mp3(data)
+
+            if parsed is None:
+                return None
+
+            duration, bitrate, sample_rate = parsed
+
+            return {
+                "duration": round(duration),
+                "bitrate": round(bitrate / 1000),
+                "sample_rate": sample_rate,
+                "content_hash": hashlib.sha256(data).hexdigest(),
+            }
+
+# Те саме, але пошкоджений або недоступний файл - теж None, а не виняток
+def probe_file(path: str):
+    try:
+        return probe(path)
+    except (OSError, ValueError, struct.error, IndexError):
+        return None
+
+# Те саме за file_name треку (відносно static/tracks). None - якщо файлу немає.
+def probe_track_file(file_name: str):
+    path = track_file_path(file_name)
+
+    if path is None:
+        return None
+
+    return probe_file(path)
+
+# sha256 файлу будь-якого формату
+def file_sha256(path: str) -> str:
+    with open(path, "rb") as file:
+        return hashlib.file_digest(file, "sha256").hexdigest()
+
+#-----------------------------------------------------------------------------------------------#
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=AUDIO_META_WORKERS)
+
+        return _executor
+
+def shutdown_pool():
+    global _executor
+
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+# Виконує func в пулі процесів для роботи з аудіофайлами (також використовується в peaks.py)
+async def run_in_pool(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), func, *args)
+
+async def probe_file_async(path: str):
+    return await run_in_pool(probe_file, path)
+
+async def file_sha256_async(path: str) -> str:
+    return await run_in_pool(file_sha256, path)
+
+async def probe_track_file_async(file_name: str):
+    return await run_in_pool(probe_track_file, file_name)
+
+# Метадані для пачки файлів - паралельно на всіх процесах пулу, у тому ж порядку
+async def probe_track_files_async(file_names: list) -> list:
+    return await asyncio.gather(*(run_in_pool(probe_track_file, file_name) for file_name in file_names))
+
+#-----------------------------------------------------------------------------------------------#
+
+# Заповнює метадані трекам, у яких їх ще немає (наприклад, доданим до появи цього модуля)
+def backfill(db, batch_size: int = 500):
+    updated = 0
+    last_id = 0
+
+    with ProcessPoolExecutor(max_workers=AUDIO_META_WORKERS) as executor:
+        while True:
+            rows = db.execute(
+                select(models.Track.id, models.Track.file_name)
+                .where(models.Track.content_hash.is_(None), models.Track.id > last_id)
+                .order_by(models.Track.id)
+                .limit(batch_size)
+            ).all()
+
+            if not rows:
+                break
+
+            last_id = rows[-1].id
+
+            for row, meta in zip(rows, executor.map(probe_track_file, [row.file_name for row in rows])):
+                if meta is not None:
+                    db.execute(update(models.Track).where(models.Track.id == row.id).values(**meta))
+                    updated += 1
+
+            db.commit()
+
+    return updated
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    with SessionLocal() as db:
+        print("Оновлено треків: %d" % backfill(db))
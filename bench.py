@@ -0,0 +1,267 @@
+# Навантажувальний бенчмарк маршрутів. Створює тимчасову БД, наповнює її синтетичним каталогом
+# (автори, треки, користувачі, плейлисти) через crud.py і проганяє запити до застосунку прямо в
+# процесі (httpx + ASGITransport, без мережі). Для кожного маршруту і розміру каталогу рахуються
+# пропускна здатність і затримки p50/p95/p99. Результат - JSON, який можна порівняти з попереднім
+# запуском, щоб побачити регресію до того, як зміна потрапить у продакшн.
+#
+#   python bench.py                                   # розміри 1000 і 10000 треків
+#   python bench.py --sizes 1000,10000,100000 --requests 500 --concurrency 20 --output new.json
+#   python bench.py --compare old.json --output new.json
+#
+# Каталог не перестворюється між розмірами, а дорощується до наступного розміру.
+
+# pip install httpx
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import sqlite3
+import statistics
+import tempfile
+
+#-----------------------------------------------------------------------------------------------#
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Бенчмарк маршрутів")
+    parser.add_argument("--sizes", default="1000,10000", help="кількість треків у каталозі, через кому")
+    parser.add_argument("--requests", type=int, default=200, help="запитів на кожен маршрут")
+    parser.add_argument("--login-requests", type=int, default=20, help="запитів на /login (bcrypt повільний)")
+    parser.add_argument("--concurrency", type=int, default=10, help="одночасних запитів")
+    parser.add_argument("--seed", type=int, default=1, help="seed генератора випадкових даних")
+    parser.add_argument("--output", help="записати результат у файл (інакше - в stdout)")
+    parser.add_argument("--compare", help="попередній результат для порівняння")
+    return parser.parse_args()
+
+def percentile(sorted_values: list, p: float) -> float:
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+
+    return statistics.quantiles(sorted_values, n=100, method="inclusive")[int(p) - 1]
+
+#-----------------------------------------------------------------------------------------------#
+
+# Співвідношення сутностей у каталозі на N треків
+AUTHORS_PER_TRACK = 0.1
+USERS_PER_TRACK = 0.01
+PLAYLISTS_PER_TRACK = 0.05
+TRACKS_PER_PLAYLIST = 20
+
+BENCH_PASSWORD = "bench-password"
+
+class Catalog:
+    def __init__(self, seed: int):
+        self.random = random.Random(seed)
+        self.authors = []
+        self.tracks = []
+        self.users = []
+        self.playlists = []
+
+    # Дорощує каталог до size треків (і пропорційної кількості решти сутностей)
+    def grow(self, db, size: int):
+        import crud
+        import schemas
+
+        from hashing import hash_password
+
+        authors = max(1, int(size * AUTHORS_PER_TRACK))
+        rows = [schemas.AuthorCreate(nickname="author %d" % i) for i in range(len(self.authors), authors)]
+
+        for start in range(0, len(rows), crud.BULK_CHUNK_SIZE):
+            for result in crud.bulk_create_authors(db, rows[start:start + crud.BULK_CHUNK_SIZE]):
+                self.authors.append(result["id"])
+
+        rows = [
+            schemas.TrackCreate(
+                name="track %d" % i,
+                duration=self.random.randint(60, 600),
+                author_id=self.random.choice(self.authors),
+                file_name="track_%d.mp3" % i,
+            )
+            for i in range(len(self.tracks), size)
+        ]
+
+        for start in range(0, len(rows), crud.BULK_CHUNK_SIZE):
+            for result in crud.bulk_create_tracks(db, rows[start:start + crud.BULK_CHUNK_SIZE]):
+                self.tracks.append(result["id"])
+
+        # Один хеш на всіх - bcrypt тут лише сповільнив би наповнення
+        password = hash_password(BENCH_PASSWORD)
+
+        for i in range(len(self.users), max(1, int(size * USERS_PER_TRACK))):
+            self.users.append(crud.create_user(db, schemas.UserCreate(login="user %d" % i, password=password)).id)
+
+        for i in range(len(self.playlists), max(1, int(size * PLAYLISTS_PER_TRACK))):
+            playlist = crud.create_playlist(db, schemas.PlayListCreate(name="playlist %d" % i, user_id=self.random.choice(self.users)))
+            track_ids = self.random.sample(self.tracks, min(TRACKS_PER_PLAYLIST, len(self.tracks)))
+            crud.apply_playlist_ops(db, playlist.id, [schemas.PlaylistTrackOp(op="add", track_id=track_id) for track_id in track_ids])
+            self.playlists.append(playlist.id)
+
+#-----------------------------------------------------------------------------------------------#
+
+# Сценарії: назва -> функція, яка повертає параметри наступного запиту.
+# Записи створюють унікальні імена, тому їх можна повторювати скільки завгодно.
+def scenarios(catalog: Catalog, token: str, run_id: str):
+    rnd = catalog.random
+    auth = {"Authorization": "Bearer " + token}
+    counter = iter(range(10 ** 9))
+
+    return {
+        "GET /get_tracks": lambda: ("GET", "/get_tracks", {"params": {"limit": 100}}),
+        "GET /get_track/{id}": lambda: ("GET", "/get_track/%d" % rnd.choice(catalog.tracks), {}),
+        "GET /get_authors": lambda: ("GET", "/get_authors", {"params": {"limit": 100}}),
+        "GET /get_tracks_by_author/{id}": lambda: ("GET", "/get_tracks_by_author/%d" % rnd.choice(catalog.authors), {}),
+        "GET /get_playlist/{id}": lambda: ("GET", "/get_playlist/%d" % rnd.choice(catalog.playlists), {}),
+        "GET /get_playlist_detail/{id}": lambda: ("GET", "/get_playlist_detail/%d" % rnd.choice(catalog.playlists), {}),
+        "GET /tracks/{id}/related": lambda: ("GET", "/tracks/%d/related" % rnd.choice(catalog.tracks), {}),
+        "GET /search": lambda: ("GET", "/search", {"params": {"q": "track %d" % rnd.randrange(len(catalog.tracks))}}),
+        "POST /add_author": lambda: ("POST", "/add_author", {"json": {"nickname": "bench %s %d" % (run_id, next(counter))}, "headers": auth}),
+        "POST /add_track": lambda: ("POST", "/add_track", {
+            "json": {"name": "bench %s %d" % (run_id, next(counter)), "duration": 180, "author_id": rnd.choice(catalog.authors), "file_name": "bench.mp3"},
+            "headers": auth,
+        }),
+        "PATCH /update_track/{id}": lambda: ("PATCH", "/update_track/%d" % rnd.choice(catalog.tracks), {"json": {"duration": rnd.randint(60, 600)}, "headers": auth}),
+        "POST /edit_playlist_tracks/{id}": lambda: ("POST", "/edit_playlist_tracks/%d" % rnd.choice(catalog.playlists), {
+            "json": [{"op": "add", "track_id": rnd.choice(catalog.tracks)}],
+            "headers": auth,
+        }),
+        "POST /login": lambda: ("POST", "/login", {"data": {"username": "user 0", "password": BENCH_PASSWORD}}),
+    }
+
+async def run_scenario(client, make_request, count: int, concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    remaining = iter(range(count))
+
+    async def worker():
+        nonlocal errors
+
+        for _ in remaining:
+            method, url, kwargs = make_request()
+            start = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - start)
+
+            # 400 на edit_playlist_tracks - трек вже в плейлисті, це теж повноцінний запит
+            if response.status_code >= 500:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+
+    return {
+        "requests": count,
+        "errors": errors,
+        "throughput_rps": round(count / elapsed, 1),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3),
+    }
+
+#-----------------------------------------------------------------------------------------------#
+
+async def run(args) -> dict:
+    import httpx
+
+    import cache
+    import related
+
+    from main import app
+    from database import SessionLocal
+
+    catalog = Catalog(args.seed)
+    results = []
+    run_id = "%x" % time.time_ns()
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        for size in [int(size) for size in args.sizes.split(",")]:
+            start = time.perf_counter()
+
+            with SessionLocal() as db:
+                catalog.grow(db, size)
+                related.build(db)
+
+            print("Каталог %d треків: %.1f с" % (size, time.perf_counter() - start), file=sys.stderr)
+
+            for name in ("authors", "tracks", "users", "playlists"):
+                cache.invalidate_all(name)
+
+            response = await client.post("/login", data={"username": "user 0", "password": BENCH_PASSWORD})
+            token = response.json()["access_token"]
+
+            for name, make_request in scenarios(catalog, token, run_id).items():
+                count = args.login_requests if name == "POST /login" else args.requests
+                result = await run_scenario(client, make_request, count, args.concurrency)
+                results.append({"size": size, "endpoint": name, **result})
+                print("  %-36s p50 %8.2f мс  p99 %8.2f мс  %8.1f зап/с" % (name, result["p50_ms"], result["p99_ms"], result["throughput_rps"]), file=sys.stderr)
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+# Зміна у відсотках відносно попереднього запуску для кожного (розмір, маршрут)
+def compare(old: dict, new: dict) -> list:
+    previous = {(row["size"], row["endpoint"]): row for row in old["results"]}
+    changes = []
+
+    for row in new["results"]:
+        before = previous.get((row["size"], row["endpoint"]))
+
+        if before is None:
+            continue
+
+        changes.append({
+            "size": row["size"],
+            "endpoint": row["endpoint"],
+            **{
+                key + "_change_pct": round((row[key] - before[key]) / before[key] * 100, 1) if before[key] else None
+                for key in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps")
+            },
+        })
+
+    return changes
+
+def main():
+    args = parse_args()
+
+    # БД бенчмарку - тимчасовий файл; змінна середовища має бути задана до імпорту database.py
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(workdir, "bench.db")
+    os.environ.setdefault("PEAKS_DIR", os.path.join(workdir, "peaks"))
+    os.environ.setdefault("UPLOADS_DIR", os.path.join(workdir, "uploads"))
+    os.environ.setdefault("RELATED_DIR", os.path.join(workdir, "related"))
+
+    report = asyncio.run(run(args))
+
+    if args.compare:
+        with open(args.compare) as file:
+            report["comparison"] = compare(json.load(file), report)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
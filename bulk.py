@@ -0,0 +1,102 @@
+# Розбір тіла запиту для масового імпорту (/bulk/authors, /bulk/tracks).
+# Підтримується звичайний JSON масив або NDJSON (один JSON об'єкт на рядок, Content-Type:
+# application/x-ndjson). NDJSON читається потоком, тому навіть дуже великий імпорт
+# не потрапляє в пам'ять цілком - у пам'яті лише одна пачка з BULK_CHUNK_SIZE рядків.
+
+import json
+
+from fastapi import HTTPException, Request
+from pydantic import ValidationError
+
+from crud import BULK_CHUNK_SIZE
+
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonlines")
+
+def _error_message(error: ValidationError) -> str:
+    first = error.errors()[0]
+    return "%s: %s" % (".".join(str(part) for part in first["loc"]) or "row", first["msg"])
+
+async def _ndjson_lines(request: Request):
+    buffer = b""
+
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+
+        for line in lines:
+            if line.strip():
+                yield line
+
+    if buffer.strip():
+        yield buffer
+
+# Повертає пари (номер рядка, схема) або (номер рядка, текст помилки)
+async def iter_rows(request: Request, schema):
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+
+    if content_type in NDJSON_TYPES:
+        index = 0
+
+        async for line in _ndjson_lines(request):
+            try:
+                yield index, schema.model_validate_json(line)
+            except ValidationError as e:
+                yield index, _error_message(e)
+
+            index += 1
+        return
+
+    try:
+        items = json.loads(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Тіло запиту має бути JSON масивом або NDJSON")
+
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Тіло запиту має бути JSON масивом або NDJSON")
+
+    for index, item in enumerate(items):
+        try:
+            yield index, schema.model_validate(item)
+        except ValidationError as e:
+            yield index, _error_message(e)
+
+# Читає рядки, ділить їх на пачки і передає кожну пачку в import_chunk (async_crud.bulk_create_*).
+# Кожна пачка - окрема транзакція, тому вже імпортовані пачки не відкочуються при помилці в наступній.
+async def run_import(request: Request, schema, import_chunk, db):
+    results = []
+    chunk = []
+    chunk_indexes = []
+
+    async def flush():
+        if not chunk:
+            return
+
+        for index, result in zip(chunk_indexes, await import_chunk(db, list(chunk))):
+            results.append({"index": index, **result})
+
+        chunk.clear()
+        chunk_indexes.clear()
+
+    async for index, row in iter_rows(request, schema):
+        if isinstance(row, str):
+            results.append({"index": index, "status": "invalid", "detail": row})
+            continue
+
+        chunk.append(row)
+        chunk_indexes.append(index)
+
+        if len(chunk) >= BULK_CHUNK_SIZE:
+            await flush()
+
+    await flush()
+    results.sort(key=lambda result: result["index"])
+
+    created = sum(1 for result in results if result["status"] == "created")
+    skipped = sum(1 for result in results if result["status"] in ("exists", "duplicate"))
+
+    return {
+        "created": created,
+        "skipped": skipped,
+        "failed": len(results) - created - skipped,
+        "results": results,
+    }
@@ -0,0 +1,267 @@
+# Кеш сутностей, які часто читаються і рідко змінюються (автори, треки, плейлисти, користувачі).
+# Кеш стоїть перед читанням з БД у crud.py (read-through): при влучанні повертається готова схема
+# з пам'яті без запиту в БД і без ORM, при промаху - дані читаються з БД і кладуться в кеш.
+# Функції create/update/delete у crud.py видаляють відповідні записи з кешу.
+# Кеш живе в пам'яті одного процесу, тому TTL обмежує, наскільки застарілими можуть бути дані
+# в інших воркерах. Для спільного кешу (наприклад Redis) достатньо написати свій CacheBackend
+# і передати його фабрику в use_backend().
+
+import os
+import time
+import threading
+
+from collections import OrderedDict
+
+CACHE_TTL = float(os.getenv("CACHE_TTL", 60))              # секунд
+CACHE_MAXSIZE = int(os.getenv("CACHE_MAXSIZE", 10000))     # записів в кожному кеші
+
+MISSING = object()
+
+#-----------------------------------------------------------------------------------------------#
+
+# Інтерфейс сховища кешу
+class CacheBackend:
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        raise NotImplementedError
+
+# Кеш в пам'яті процесу: LRU (найдавніше використаний запис витісняється першим) + TTL.
+class MemoryCache(CacheBackend):
+    def __init__(self, maxsize: int = CACHE_MAXSIZE, ttl: float = CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return MISSING
+
+            expires, value = entry
+
+            if expires < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return MISSING
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+#-----------------------------------------------------------------------------------------------#
+
+_backend_factory = MemoryCache
+_caches = {}
+_caches_lock = threading.Lock()
+
+# Замінює сховище для всіх кешів. Вже накопичені дані відкидаються.
+def use_backend(factory):
+    global _backend_factory
+
+    with _caches_lock:
+        _backend_factory = factory
+        _caches.clear()
+
+def get_cache(name: str) -> CacheBackend:
+    cache = _caches.get(name)
+
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.setdefault(name, _backend_factory())
+
+    return cache
+
+# Покоління записів: змінюється при кожному invalidate, щоб read_through не поклав у кеш
+# дані, прочитані з БД до оновлення, яке встигло завершитися, поки loader() ще працював.
+# Для всього кешу - лічильник, для окремого ключа - лише поки для нього працює хоча б один
+# loader(): тоді словник не більший за кількість одночасних промахів.
+_generations = {}
+_key_generations = {}
+_loading = {}
+_generations_lock = threading.Lock()
+
+def _start_load(name: str, key):
+    with _generations_lock:
+        _loading[(name, key)] = _loading.get((name, key), 0) + 1
+        return _generations.get(name, 0), _key_generations.get((name, key), 0)
+
+# Кладе результат у кеш, якщо покоління не змінилося з початку завантаження.
+# Під замком: invalidate або вже змінив покоління, або видалить цей запис після нас.
+def _finish_load(name: str, key, generation, cache, data):
+    item = (name, key)
+
+    with _generations_lock:
+        if data is not None and (_generations.get(name, 0), _key_generations.get(item, 0)) == generation:
+            cache.set(key, data)
+
+        _loading[item] -= 1
+
+        if not _loading[item]:
+            del _loading[item]
+            _key_generations.pop(item, None)
+
+def invalidate(name: str, key):
+    with _generations_lock:
+        if (name, key) in _loading:
+            _key_generations[(name, key)] = _key_generations.get((name, key), 0) + 1
+
+    get_cache(name).delete(key)
+
+def invalidate_all(name: str):
+    with _generations_lock:
+        _generations[name] = _generations.get(name, 0) + 1
+
+    get_cache(name).clear()
+
+def stats() -> dict:
+    result = {name: cache.stats() for name, cache in list(_caches.items())}
+    result["tokens"] = token_cache.stats()
+    return result
+
+# Читання через кеш. loader() дістає об'єкт з БД, schema - схема, в якій він зберігається.
+# У кеші лежить словник (model_dump), тому влучання не торкається ні БД, ні ORM.
+# None не кешується, щоб щойно створений запис одразу став видимим.
+# Якщо під час loader() запис інвалідували, результат повертається, але в кеш не кладеться.
+def read_through(name: str, key, loader, schema):
+    cache = get_cache(name)
+    data = cache.get(key)
+
+    if data is not MISSING:
+        return schema.model_construct(**data)
+
+    generation = _start_load(name, key)
+    result = None
+
+    try:
+        obj = loader()
+
+        if obj is not None:
+            result = schema.model_validate(obj)
+    finally:
+        _finish_load(name, key, generation, cache, result.model_dump() if result is not None else None)
+
+    return result
+
+#-----------------------------------------------------------------------------------------------#
+
+TOKEN_CACHE_MAXSIZE = int(os.getenv("TOKEN_CACHE_MAXSIZE", 10000))
+
+# Кеш перевірених токенів для get_current_user.
+# Для кожного токена зберігається його payload і короткий знімок користувача до моменту,
+# коли токен протухає (exp), тому захищений запит не перевіряє підпис і не робить SELECT щоразу.
+# Записи також індексуються за id користувача, щоб update_user/delete_user могли їх скинути.
+class TokenCache:
+    def __init__(self, maxsize: int = TOKEN_CACHE_MAXSIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._by_user = {}
+        self._lock = threading.Lock()
+
+    def get(self, token: str):
+        with self._lock:
+            entry = self._data.get(token)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if entry[0] <= time.time():
+                self._remove(token)
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(token)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def set(self, token: str, payload: dict, user):
+        expires = payload.get("exp")
+
+        if expires is None:
+            return
+
+        with self._lock:
+            self._remove(token)
+            self._data[token] = (float(expires), payload, user)
+            self._by_user.setdefault(user.id, set()).add(token)
+
+            while len(self._data) > self.maxsize:
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for token in list(self._by_user.get(user_id, ())):
+                self._remove(token)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._by_user.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def _remove(self, token: str):
+        entry = self._data.pop(token, None)
+
+        if entry is None:
+            return
+
+        tokens = self._by_user.get(entry[2].id)
+
+        if tokens is not None:
+            tokens.discard(token)
+
+            if not tokens:
+                del self._by_user[entry[2].id]
+
+token_cache = TokenCache()
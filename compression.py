@@ -0,0 +1,402 @@
+# Стиснення відповідей (gzip / brotli) і попередньо стиснені статичні файли.
+#
+# CompressionMiddleware стискає відповіді з текстовими типами (JSON, NDJSON, HTML, CSS, JS, SVG),
+# якщо клієнт підтримує стиснення (Accept-Encoding) і тіло не менше COMPRESSION_MIN_SIZE байт.
+# Списки треків і плейлистів - дуже повторюваний JSON, тому вони стискаються в рази.
+# Не стискаються: аудіо і взагалі бінарні типи, відповіді на Range (206 / Content-Range),
+# відповіді, які вже стиснені (Content-Encoding - наприклад /export з власним gzip), і HEAD.
+# Потокові відповіді (без Content-Length) стискаються частинами: кожна частина одразу
+# відправляється клієнту, тому потік не затримується до кінця відповіді.
+#
+# ETag стисненої відповіді отримує суфікс -gz / -br - це вже інше представлення ресурсу.
+# Щоб If-None-Match з таким ETag і далі давав 304, суфікс прибирається із запиту до того,
+# як його побачить ETagMiddleware, тому CompressionMiddleware має бути зовнішнім шаром відносно неї.
+#
+# PrecompressedStaticFiles - StaticFiles, який віддає готові сусідні файли style.css.br /
+# style.css.gz замість стиснення на кожен запит. Вони створюються один раз (precompress_dir):
+# при запуску сервера або вручну - python compression.py [папка]
+
+# pip install brotli
+
+import os
+import gzip
+import zlib
+import logging
+import mimetypes
+import threading
+
+import anyio
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import StaticFiles, NotModifiedResponse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", 6))
+# Для стиснення на льоту - середня якість: вже краще за gzip і ненабагато повільніше
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", 4))
+# Більші тіла стискаються в окремому потоці, щоб не блокувати event loop
+COMPRESSION_THREAD_SIZE = int(os.getenv("COMPRESSION_THREAD_SIZE", 256 * 1024))
+COMPRESSION_TYPES = tuple(
+    value.strip() for value in os.getenv(
+        "COMPRESSION_TYPES",
+        "application/json,application/x-ndjson,application/javascript,application/xml,image/svg+xml,text/",
+    ).split(",") if value.strip()
+)
+# Розширення статичних файлів, для яких створюються .br / .gz (аудіо вже стиснене)
+PRECOMPRESS_EXTENSIONS = tuple(os.getenv("PRECOMPRESS_EXTENSIONS", ".css,.js,.html,.svg,.json,.txt,.map,.xml").split(","))
+
+# Порядок переваги, якщо клієнт підтримує кілька з однаковим q
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+ETAG_SUFFIXES = {"br": "-br", "gzip": "-gz"}
+FILE_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+_stats = {"responses": 0, "bytes_in": 0, "bytes_out": 0}
+_stats_lock = threading.Lock()
+
+#-----------------------------------------------------------------------------------------------#
+
+def _header(headers, name: bytes):
+    for key, value in headers:
+        if key.lower() == name:
+            return value.decode("latin-1")
+
+    return None
+
+# Кодування з Accept-Encoding (з урахуванням q) з тих, що підтримуються. None - без стиснення.
+def choose_encoding(accept_encoding: str, encodings: tuple = ENCODINGS):
+    weights = {}
+
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+
+        if name:
+            weights[name.strip().lower()] = q
+
+    best = None
+
+    for encoding in encodings:
+        q = weights.get(encoding, weights.get("*", 0.0))
+
+        if q > 0 and (best is None or q > best[1]):
+            best = (encoding, q)
+
+    return best[0] if best else None
+
+def _compressible(content_type: str) -> bool:
+    return content_type.split(";")[0].strip().lower().startswith(COMPRESSION_TYPES)
+
+def _add_etag_suffix(etag: str, suffix: str) -> str:
+    if not etag.endswith('"'):
+        return etag
+
+    return etag[:-1] + suffix + '"'
+
+# Лише суфікс поточного кодування: копія в іншому кодуванні клієнту зараз не підходить
+def _strip_etag_suffix(if_none_match: str, suffix: str) -> str:
+    tags = []
+
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+
+        if tag.endswith(suffix + '"'):
+            tag = tag[:-len(suffix) - 1] + '"'
+
+        tags.append(tag)
+
+    return ", ".join(tags)
+
+def _vary(headers) -> str:
+    vary = _header(headers, b"vary")
+
+    if vary is None:
+        return "Accept-Encoding"
+
+    if "accept-encoding" in vary.lower() or vary.strip() == "*":
+        return vary
+
+    return vary + ", Accept-Encoding"
+
+def _count(before: int, after: int):
+    with _stats_lock:
+        _stats["responses"] += 1
+        _stats["bytes_in"] += before
+        _stats["bytes_out"] += after
+
+def stats() -> dict:
+    with _stats_lock:
+        return dict(_stats)
+
+#-----------------------------------------------------------------------------------------------#
+
+# Потоковий компресор з однаковим інтерфейсом для gzip і brotli
+class _Compressor:
+    def __init__(self, encoding: str, quality: int = None):
+        self.encoding = encoding
+
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY if quality is None else quality)
+        else:
+            # wbits=31 - формат gzip (заголовок і контрольна сума), а не "голий" deflate
+            self._zlib = zlib.compressobj(COMPRESSION_GZIP_LEVEL if quality is None else quality, zlib.DEFLATED, 31)
+
+    # Стиснена частина, яку клієнт може розпакувати одразу, не чекаючи решти потоку
+    def chunk(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._brotli.process(data) + self._brotli.flush()
+
+        return self._zlib.compress(data) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        if self.encoding == "br":
+            return self._brotli.process(data) + self._brotli.finish()
+
+        return self._zlib.compress(data) + self._zlib.flush()
+
+def compress(data: bytes, encoding: str, quality: int = None) -> bytes:
+    return _Compressor(encoding, quality).finish(data)
+
+#-----------------------------------------------------------------------------------------------#
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(_header(scope["headers"], b"accept-encoding") or "")
+
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        suffix = ETAG_SUFFIXES[encoding]
+        if_none_match = _header(scope["headers"], b"if-none-match")
+
+        # Клієнт перевіряє збережену стиснену копію - ETagMiddleware порівнюватиме без суфікса
+        if if_none_match is not None:
+            headers = [(key, value) for key, value in scope["headers"] if key.lower() != b"if-none-match"]
+            headers.append((b"if-none-match", _strip_etag_suffix(if_none_match, suffix).encode("latin-1")))
+            scope = {**scope, "headers": headers}
+
+        start = None
+        compressor = None
+        passthrough = False
+        size_in = 0
+        size_out = 0
+
+        def compressed_headers(headers, content_length=None):
+            headers = [
+                (key, value) for key, value in headers
+                if key.lower() not in (b"content-length", b"vary", b"etag", b"accept-ranges")
+            ]
+            etag = _header(start.get("headers", []), b"etag")
+
+            if etag is not None:
+                headers.append((b"etag", _add_etag_suffix(etag, suffix).encode("latin-1")))
+
+            headers.append((b"content-encoding", encoding.encode("latin-1")))
+            headers.append((b"vary", _vary(start.get("headers", [])).encode("latin-1")))
+
+            if content_length is not None:
+                headers.append((b"content-length", str(content_length).encode("latin-1")))
+
+            return headers
+
+        async def send_wrapper(message):
+            nonlocal start, compressor, passthrough, size_in, size_out
+
+            if passthrough:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                headers = message.get("headers", [])
+                status = message["status"]
+                content_length = _header(headers, b"content-length")
+                cache_control = (_header(headers, b"cache-control") or "").lower()
+
+                # 304 на збережену стиснену копію - ETag такий, як у неї
+                if status == 304:
+                    etag = _header(headers, b"etag")
+
+                    if etag is not None and if_none_match is not None and suffix + '"' in if_none_match:
+                        headers = [(key, value) for key, value in headers if key.lower() != b"etag"]
+                        headers.append((b"etag", _add_etag_suffix(etag, suffix).encode("latin-1")))
+                        message = {**message, "headers": headers}
+
+                if (
+                    status < 200 or status in (204, 206, 304)
+                    or _header(headers, b"content-encoding") is not None
+                    or _header(headers, b"content-range") is not None
+                    or "no-transform" in cache_control
+                    or not _compressible(_header(headers, b"content-type") or "")
+                    or (content_length is not None and int(content_length) < self.minimum_size)
+                ):
+                    passthrough = True
+                    await send(message)
+                    return
+
+                start = message
+                return
+
+            # Інше тіло (наприклад http.response.pathsend у FileResponse) стиснути не можна -
+            # затриманий заголовок іде без змін, далі все як є
+            if message["type"] != "http.response.body":
+                passthrough = True
+
+                if start is not None and compressor is None:
+                    await send(start)
+
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            # Уся відповідь в одному повідомленні
+            if compressor is None and not more_body:
+                passthrough = True
+
+                if len(body) < self.minimum_size:
+                    await send(start)
+                    await send(message)
+                    return
+
+                if len(body) >= COMPRESSION_THREAD_SIZE:
+                    data = await anyio.to_thread.run_sync(compress, body, encoding)
+                else:
+                    data = compress(body, encoding)
+
+                _count(len(body), len(data))
+                await send({**start, "headers": compressed_headers(start.get("headers", []), len(data))})
+                await send({"type": "http.response.body", "body": data})
+                return
+
+            # Потокова відповідь
+            if compressor is None:
+                compressor = _Compressor(encoding)
+                await send({**start, "headers": compressed_headers(start.get("headers", []))})
+
+            data = compressor.chunk(body) if more_body else compressor.finish(body)
+            size_in += len(body)
+            size_out += len(data)
+
+            if not more_body:
+                _count(size_in, size_out)
+
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
+
+#-----------------------------------------------------------------------------------------------#
+
+# Для кожного текстового файлу в directory створює file.gz і file.br (найвища якість - це робиться
+# один раз), якщо їх ще немає або оригінал новіший. Файли, які від стиснення не меншають, пропускаються.
+# Повертає кількість створених файлів.
+def precompress_dir(directory: str) -> int:
+    created = 0
+
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if not name.endswith(PRECOMPRESS_EXTENSIONS):
+                continue
+
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+
+            if stat.st_size < COMPRESSION_MIN_SIZE:
+                continue
+
+            data = None
+
+            for encoding in ENCODINGS:
+                target = path + FILE_SUFFIXES[encoding]
+
+                if os.path.exists(target) and os.path.getmtime(target) >= stat.st_mtime:
+                    continue
+
+                if data is None:
+                    with open(path, "rb") as file:
+                        data = file.read()
+
+                packed = brotli.compress(data, quality=11) if encoding == "br" else gzip.compress(data, 9, mtime=0)
+
+                if len(packed) >= len(data):
+                    continue
+
+                temp = target + ".tmp"
+
+                # Папка лише для читання - не біда, файл віддаватиметься і стискатиметься як раніше
+                try:
+                    with open(temp, "wb") as file:
+                        file.write(packed)
+
+                    os.replace(temp, target)
+                except OSError as error:
+                    logger.warning("Не вдалося записати %s: %s", target, error)
+                    continue
+
+                created += 1
+
+    return created
+
+# StaticFiles, який віддає готовий file.br / file.gz, якщо клієнт його приймає і він не старший
+# за оригінал. Range запити отримують оригінал - діапазон рахується по нестисненому файлу.
+class PrecompressedStaticFiles(StaticFiles):
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200):
+        request_headers = Headers(scope=scope)
+
+        if status_code == 200 and "range" not in request_headers and str(full_path).endswith(PRECOMPRESS_EXTENSIONS):
+            encoding = choose_encoding(request_headers.get("accept-encoding", ""))
+
+            if encoding is not None:
+                sibling = str(full_path) + FILE_SUFFIXES[encoding]
+
+                try:
+                    sibling_stat = os.stat(sibling)
+                except OSError:
+                    sibling_stat = None
+
+                if sibling_stat is not None and sibling_stat.st_mtime >= stat_result.st_mtime:
+                    response = FileResponse(
+                        sibling,
+                        stat_result=sibling_stat,
+                        media_type=mimetypes.guess_type(str(full_path))[0] or "application/octet-stream",
+                        headers={"Content-Encoding": encoding, "Vary": "Accept-Encoding"},
+                    )
+
+                    if self.is_not_modified(response.headers, request_headers):
+                        return NotModifiedResponse(response.headers)
+
+                    return response
+
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        response.headers.setdefault("vary", "Accept-Encoding")
+        return response
+
+if __name__ == "__main__":
+    import sys
+
+    print("Створено стиснених файлів: %d" % precompress_dir(sys.argv[1] if len(sys.argv) > 1 else "static"))
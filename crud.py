@@ -3,213 +3,317 @@
 # CRUD - Create, Read, Update, Delete
 # Тобто функції для роботи із БД.
 
+import time
+
 import models
 import schemas
+import cache
+
+from sqlalchemy import select, insert, update, delete, func, bindparam
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import sqlite, postgresql
+from sqlalchemy.orm import Session, selectinload, joinedload
+from pagination import paginate, paginate_rows, DEFAULT_LIMIT
+
+#-----------------------------------------------------------------------------------------------#
+
+# Колонки моделі, які відповідають полям схеми відповіді, - у тому ж порядку.
+# Списки вибирають лише їх (без створення ORM об'єктів) і повертають словники.
+def _columns(model, schema) -> list:
+    return [getattr(model, name) for name in schema.model_fields]
+
+# Спільні функції запису. Кожна з них - один SQL запит + commit:
+# INSERT повертає id сам (без refresh), UPDATE/DELETE одразу повертають рядок через RETURNING,
+# тому не потрібен попередній SELECT. Сесії створюються з expire_on_commit=False,
+# отже після commit об'єкт можна віддати у відповідь без повторного читання з БД.
+
+# Порушення обмежень БД при записі. Маршрути перетворюють їх на 400 з поясненням.
+class AlreadyExists(Exception):
+    pass
+
+# Зовнішній ключ вказує на запис, якого немає (наприклад author_id неіснуючого автора)
+class MissingReference(Exception):
+    def __init__(self, column: str, value):
+        super().__init__("%s=%s" % (column, value))
+        self.column = column
+        self.value = value
+
+def _is_foreign_key_error(error: IntegrityError) -> bool:
+    code = getattr(error.orig, "sqlstate", None) or getattr(error.orig, "pgcode", None)
+    return code == "23503" or "foreign key" in str(error.orig).lower()
+
+def _is_unique_error(error: IntegrityError) -> bool:
+    code = getattr(error.orig, "sqlstate", None) or getattr(error.orig, "pgcode", None)
+    message = str(error.orig).lower()
+    return code == "23505" or "unique" in message or "duplicate" in message
+
+# Яке з переданих посилань вказує на неіснуючий запис. SQLite не називає колонку в помилці,
+# тому батьківські записи перевіряються вже після відкату - лише на шляху помилки.
+def _missing_reference(db: Session, model, values: dict):
+    for column in model.__table__.columns:
+        value = values.get(column.name)
+        
+        if value is None:
+            continue
+        
+        for foreign_key in column.foreign_keys:
+            if db.scalar(select(foreign_key.column).where(foreign_key.column == value)) is None:
+                return MissingReference(column.name, value)
+    
+    return None
+
+# Відкочує транзакцію і перетворює IntegrityError на AlreadyExists / MissingReference.
+# Інші порушення (NOT NULL тощо) прокидаються далі як є.
+def _raise_integrity_error(db: Session, model, values: dict, error: IntegrityError):
+    db.rollback()
+    
+    if _is_foreign_key_error(error):
+        missing = _missing_reference(db, model, values)
+        
+        if missing is not None:
+            raise missing from error
+    elif _is_unique_error(error):
+        raise AlreadyExists(str(error.orig)) from error
+    
+    raise error
+
+# AlreadyExists / MissingReference - якщо порушено унікальність або зовнішній ключ
+def _insert(db: Session, obj):
+    db.add(obj)
+    
+    try:
+        db.commit()
+    except IntegrityError as error:
+        _raise_integrity_error(db, type(obj), {column.name: getattr(obj, column.name) for column in obj.__table__.columns}, error)
+    
+    return obj
+
+# Часткове оновлення (PATCH): змінюються лише передані поля.
+# None - якщо запису немає; AlreadyExists / MissingReference - якщо нові значення порушують обмеження БД.
+def _update(db: Session, model, obj_id: int, data):
+    values = data.model_dump(exclude_unset=True, exclude_none=True)
+    
+    if not values:
+        return db.get(model, obj_id)
+    
+    statement = update(model).where(model.id == obj_id).values(**values).returning(model)
+    
+    try:
+        obj = db.scalars(statement).first()
+        db.commit()
+    except IntegrityError as error:
+        _raise_integrity_error(db, model, values, error)
+    
+    return obj
 
-from sqlalchemy.orm import Session
+def _delete(db: Session, model, obj_id: int):
+    obj = db.scalars(delete(model).where(model.id == obj_id).returning(model)).first()
+    db.commit()
+    
+    return obj
 
 #-----------------------------------------------------------------------------------------------#
 
-def get_authors(db: Session, limit: int = 100):
-    return db.query(models.Author).limit(limit).all()
+def get_authors(db: Session, limit: int = DEFAULT_LIMIT, after_id: int = None):
+    return paginate_rows(db, _columns(models.Author, schemas.Author), models.Author.id, limit, after_id)
 
 def get_author_by_id(db: Session, author_id: int):
     return db.query(models.Author).filter(models.Author.id == author_id).first()
 
+# Те саме, що get_author_by_id, але через кеш. Повертає schemas.Author, а не ORM об'єкт.
+def get_author_cached(db: Session, author_id: int):
+    return cache.read_through("authors", author_id, lambda: get_author_by_id(db, author_id), schemas.Author)
+
 def get_author_by_name(db: Session, nickname: str):
     return db.query(models.Author).filter(models.Author.nickname == nickname).first()
 
 def create_author(db: Session, author: schemas.AuthorCreate):
-    
-    if get_author_by_name(db, author.nickname):
-        return None
-    
-    db_author = models.Author(**author.model_dump())
-    db.add(db_author)
-    db.commit()
-    db.refresh(db_author)
-    
-    return db_author
+    return _insert(db, models.Author(**author.model_dump()))
 
 def update_author(db: Session, author_id: int, author: schemas.AuthorUpdate):
-    db_author = get_author_by_id(db, author_id)
-    
-    if db_author is None:
-        return None
-    
-    for k,v in author.model_dump().items():
-        setattr(db_author, k, v) # db_author.k = v
-        
-    db.commit()
-    db.refresh(db_author)
+    db_author = _update(db, models.Author, author_id, author)
+    cache.invalidate("authors", author_id)
     
     return db_author
 
 def delete_author(db: Session, author_id: int):
-    db_author = get_author_by_id(db, author_id)
+    db_author = _delete(db, models.Author, author_id)
     
     if db_author is None:
         return None
     
-    db.delete(db_author)
-    db.commit()
-        
+    cache.invalidate("authors", author_id)
+    # Треки автора видалені каскадом, тому їхні кешовані копії вже неактуальні,
+    # а в плейлистах, де вони були, змінилися лічильники
+    cache.invalidate_all("tracks")
+    cache.invalidate_all("playlists")
+    
     return db_author
 
 #-----------------------------------------------------------------------------------------------#
 
-def get_tracks(db: Session, limit: int = 100):
-    return db.query(models.Track).limit(limit).all()
+def get_tracks(db: Session, limit: int = DEFAULT_LIMIT, after_id: int = None):
+    return paginate_rows(db, _columns(models.Track, schemas.Track), models.Track.id, limit, after_id)
 
 def get_track(db: Session, track_id: int):
     return db.query(models.Track).filter(models.Track.id == track_id).first()
 
+def get_track_cached(db: Session, track_id: int):
+    return cache.read_through("tracks", track_id, lambda: get_track(db, track_id), schemas.Track)
+
 def get_track_by_name(db: Session, name: str):
     return db.query(models.Track).filter(models.Track.name == name).first()
 
-def get_tracks_by_author(db: Session, author_id: int):
-    return db.query(models.Track).filter(models.Track.author_id == author_id).all()
+def get_tracks_by_author(db: Session, author_id: int, limit: int = DEFAULT_LIMIT, after_id: int = None):
+    return paginate_rows(db, _columns(models.Track, schemas.Track), models.Track.id, limit, after_id, models.Track.author_id == author_id)
 
-def create_track(db: Session, track: schemas.TrackCreate):
-    db_track = models.Track(**track.model_dump())
+# Треки за списком id одним запитом - у тому ж порядку, без тих, яких вже немає
+def get_tracks_by_ids(db: Session, track_ids: list):
+    if not track_ids:
+        return []
     
-    if get_track_by_name(db, db_track.name):
-        return None
+    rows = db.execute(select(*_columns(models.Track, schemas.Track)).where(models.Track.id.in_(track_ids))).mappings()
+    found = {row["id"]: dict(row) for row in rows}
     
-    db.add(db_track)
-    db.commit()
-    db.refresh(db_track)
+    return [found[track_id] for track_id in track_ids if track_id in found]
+
+# meta - метадані файлу з audio_meta.probe_track_file; тривалість з файлу важливіша за передану
+def create_track(db: Session, track: schemas.TrackCreate, meta: dict = None):
+    db_track = _insert(db, models.Track(**{**track.model_dump(), **(meta or {})}))
+    # Лічильники автора змінив тригер (aggregates.py) - кешована копія застаріла
+    cache.invalidate("authors", track.author_id)
     
     return db_track
 
 def update_track(db: Session, track_id: int, track: schemas.TrackUpdate):
-    db_track = get_track(db, track_id)
-    
-    if db_track is None:
-        return None
+    db_track = _update(db, models.Track, track_id, track)
+    cache.invalidate("tracks", track_id)
     
-    for k, v in track.model_dump().items():
-        setattr(db_track, k, v)
-        
-    db.commit()
-    db.refresh(db_track)
+    # Старий автор і плейлисти з цим треком тут невідомі, тому кеш скидається повністю
+    if db_track is not None and track.model_fields_set & {"duration", "author_id"}:
+        cache.invalidate_all("authors")
+        cache.invalidate_all("playlists")
     
     return db_track
 
 def delete_track(db: Session, track_id: int):
-    db_track = get_track(db, track_id)
+    db_track = _delete(db, models.Track, track_id)
+    cache.invalidate("tracks", track_id)
     
-    if db_track is None:
-        return None
+    if db_track is not None:
+        cache.invalidate("authors", db_track.author_id)
+        cache.invalidate_all("playlists")
     
-    db.delete(db_track)
-    db.commit()
-        
     return db_track
 
 #-----------------------------------------------------------------------------------------------#
 
-def get_users(db: Session, limit: int = 100):
-    return db.query(models.User).limit(limit).all()
+def get_users(db: Session, limit: int = DEFAULT_LIMIT, after_id: int = None):
+    return paginate(db.query(models.User), models.User.id, limit, after_id)
 
 def get_user(db: Session, user_id: int):
     return db.query(models.User).filter(models.User.id == user_id).first()
 
+def get_user_cached(db: Session, user_id: int):
+    return cache.read_through("users", user_id, lambda: get_user(db, user_id), schemas.User)
+
 def get_user_by_login(db: Session, login: str):
     return db.query(models.User).filter(models.User.login == login).first()
 
 def create_user(db: Session, user: schemas.UserCreate):
-    db_user = models.User(**user.model_dump())
-    
-    if get_user_by_login(db, db_user.login):
-        return None
-    
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    
-    return db_user
+    return _insert(db, models.User(**user.model_dump()))
 
 def update_user(db: Session, user_id: int, user: schemas.UserUpdate):
-    db_user = get_user(db, user_id)
-    
-    if db_user is None:
-        return None
-    
-    for k, v in user.model_dump().items():
-        setattr(db_user, k, v)
-        
-    db.commit()
-    db.refresh(db_user)
+    db_user = _update(db, models.User, user_id, user)
+    cache.invalidate("users", user_id)
+    cache.token_cache.invalidate_user(user_id)
     
     return db_user
 
 def delete_user(db: Session, user_id: int):
-    db_user = get_user(db, user_id)
+    db_user = _delete(db, models.User, user_id)
     
     if db_user is None:
         return None
     
-    db.delete(db_user)
-    db.commit()
+    cache.invalidate("users", user_id)
+    cache.token_cache.invalidate_user(user_id)
+    # Плейлисти користувача видалені каскадом
+    cache.invalidate_all("playlists")
     
     return db_user
 
 #-----------------------------------------------------------------------------------------------#
 
-def get_playlists(db: Session, limit: int = 100):
-    return db.query(models.PlayList).limit(limit).all()
+def get_playlists(db: Session, limit: int = DEFAULT_LIMIT, after_id: int = None):
+    return paginate_rows(db, _columns(models.PlayList, schemas.PlayList), models.PlayList.id, limit, after_id)
 
 def get_playlist(db: Session, playlist_id: int):
     return db.query(models.PlayList).filter(models.PlayList.id == playlist_id).first()
 
-def get_user_playlists(db: Session, user_id: int, limit: int = 100):
-    return db.query(models.PlayList).filter(models.PlayList.user_id == user_id).limit(limit).all()
-
-def get_playlist_tracks(db: Session, playlist_id: int):
-    return db.query(models.PlaylistTrack).filter(models.PlaylistTrack.playlist_id == playlist_id).all()
-
-def create_playlist(db: Session, playlist: schemas.PlayListCreate):
-    db_user = get_user(db, playlist.user_id)
+def get_playlist_cached(db: Session, playlist_id: int):
+    return cache.read_through("playlists", playlist_id, lambda: get_playlist(db, playlist_id), schemas.PlayList)
+
+def get_user_playlists(db: Session, user_id: int, limit: int = DEFAULT_LIMIT, after_id: int = None):
+    return paginate_rows(db, _columns(models.PlayList, schemas.PlayList), models.PlayList.id, limit, after_id, models.PlayList.user_id == user_id)
+
+def get_playlist_tracks(db: Session, playlist_id: int, limit: int = DEFAULT_LIMIT, after_id: int = None):
+    columns = _columns(models.PlaylistTrack, schemas.PlaylistTrack)
+    return paginate_rows(db, columns, models.PlaylistTrack.id, limit, after_id, models.PlaylistTrack.playlist_id == playlist_id)
+
+# Плейлист з усіма треками і авторами за два запити: сам плейлист і один SELECT зв'язків,
+# до якого через JOIN підтягуються треки та їхні автори.
+def get_playlist_detail(db: Session, playlist_id: int):
+    db_playlist = (
+        db.query(models.PlayList)
+        .options(
+            selectinload(models.PlayList.playlisttracks_connection)
+            .joinedload(models.PlaylistTrack.track_connection)
+            .joinedload(models.Track.authors_connection)
+        )
+        .filter(models.PlayList.id == playlist_id)
+        .first()
+    )
     
-    if db_user is None:
+    if db_playlist is None:
         return None
     
-    db_playlist = models.PlayList(**playlist.model_dump())
+    tracks = []
     
-    db.add(db_playlist)
-    db.commit()
-    db.refresh(db_playlist)
+    for link in db_playlist.playlisttracks_connection:
+        db_track = link.track_connection
+        
+        if db_track is None:
+            continue
+        
+        tracks.append(schemas.PlaylistDetailTrack(
+            **schemas.Track.model_validate(db_track).model_dump(),
+            link_id=link.id,
+            author_nickname=db_track.authors_connection.nickname if db_track.authors_connection else None,
+        ))
     
-    return db_playlist
+    return schemas.PlaylistDetail(**schemas.PlayList.model_validate(db_playlist).model_dump(), tracks=tracks)
+
+def create_playlist(db: Session, playlist: schemas.PlayListCreate):
+    return _insert(db, models.PlayList(**playlist.model_dump()))
 
 def update_playlist(db: Session, playlist_id: int, playlist: schemas.PlayListUpdate):
-    db_playlist = get_playlist(db, playlist_id)
-    
-    if db_playlist is None:
-        return None
-    
-    for k, v in playlist.model_dump().items():
-        setattr(db_playlist, k, v)
-        
-    db.commit()
-    db.refresh(db_playlist)
+    db_playlist = _update(db, models.PlayList, playlist_id, playlist)
+    cache.invalidate("playlists", playlist_id)
     
     return db_playlist
 
 def delete_playlist(db: Session, playlist_id: int):
-    db_playlist = db.query(models.PlayList).filter(models.PlayList.id == playlist_id).first()
-    
-    if db_playlist is None:
-        return None
-    
-    db.delete(db_playlist)
-    db.commit()
+    db_playlist = _delete(db, models.PlayList, playlist_id)
+    cache.invalidate("playlists", playlist_id)
     
     return db_playlist
 
 #-----------------------------------------------------------------------------------------------#
 
+# Проміжок між позиціями сусідніх треків у плейлисті
+POSITION_GAP = 1024
+
 def add_track_to_playlist(db: Session, playlist_id: int, track_id: int):
     db_playlist = get_playlist(db, playlist_id)
     db_track = get_track(db, track_id)
@@ -220,10 +324,19 @@ def add_track_to_playlist(db: Session, playlist_id: int, track_id: int):
     if db_track is None:
         return None
     
-    db_link = models.PlaylistTrack(playlist_id=playlist_id, track_id=track_id)
+    last_position = db.scalar(select(func.max(models.PlaylistTrack.position)).where(models.PlaylistTrack.playlist_id == playlist_id))
+    db_link = models.PlaylistTrack(playlist_id=playlist_id, track_id=track_id, position=(last_position or 0) + POSITION_GAP)
     
     db.add(db_link)
-    db.commit()
+    
+    # Трек вже є в цьому плейлисті
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return None
+    
+    cache.invalidate("playlists", playlist_id)
     db.refresh(db_link)
     return db_link
     
@@ -235,5 +348,328 @@ def remove_track_from_playlist(db: Session, playlist_id: int, track_id: int):
     
     db.delete(db_link)
     db.commit()
+    cache.invalidate("playlists", db_link.playlist_id)
     
     return db_link
+
+def remove_from_playlist(db: Session, link_id: int):
+    db_link = db.query(models.PlaylistTrack).filter(models.PlaylistTrack.id == link_id).first()
+    
+    if db_link is None:
+        return None
+    
+    db.delete(db_link)
+    db.commit()
+    cache.invalidate("playlists", db_link.playlist_id)
+    
+    return db_link
+
+# Позиція для вставки між prev і next. None - якщо між ними вже немає вільного місця.
+def _position_between(prev, next):
+    if prev is None and next is None:
+        return POSITION_GAP
+    
+    if next is None:
+        return prev + POSITION_GAP
+    
+    if prev is None:
+        return next - POSITION_GAP
+    
+    middle = (prev + next) // 2
+    return middle if prev < middle < next else None
+
+# Застосовує пачку операцій (add / remove / move) до плейлиста в одній транзакції.
+# Усі зв'язки плейлиста читаються одним запитом, далі порядок ведеться в пам'яті,
+# а в БД записуються лише змінені рядки. Перенумерація всього плейлиста потрібна лише тоді,
+# коли між двома сусідами закінчився проміжок. Якщо хоч одна операція некоректна -
+# ValueError, і нічого не зберігається.
+def apply_playlist_ops(db: Session, playlist_id: int, ops: list):
+    if get_playlist(db, playlist_id) is None:
+        return None
+    
+    links = (
+        db.query(models.PlaylistTrack)
+        .filter(models.PlaylistTrack.playlist_id == playlist_id)
+        .order_by(models.PlaylistTrack.position, models.PlaylistTrack.id)
+        .all()
+    )
+    by_id = {link.id: link for link in links}
+    in_playlist = {link.track_id for link in links}
+    
+    track_ids = {op.track_id for op in ops if op.op == "add"}
+    known_tracks = set(db.scalars(select(models.Track.id).where(models.Track.id.in_(track_ids))).all()) if track_ids else set()
+    
+    def renumber():
+        for number, link in enumerate(links, start=1):
+            link.position = number * POSITION_GAP
+    
+    def place(link, op):
+        if op.after_link_id is not None and op.before_link_id is not None:
+            raise ValueError("Вкажіть лише after_link_id або before_link_id")
+        
+        anchor_id = op.after_link_id if op.after_link_id is not None else op.before_link_id
+        
+        if anchor_id is None:
+            index = len(links)
+        elif anchor_id not in by_id or anchor_id == link.id:
+            raise ValueError("Зв'язок %d не знайдено в плейлисті" % anchor_id)
+        else:
+            index = links.index(by_id[anchor_id]) + (1 if op.after_link_id is not None else 0)
+        
+        for _ in range(2):
+            prev = links[index - 1].position if index > 0 else None
+            next = links[index].position if index < len(links) else None
+            position = _position_between(prev, next)
+            
+            if position is not None:
+                break
+            
+            renumber()
+        
+        link.position = position
+        links.insert(index, link)
+    
+    def apply(op):
+        if op.op == "add":
+            if op.track_id not in known_tracks:
+                raise ValueError("Трек %s не знайдено" % op.track_id)
+            
+            if op.track_id in in_playlist:
+                raise ValueError("Трек %s вже є в плейлисті" % op.track_id)
+            
+            link = models.PlaylistTrack(playlist_id=playlist_id, track_id=op.track_id)
+            place(link, op)
+            db.add(link)
+            in_playlist.add(op.track_id)
+        
+        elif op.op == "remove":
+            link = by_id.pop(op.link_id, None)
+            
+            if link is None:
+                raise ValueError("Зв'язок %s не знайдено в плейлисті" % op.link_id)
+            
+            links.remove(link)
+            in_playlist.discard(link.track_id)
+            db.delete(link)
+        
+        elif op.op == "move":
+            link = by_id.get(op.link_id)
+            
+            if link is None:
+                raise ValueError("Зв'язок %s не знайдено в плейлисті" % op.link_id)
+            
+            links.remove(link)
+            place(link, op)
+    
+    # Старі зв'язки без позиції (створені до появи колонки) отримують її за поточним порядком
+    if any(link.position is None for link in links):
+        renumber()
+    
+    try:
+        for op in ops:
+            apply(op)
+    except ValueError:
+        db.rollback()
+        raise
+    
+    db.flush()
+    result = [schemas.PlaylistTrack.model_validate(link) for link in links]
+    db.commit()
+    cache.invalidate("playlists", playlist_id)
+    
+    return result
+
+#-----------------------------------------------------------------------------------------------#
+
+# Масовий імпорт. Кожен виклик обробляє одну пачку (до BULK_CHUNK_SIZE рядків):
+# один SELECT для пошуку дублікатів по унікальному полю, один INSERT на всю пачку (executemany)
+# і один commit. Результат - список статусів у тому ж порядку, що й вхідні рядки.
+
+BULK_CHUNK_SIZE = 1000
+
+# INSERT ... ON CONFLICT DO NOTHING - рядки, які встиг вставити хтось інший між
+# перевіркою на дублікати і вставкою, просто пропускаються замість помилки всієї пачки
+def _insert_ignore(db: Session, model):
+    dialect = db.get_bind().dialect.name
+    
+    if dialect == "sqlite":
+        return sqlite.insert(model).on_conflict_do_nothing()
+    
+    if dialect == "postgresql":
+        return postgresql.insert(model).on_conflict_do_nothing()
+    
+    return insert(model)
+
+# Пачка, яка все ж не вставилась (наприклад автора видалили між перевіркою і вставкою -
+# ON CONFLICT не рятує від зовнішнього ключа), вставляється ще раз по одному рядку, щоб
+# помилку отримали лише ті рядки, які її спричинили. Повертає {ключ: опис помилки}.
+def _insert_rows_one_by_one(db: Session, model, key_column, rows: list) -> dict:
+    failed = {}
+    
+    for row in rows:
+        try:
+            db.execute(_insert_ignore(db, model), [row])
+            db.commit()
+        except IntegrityError as error:
+            db.rollback()
+            missing = _missing_reference(db, model, row) if _is_foreign_key_error(error) else None
+            
+            if missing is not None:
+                failed[row[key_column.name]] = "Не існує запису, на який посилається %s" % missing
+            else:
+                failed[row[key_column.name]] = "Не вдалося додати запис"
+    
+    return failed
+
+def _bulk_insert(db: Session, model, key_column, rows: list, results: list, pending: dict):
+    failed = {}
+    
+    try:
+        if rows:
+            db.execute(_insert_ignore(db, model), rows)
+        
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        failed = _insert_rows_one_by_one(db, model, key_column, rows)
+    
+    if not pending:
+        return results
+    
+    created = dict(db.execute(select(key_column, model.id).where(key_column.in_(list(pending)))).all())
+    
+    for key, index in pending.items():
+        if key in failed:
+            results[index] = {"status": "error", "detail": failed[key]}
+        elif key in created:
+            results[index] = {"status": "created", "id": created[key]}
+        else:
+            results[index] = {"status": "error", "detail": "Не вдалося додати запис"}
+    
+    return results
+
+def bulk_create_authors(db: Session, authors: list):
+    nicknames = [author.nickname for author in authors]
+    existing = dict(db.execute(
+        select(models.Author.nickname, models.Author.id).where(models.Author.nickname.in_(nicknames))
+    ).all())
+    
+    results = [None] * len(authors)
+    pending = {}
+    rows = []
+    
+    for index, author in enumerate(authors):
+        if author.nickname in existing:
+            results[index] = {"status": "exists", "id": existing[author.nickname]}
+        elif author.nickname in pending:
+            results[index] = {"status": "duplicate", "detail": "Повтор у запиті"}
+        else:
+            pending[author.nickname] = index
+            rows.append(author.model_dump())
+    
+    return _bulk_insert(db, models.Author, models.Author.nickname, rows, results, pending)
+
+# metas - метадані файлів у тому ж порядку, що й tracks (None - файл не розібрано)
+def bulk_create_tracks(db: Session, tracks: list, metas: list = None):
+    names = [track.name for track in tracks]
+    existing = dict(db.execute(
+        select(models.Track.name, models.Track.id).where(models.Track.name.in_(names))
+    ).all())
+    author_ids = set(db.scalars(
+        select(models.Author.id).where(models.Author.id.in_({track.author_id for track in tracks}))
+    ).all())
+    
+    results = [None] * len(tracks)
+    pending = {}
+    rows = []
+    
+    metas = metas or [None] * len(tracks)
+    
+    for index, (track, meta) in enumerate(zip(tracks, metas)):
+        row = {**track.model_dump(), **(meta or {})}
+        
+        if track.name in existing:
+            results[index] = {"status": "exists", "id": existing[track.name]}
+        elif track.name in pending:
+            results[index] = {"status": "duplicate", "detail": "Повтор у запиті"}
+        elif track.author_id not in author_ids:
+            results[index] = {"status": "error", "detail": "Автор не знайдений"}
+        elif row["duration"] is None:
+            results[index] = {"status": "error", "detail": "Не вдалося визначити тривалість треку"}
+        else:
+            pending[track.name] = index
+            rows.append(row)
+    
+    results = _bulk_insert(db, models.Track, models.Track.name, rows, results, pending)
+    
+    for author_id in {row["author_id"] for row in rows}:
+        cache.invalidate("authors", author_id)
+    
+    return results
+
+#-----------------------------------------------------------------------------------------------#
+
+def create_upload(db: Session, upload_id: str, user_id: int, upload: schemas.UploadCreate):
+    return _insert(db, models.Upload(id=upload_id, user_id=user_id, created_at=time.time(), **upload.model_dump()))
+
+def get_upload(db: Session, upload_id: str):
+    return db.get(models.Upload, upload_id)
+
+def delete_upload(db: Session, upload_id: str):
+    return _delete(db, models.Upload, upload_id)
+
+# Трек із завантаженого файлу і прив'язка завантаження до нього - в одній транзакції.
+# AlreadyExists - якщо трек з такою назвою вже є, MissingReference - якщо автора не існує.
+def create_track_from_upload(db: Session, upload_id: str, track: schemas.TrackCreate, meta: dict = None):
+    db_track = models.Track(**{**track.model_dump(), **(meta or {})})
+    db.add(db_track)
+    
+    try:
+        db.flush()
+        db.execute(update(models.Upload).where(models.Upload.id == upload_id).values(track_id=db_track.id))
+        db.commit()
+    except IntegrityError as error:
+        _raise_integrity_error(db, models.Track, track.model_dump(), error)
+    
+    cache.invalidate("authors", track.author_id)
+    return db_track
+
+#-----------------------------------------------------------------------------------------------#
+
+# Запис пачки прослуховувань (словники track_id, user_id, listened_ms, created_at) однією транзакцією:
+# один executemany INSERT журналу і один executemany UPDATE лічильників - по рядку на трек, а не на подію.
+# Події для вже видалених треків відкидаються, для видалених користувачів - зберігаються без user_id.
+def record_plays(db: Session, events: list):
+    track_ids = set(db.scalars(select(models.Track.id).where(models.Track.id.in_({event["track_id"] for event in events}))).all())
+    user_ids = {event["user_id"] for event in events if event["user_id"] is not None}
+    user_ids = set(db.scalars(select(models.User.id).where(models.User.id.in_(user_ids))).all()) if user_ids else set()
+    
+    rows = []
+    totals = {}
+    
+    for event in events:
+        if event["track_id"] not in track_ids:
+            continue
+        
+        rows.append({**event, "user_id": event["user_id"] if event["user_id"] in user_ids else None})
+        plays, listened = totals.get(event["track_id"], (0, 0))
+        totals[event["track_id"]] = (plays + 1, listened + event["listened_ms"])
+    
+    if not rows:
+        return 0
+    
+    tracks = models.Track.__table__
+    
+    db.execute(insert(models.PlayEvent), rows)
+    db.execute(
+        update(tracks)
+        .where(tracks.c.id == bindparam("track_id_"))
+        .values(play_count=tracks.c.play_count + bindparam("plays"), listen_ms=tracks.c.listen_ms + bindparam("listened")),
+        [{"track_id_": track_id, "plays": plays, "listened": listened} for track_id, (plays, listened) in totals.items()],
+    )
+    db.commit()
+    
+    # Кеш треків навмисно не скидається: пачка пишеться щосекунди, і найпопулярніші треки
+    # постійно випадали б з кешу. play_count / listen_ms у кешованій копії відстають не більше ніж на CACHE_TTL.
+    return len(rows)
+
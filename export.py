@@ -0,0 +1,86 @@
+# Потокове вивантаження каталогу в NDJSON (один JSON об'єкт на рядок):
+# /export/tracks, /export/authors, /export/playlists/{id}.
+# Рядки читаються з БД пачками по EXPORT_BATCH_SIZE (yield_per) і одразу відправляються клієнту,
+# тому пам'ять не залежить від розміру таблиці. Наступна пачка читається лише тоді, коли попередня
+# вже відправлена, - повільний клієнт просто пригальмовує читання з БД (backpressure).
+# Якщо клієнт підтримує gzip (Accept-Encoding), потік стискається на льоту.
+
+import zlib
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+
+import models
+import schemas
+
+from crud import _columns
+from database import AsyncSessionLocal
+from fast_json import dumps
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_GZIP_LEVEL = 6
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+#-----------------------------------------------------------------------------------------------#
+
+def tracks_query():
+    return select(*_columns(models.Track, schemas.Track)).order_by(models.Track.id)
+
+def authors_query():
+    return select(*_columns(models.Author, schemas.Author)).order_by(models.Author.id)
+
+# Треки плейлиста в порядку відтворення - ті самі поля, що й у /get_playlist_detail
+def playlist_query(playlist_id: int):
+    return (
+        select(
+            *_columns(models.Track, schemas.Track),
+            models.PlaylistTrack.id.label("link_id"),
+            models.Author.nickname.label("author_nickname"),
+        )
+        .join(models.Track, models.Track.id == models.PlaylistTrack.track_id)
+        .outerjoin(models.Author, models.Author.id == models.Track.author_id)
+        .where(models.PlaylistTrack.playlist_id == playlist_id)
+        .order_by(models.PlaylistTrack.position, models.PlaylistTrack.id)
+    )
+
+#-----------------------------------------------------------------------------------------------#
+
+# Окрема сесія, бо генератор працює вже після завершення маршруту
+async def _ndjson_lines(statement):
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(statement.execution_options(yield_per=EXPORT_BATCH_SIZE))
+
+        async for rows in result.mappings().partitions():
+            yield b"".join(dumps(dict(row)) + b"\n" for row in rows)
+
+async def _gzip(chunks):
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+
+        if data:
+            yield data
+
+    yield compressor.flush()
+
+def _accepts_gzip(request: Request) -> bool:
+    for coding in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = coding.strip().partition(";")
+
+        if name.strip().lower() == "gzip" and params.replace(" ", "") != "q=0":
+            return True
+
+    return False
+
+def ndjson_response(request: Request, statement, filename: str) -> StreamingResponse:
+    body = _ndjson_lines(statement)
+    headers = {"Content-Disposition": 'attachment; filename="%s.ndjson"' % filename, "Vary": "Accept-Encoding"}
+
+    if _accepts_gzip(request):
+        body = _gzip(body)
+        headers["Content-Encoding"] = "gzip"
+
+    return StreamingResponse(body, media_type=NDJSON_MEDIA_TYPE, headers=headers)
@@ -0,0 +1,29 @@
+# Швидка відповідь для списків (/get_tracks, /get_authors, ...).
+# Звичайний шлях FastAPI - ORM об'єкт -> перевірка через response_model (from_attributes) ->
+# JSON. Для сторінки на 100+ рядків саме це займає більшу частину часу запиту.
+# Тут crud вже повертає прості словники з потрібних колонок, а відповідь одразу рендериться в JSON
+# через orjson, без Pydantic. response_model у декораторі маршруту залишається, тому схема OpenAPI
+# та сама, але FastAPI не перевіряє Response, повернений напряму.
+
+# pip install orjson
+
+import json
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
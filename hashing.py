@@ -1,11 +1,90 @@
 # pip install passlib[bcrypt]
 
+# Хешування паролів. bcrypt навмисно повільний (сотні мс CPU на один виклик), тому в маршрутах
+# він виконується в окремому обмеженому пулі процесів (або потоків), а не в event loop.
+# Якщо в пулі вже забагато задач - одразу відмовляємо (HashPoolSaturated -> 503),
+# замість того щоб шквал логінів забрав CPU у всіх інших запитів.
+
+import os
+import asyncio
+import threading
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+HASH_POOL = os.getenv("HASH_POOL", "process")                            # process або thread
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", min(4, os.cpu_count() or 1)))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", HASH_WORKERS * 8))  # задач в роботі + в черзі
+
+# min_rounds: хеші зі старою (меншою) вартістю вважаються застарілими і перехешовуються при логіні
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+)
 
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
\ No newline at end of file
+    return pwd_context.verify(plain_password, hashed_password)
+
+# Повертає (пароль вірний, новий хеш або None, якщо старий хеш ще актуальний)
+def verify_and_update(plain_password: str, hashed_password: str):
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+#-----------------------------------------------------------------------------------------------#
+
+class HashPoolSaturated(Exception):
+    pass
+
+_executor = None
+_executor_lock = threading.Lock()
+_in_flight = 0
+
+def _get_executor():
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            if HASH_POOL == "thread":
+                _executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="hashing")
+            else:
+                _executor = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+
+        return _executor
+
+def shutdown_pool():
+    global _executor
+
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+def pool_stats() -> dict:
+    return {"in_flight": _in_flight, "limit": HASH_QUEUE_LIMIT, "workers": HASH_WORKERS}
+
+async def _submit(func, *args):
+    global _in_flight
+
+    with _executor_lock:
+        if _in_flight >= HASH_QUEUE_LIMIT:
+            raise HashPoolSaturated()
+        _in_flight += 1
+
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_executor(), func, *args)
+    finally:
+        with _executor_lock:
+            _in_flight -= 1
+
+async def hash_password_async(password: str) -> str:
+    return await _submit(hash_password, password)
+
+async def verify_and_update_async(plain_password: str, hashed_password: str):
+    return await _submit(verify_and_update, plain_password, hashed_password)
@@ -0,0 +1,125 @@
+# HTTP кешування JSON відповідей на GET запити (/get_tracks, /get_track/{id}, /get_playlist/{id}, ...).
+# Для кожної такої відповіді обчислюється сильний ETag - хеш її тіла. Якщо клієнт надіслав
+# If-None-Match з тим самим ETag (тобто дані з його попереднього запиту не змінилися),
+# замість тіла повертається порожня відповідь 304 Not Modified.
+# Хеш від вмісту, а не лічильник версій, тому ETag не залежить від того, через який маршрут
+# чи скрипт змінилися дані, і однаковий на всіх процесах сервера.
+# Заголовки Cache-Control і Vary налаштовуються через змінні середовища, щоб CDN і браузери
+# могли зберігати відповіді і лише перевіряти їх актуальність.
+
+import hashlib
+import os
+
+# public - відповідь може зберігати CDN; no-cache - перед використанням збереженої копії
+# її треба перевірити (If-None-Match), тому клієнт не побачить застарілих даних
+HTTP_CACHE_CONTROL = os.getenv("HTTP_CACHE_CONTROL", "public, no-cache")
+# Для запитів з токеном - відповідь може залежати від користувача, тому лише кеш браузера
+HTTP_CACHE_CONTROL_PRIVATE = os.getenv("HTTP_CACHE_CONTROL_PRIVATE", "private, no-cache")
+HTTP_CACHE_VARY = os.getenv("HTTP_CACHE_VARY", "Accept-Encoding, Authorization")
+# Більші відповіді віддаються як є, без ETag, щоб не тримати їх цілком у пам'яті
+HTTP_CACHE_MAX_BODY = int(os.getenv("HTTP_CACHE_MAX_BODY", 4 * 1024 * 1024))
+
+#-----------------------------------------------------------------------------------------------#
+
+def make_etag(body: bytes) -> str:
+    return '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+
+# If-None-Match може містити кілька ETag через кому або "*".
+# Для GET порівняння слабке, тобто префікс W/ ігнорується.
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+
+    etag = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+def _header(headers, name: bytes):
+    for key, value in headers:
+        if key.lower() == name:
+            return value.decode("latin-1")
+
+    return None
+
+def _cacheable(message) -> bool:
+    headers = message.get("headers", [])
+    content_type = _header(headers, b"content-type") or ""
+
+    return (
+        message["status"] == 200
+        and content_type.startswith("application/json")
+        # Маршрут сам керує кешуванням (наприклад, стрімінг файлів має власний ETag)
+        and _header(headers, b"etag") is None
+        and _header(headers, b"cache-control") is None
+    )
+
+#-----------------------------------------------------------------------------------------------#
+
+class ETagMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = scope["headers"]
+        if_none_match = _header(request_headers, b"if-none-match")
+        private = _header(request_headers, b"authorization") is not None
+
+        start = None
+        body = []
+        size = 0
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, size, passthrough
+
+            if passthrough:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                if not _cacheable(message):
+                    passthrough = True
+                    await send(message)
+                    return
+
+                start = message
+                return
+
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body.append(message.get("body", b""))
+            size += len(body[-1])
+
+            if size > HTTP_CACHE_MAX_BODY:
+                passthrough = True
+                await send(start)
+                await send({"type": "http.response.body", "body": b"".join(body), "more_body": message.get("more_body", False)})
+                return
+
+            if message.get("more_body", False):
+                return
+
+            content = b"".join(body)
+            etag = make_etag(content)
+            headers = [(key, value) for key, value in start.get("headers", []) if key.lower() != b"vary"]
+            headers += [
+                (b"etag", etag.encode("latin-1")),
+                (b"cache-control", (HTTP_CACHE_CONTROL_PRIVATE if private else HTTP_CACHE_CONTROL).encode("latin-1")),
+                (b"vary", HTTP_CACHE_VARY.encode("latin-1")),
+            ]
+
+            if if_none_match is not None and etag_matches(if_none_match, etag):
+                headers = [(key, value) for key, value in headers if key.lower() not in (b"content-length", b"content-type")]
+                await send({"type": "http.response.start", "status": 304, "headers": headers})
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+            await send({**start, "headers": headers})
+            await send({"type": "http.response.body", "body": content})
+
+        await self.app(scope, receive, send_wrapper)
@@ -1,12 +1,47 @@
 # Файл, який об'єднує увесь проект в єдину програму FastAPI
 
+from contextlib import asynccontextmanager
+
+import anyio
+
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
 from routes import main_router
-from database import Base, engine
+from hashing import shutdown_pool
+from audio_meta import shutdown_pool as shutdown_meta_pool
+from migrations import upgrade
+from http_cache import ETagMiddleware
+from compression import CompressionMiddleware, PrecompressedStaticFiles, precompress_dir
+from metrics import MetricsMiddleware, instrument_engine
+from database import engine, async_engine
+import plays
+import related
+import uploads
+
+# Код до yield виконується при запуску сервера, після yield - при зупинці
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Стиснені копії статичних файлів - один раз при запуску, а не на кожен запит
+    await anyio.to_thread.run_sync(precompress_dir, "static")
+    plays.start()
+    related.start()
+    uploads.start_cleanup()
+    yield
+    await uploads.stop_cleanup()
+    await related.stop()
+    await plays.stop()
+    shutdown_pool()
+    shutdown_meta_pool()
 
-app = FastAPI()
-app.mount("/static", StaticFiles(directory="static"), name="static")
-Base.metadata.create_all(bind=engine)
+app = FastAPI(lifespan=lifespan)
+# ETag / 304 для JSON відповідей на GET запити
+app.add_middleware(ETagMiddleware)
+# gzip / brotli - зовні ETagMiddleware: ETag рахується від нестисненого тіла
+app.add_middleware(CompressionMiddleware)
+# Метрики - останнім, тобто зовнішнім шаром: час запиту включає всі інші middleware
+app.add_middleware(MetricsMiddleware)
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+app.mount("/static", PrecompressedStaticFiles(directory="static"), name="static")
+upgrade()
 
 app.include_router(main_router)
\ No newline at end of file
@@ -0,0 +1,325 @@
+# Метрики запитів і запитів до БД у форматі Prometheus (/metrics).
+#
+# MetricsMiddleware міряє кожен HTTP запит (гістограма затримок за маршрутом, лічильник за статусом),
+# а події SQLAlchemy before/after_cursor_execute - кожен SQL запит. SQL запити прив'язуються до
+# HTTP запиту через contextvars, тому для кожного запиту відомо, скільки було SQL запитів і скільки
+# часу вони зайняли (також віддається клієнту в заголовку Server-Timing). Окремо в лог пишуться:
+#   - повільні SQL запити (довші за METRICS_SLOW_QUERY_MS);
+#   - N+1: той самий SQL виконано METRICS_N_PLUS_ONE разів або більше за один HTTP запит
+#     (типово - lazy-завантаження зв'язку в циклі).
+#
+# Профілювання окремого запиту (лише якщо METRICS_PROFILE=1): заголовок X-Profile: 1.
+# Поки запит виконується, потік event loop кожні METRICS_PROFILE_INTERVAL секунд знімається
+# семплюючим профайлером; результат (стеки у форматі collapsed, для flamegraph.pl / speedscope)
+# доступний за /debug/profiles/{id}, де id - із заголовка відповіді X-Profile-Id.
+
+import os
+import sys
+import time
+import uuid
+import logging
+import threading
+import contextvars
+
+from collections import Counter, OrderedDict
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+METRICS_SLOW_QUERY_MS = float(os.getenv("METRICS_SLOW_QUERY_MS", 100))
+METRICS_N_PLUS_ONE = int(os.getenv("METRICS_N_PLUS_ONE", 10))
+METRICS_PROFILE = os.getenv("METRICS_PROFILE", "0").strip().lower() in ("1", "true", "yes", "on")
+METRICS_PROFILE_INTERVAL = float(os.getenv("METRICS_PROFILE_INTERVAL", 0.001))
+METRICS_PROFILE_KEEP = int(os.getenv("METRICS_PROFILE_KEEP", 20))
+
+# Межі кошиків гістограм, секунди
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+
+#-----------------------------------------------------------------------------------------------#
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+        self.sum += value
+        self.count += 1
+
+# Лічильники і гістограми з мітками: (назва, мітки) -> значення
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = OrderedDict()
+        self.histograms = OrderedDict()
+        self.help = {}
+
+    def describe(self, name: str, kind: str, text: str):
+        self.help[name] = (kind, text)
+
+    def inc(self, name: str, labels: tuple = (), value: float = 1):
+        with self.lock:
+            self.counters[(name, labels)] = self.counters.get((name, labels), 0) + value
+
+    def observe(self, name: str, labels: tuple, value: float, buckets=LATENCY_BUCKETS):
+        with self.lock:
+            histogram = self.histograms.get((name, labels))
+
+            if histogram is None:
+                histogram = self.histograms[(name, labels)] = Histogram(buckets)
+
+            histogram.observe(value)
+
+registry = Registry()
+
+registry.describe("http_requests_total", "counter", "HTTP запити за маршрутом і статусом")
+registry.describe("http_request_duration_seconds", "histogram", "Тривалість HTTP запиту")
+registry.describe("http_request_db_queries", "histogram", "Кількість SQL запитів на один HTTP запит")
+registry.describe("http_request_db_seconds", "histogram", "Час у БД на один HTTP запит")
+registry.describe("db_queries_total", "counter", "SQL запити")
+registry.describe("db_query_duration_seconds", "histogram", "Тривалість SQL запиту")
+registry.describe("db_slow_queries_total", "counter", "SQL запити, довші за METRICS_SLOW_QUERY_MS")
+registry.describe("db_n_plus_one_total", "counter", "HTTP запити з ознаками N+1")
+
+#-----------------------------------------------------------------------------------------------#
+
+# Статистика SQL для одного HTTP запиту
+class RequestStats:
+    def __init__(self, scope):
+        self.scope = scope
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = Counter()
+
+_current = contextvars.ContextVar("metrics_request", default=None)
+
+# Час початку зберігається в контексті виконання, а не на з'єднанні: after_cursor_execute
+# не викликається для запиту з помилкою (IntegrityError), і на з'єднанні залишалося б сміття
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_start = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_metrics_start", None)
+
+    if start is None:
+        return
+
+    elapsed = time.perf_counter() - start
+    stats = _current.get()
+    route = _route_name(stats.scope) if stats is not None else "-"
+
+    registry.inc("db_queries_total", (("route", route),))
+    registry.observe("db_query_duration_seconds", (("route", route),), elapsed)
+
+    if elapsed * 1000 >= METRICS_SLOW_QUERY_MS:
+        registry.inc("db_slow_queries_total", (("route", route),))
+        logger.warning("Повільний SQL (%.1f мс) у %s: %s", elapsed * 1000, route, statement)
+
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+        stats.statements[statement] += 1
+
+def instrument_engine(sync_engine):
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+#-----------------------------------------------------------------------------------------------#
+
+# Семплюючий профайлер: окремий потік періодично знімає стек потоку, який виконує запит
+class SamplingProfiler:
+    def __init__(self, thread_id: int, interval: float = METRICS_PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+
+            while frame is not None:
+                code = frame.f_code
+                stack.append("%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), frame.f_lineno))
+                frame = frame.f_back
+
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self) -> str:
+        self.stopped.set()
+        self.thread.join()
+        return "\n".join("%s %d" % (stack, count) for stack, count in self.samples.most_common())
+
+_profiles = OrderedDict()
+
+def get_profile(profile_id: str):
+    return _profiles.get(profile_id)
+
+def _save_profile(text: str) -> str:
+    profile_id = uuid.uuid4().hex
+
+    _profiles[profile_id] = text
+
+    while len(_profiles) > METRICS_PROFILE_KEEP:
+        _profiles.popitem(last=False)
+
+    return profile_id
+
+#-----------------------------------------------------------------------------------------------#
+
+def _header(headers, name: bytes):
+    for key, value in headers:
+        if key.lower() == name:
+            return value.decode("latin-1")
+
+    return None
+
+# Шаблон маршруту (/get_track/{track_id}), а не сам шлях - інакше кожен id став би окремою міткою
+def _route_name(scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = _current.set(stats)
+        status = 500
+        profiler = None
+        profile_id = None
+
+        if METRICS_PROFILE and _header(scope["headers"], b"x-profile") == "1":
+            profiler = SamplingProfiler(threading.get_ident())
+            profiler.start()
+
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status, profile_id
+
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                elapsed = time.perf_counter() - start
+                headers = list(message.get("headers", []))
+                headers.append((
+                    b"server-timing",
+                    ('db;dur=%.2f;desc="%d queries", app;dur=%.2f' % (stats.db_time * 1000, stats.queries, elapsed * 1000)).encode("latin-1"),
+                ))
+
+                if profiler is not None:
+                    profile_id = _save_profile(profiler.stop())
+                    headers.append((b"x-profile-id", profile_id.encode("latin-1")))
+
+                message = {**message, "headers": headers}
+
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+
+            if profiler is not None and profile_id is None:
+                profiler.stop()
+
+            route = _route_name(scope)
+            method = scope["method"]
+            elapsed = time.perf_counter() - start
+
+            registry.inc("http_requests_total", (("method", method), ("route", route), ("status", str(status))))
+            registry.observe("http_request_duration_seconds", (("method", method), ("route", route)), elapsed)
+            registry.observe("http_request_db_queries", (("route", route),), stats.queries, QUERY_COUNT_BUCKETS)
+            registry.observe("http_request_db_seconds", (("route", route),), stats.db_time)
+
+            repeated = [(statement, count) for statement, count in stats.statements.items() if count >= METRICS_N_PLUS_ONE]
+
+            if repeated:
+                registry.inc("db_n_plus_one_total", (("route", route),))
+                statement, count = max(repeated, key=lambda item: item[1])
+                logger.warning("Можливий N+1 у %s %s: %d однакових SQL запитів: %s", method, route, count, statement)
+
+#-----------------------------------------------------------------------------------------------#
+
+def _labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = labels + extra
+
+    if not pairs:
+        return ""
+
+    return "{%s}" % ",".join('%s="%s"' % (key, str(value).replace("\\", "\\\\").replace('"', '\\"')) for key, value in pairs)
+
+def _number(value) -> str:
+    return "%d" % value if isinstance(value, int) or float(value).is_integer() else repr(float(value))
+
+# gauges - додаткові значення {назва: значення} (статистика кешів, пулу хешування тощо)
+def render(gauges: dict = None) -> str:
+    lines = []
+    described = set()
+
+    def describe(name):
+        if name in described or name not in registry.help:
+            return
+
+        kind, text = registry.help[name]
+        lines.append("# HELP %s %s" % (name, text))
+        lines.append("# TYPE %s %s" % (name, kind))
+        described.add(name)
+
+    with registry.lock:
+        for (name, labels), value in sorted(registry.counters.items()):
+            describe(name)
+            lines.append("%s%s %s" % (name, _labels(labels), _number(value)))
+
+        for (name, labels), histogram in sorted(registry.histograms.items(), key=lambda item: item[0]):
+            describe(name)
+            cumulative = 0
+
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append("%s_bucket%s %d" % (name, _labels(labels, (("le", _number(bound)),)), cumulative))
+
+            lines.append("%s_bucket%s %d" % (name, _labels(labels, (("le", "+Inf"),)), histogram.count))
+            lines.append("%s_sum%s %s" % (name, _labels(labels), repr(histogram.sum)))
+            lines.append("%s_count%s %d" % (name, _labels(labels), histogram.count))
+
+    for name, value in sorted((gauges or {}).items()):
+        lines.append("# TYPE %s gauge" % name)
+        lines.append("%s %s" % (name, _number(value)))
+
+    return "\n".join(lines) + "\n"
+
+# Плоский словник з вкладених словників статистики: {"tracks": {"hits": 1}} -> {"prefix_tracks_hits": 1}
+def flatten(prefix: str, stats: dict) -> dict:
+    result = {}
+
+    for key, value in stats.items():
+        name = "%s_%s" % (prefix, key)
+
+        if isinstance(value, dict):
+            result.update(flatten(name, value))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            result[name] = value
+
+    return result
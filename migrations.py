@@ -0,0 +1,259 @@
+# Міграції схеми БД. Замість Base.metadata.create_all (який лише створює відсутні таблиці
+# і ніколи не змінює існуючі) кожна зміна схеми описується окремою пронумерованою функцією.
+# Номер останньої застосованої міграції зберігається в таблиці schema_version, тому при запуску
+# виконуються лише нові міграції. Міграції написані так, що повторний запуск нічого не ламає.
+#
+# Запуск вручну: python migrations.py
+# Прибрати треки без автора і плейлисти без користувача: python migrations.py --prune-orphans
+
+import os
+import sys
+import logging
+
+from sqlalchemy import Column, Integer, MetaData, Table, inspect, text
+from sqlalchemy.schema import CreateTable
+
+import cache
+import models
+
+from database import Base, engine
+from search import create_search_index
+from related import create_change_log, compact_change_log
+from aggregates import create_aggregate_triggers, repair as repair_aggregates
+from streaming import track_file_path
+from peaks import sidecar_path
+
+logger = logging.getLogger(__name__)
+
+_version_metadata = MetaData()
+schema_version = Table("schema_version", _version_metadata, Column("version", Integer, nullable=False))
+
+#-----------------------------------------------------------------------------------------------#
+
+def _add_column_if_missing(connection, table: str, column: str, ddl_type: str):
+    columns = {info["name"] for info in inspect(connection).get_columns(table)}
+
+    if column not in columns:
+        connection.execute(text("ALTER TABLE %s ADD COLUMN %s %s" % (table, column, ddl_type)))
+
+def _create_indexes(connection, table: Table):
+    for index in table.indexes:
+        index.create(connection, checkfirst=True)
+
+def _has_cascades(connection, table: Table) -> bool:
+    actual = {
+        (row.table, row.on_delete.upper())
+        for row in connection.execute(text("PRAGMA foreign_key_list(%s)" % table.name))
+    }
+    expected = {
+        (fk.column.table.name, (fk.ondelete or "NO ACTION").upper())
+        for fk in table.foreign_keys
+    }
+    return expected <= actual
+
+def _log_rows(connection, message: str, statement: str) -> int:
+    count = connection.execute(text(statement)).rowcount
+
+    if count:
+        logger.warning("%s: %d", message, count)
+
+    return count
+
+# SQLite не вміє змінювати зовнішні ключі існуючої таблиці, тому таблиця перебудовується:
+# нова таблиця за описом моделі -> копія даних -> видалення старої -> перейменування нової.
+# Разом зі старою таблицею видаляються її індекси і тригери, тому їх треба створити знову.
+def _rebuild_sqlite_table(connection, table: Table):
+    # Інші таблиці копіюються поруч, щоб зовнішні ключі нової таблиці мали на що посилатися
+    metadata = MetaData()
+
+    for other in Base.metadata.sorted_tables:
+        if other is not table:
+            other.to_metadata(metadata)
+
+    temp = table.to_metadata(metadata, name=table.name + "__new")
+    old_columns = {info["name"] for info in inspect(connection).get_columns(table.name)}
+    columns = ", ".join(column.name for column in table.columns if column.name in old_columns)
+
+    connection.execute(CreateTable(temp))
+    connection.execute(text("INSERT INTO %s (%s) SELECT %s FROM %s" % (temp.name, columns, columns, table.name)))
+    connection.execute(text("DROP TABLE %s" % table.name))
+    connection.execute(text("ALTER TABLE %s RENAME TO %s" % (temp.name, table.name)))
+    _create_indexes(connection, table)
+
+#-----------------------------------------------------------------------------------------------#
+
+# 1. Початкова схема. Для нової БД одразу створюються всі таблиці в актуальному вигляді,
+#    для старої (створеної через create_all) - лише відсутні таблиці.
+def _initial(connection):
+    Base.metadata.create_all(bind=connection)
+
+# 2. Порядок треків у плейлисті. Старим зв'язкам позиція виставляється в порядку їх додавання.
+def _playlist_position(connection):
+    _add_column_if_missing(connection, "playlisttracks", "position", "INTEGER")
+    connection.execute(text("UPDATE playlisttracks SET position = id * 1024 WHERE position IS NULL"))
+
+# 3. Зовнішні ключі з ON DELETE CASCADE, індекси на колонках фільтрації,
+#    унікальність пари (playlist_id, track_id). Дані користувачів тут не видаляються:
+#    треки і плейлисти з посиланням на неіснуючого автора / користувача лише отримують NULL
+#    (як після видалень без каскаду), їх можна прибрати окремо - python migrations.py --prune-orphans.
+#    Видаляються тільки зайві зв'язки плейлистів: на неіснуючі рядки і дублікати треків.
+def _constraints(connection):
+    _log_rows(connection, "tracks: author_id -> NULL (автора немає)",
+        "UPDATE tracks SET author_id = NULL WHERE author_id IS NOT NULL AND author_id NOT IN (SELECT id FROM authors)")
+    _log_rows(connection, "playlists: user_id -> NULL (користувача немає)",
+        "UPDATE playlists SET user_id = NULL WHERE user_id IS NOT NULL AND user_id NOT IN (SELECT id FROM users)")
+    _log_rows(connection, "playlisttracks: видалено зв'язків з неіснуючими рядками",
+        "DELETE FROM playlisttracks WHERE playlist_id IS NULL OR track_id IS NULL "
+        "OR playlist_id NOT IN (SELECT id FROM playlists) OR track_id NOT IN (SELECT id FROM tracks)")
+    _log_rows(connection, "playlisttracks: видалено дублікатів",
+        "DELETE FROM playlisttracks WHERE id NOT IN "
+        "(SELECT MIN(id) FROM playlisttracks GROUP BY playlist_id, track_id)")
+
+    for table in (models.Track.__table__, models.PlayList.__table__, models.PlaylistTrack.__table__):
+        if connection.dialect.name == "sqlite" and not _has_cascades(connection, table):
+            _rebuild_sqlite_table(connection, table)
+        else:
+            _create_indexes(connection, table)
+
+# 4. Повнотекстовий пошук (FTS5 індекси і тригери)
+def _search_index(connection):
+    create_search_index(connection)
+
+# 5. Метадані аудіофайлів треків. Для вже доданих треків їх заповнює python audio_meta.py
+def _audio_meta(connection):
+    _add_column_if_missing(connection, "tracks", "bitrate", "INTEGER")
+    _add_column_if_missing(connection, "tracks", "sample_rate", "INTEGER")
+    _add_column_if_missing(connection, "tracks", "content_hash", "VARCHAR")
+    _create_indexes(connection, models.Track.__table__)
+
+# 6. Завантаження файлів частинами
+def _uploads(connection):
+    models.Upload.__table__.create(connection, checkfirst=True)
+
+# 7. Прослуховування: журнал подій і лічильники на треках
+def _plays(connection):
+    models.PlayEvent.__table__.create(connection, checkfirst=True)
+    _add_column_if_missing(connection, "tracks", "play_count", "INTEGER NOT NULL DEFAULT 0")
+    _add_column_if_missing(connection, "tracks", "listen_ms", "INTEGER NOT NULL DEFAULT 0")
+
+# 8. Журнал змінених плейлистів для інкрементальної перебудови схожих треків (related.py)
+def _related_changes(connection):
+    create_change_log(connection)
+
+# 9. Кількість треків і сумарна тривалість на авторах і плейлистах: колонки, тригери і
+#    початкові значення для вже існуючих даних
+def _aggregates(connection):
+    for table in ("authors", "playlists"):
+        _add_column_if_missing(connection, table, "track_count", "INTEGER NOT NULL DEFAULT 0")
+        _add_column_if_missing(connection, table, "total_duration", "INTEGER NOT NULL DEFAULT 0")
+
+    create_aggregate_triggers(connection)
+    repair_aggregates(connection)
+
+# 10. Журнал змінених плейлистів без повторів: по рядку на плейлист, а не на кожну зміну
+def _related_changes_compact(connection):
+    compact_change_log(connection)
+
+MIGRATIONS = [
+    (1, _initial),
+    (2, _playlist_position),
+    (3, _constraints),
+    (4, _search_index),
+    (5, _audio_meta),
+    (6, _uploads),
+    (7, _plays),
+    (8, _related_changes),
+    (9, _aggregates),
+    (10, _related_changes_compact),
+]
+
+#-----------------------------------------------------------------------------------------------#
+
+def current_version(connection) -> int:
+    schema_version.create(connection, checkfirst=True)
+    return connection.execute(schema_version.select()).scalar() or 0
+
+def _set_version(connection, version: int):
+    connection.execute(schema_version.delete())
+    connection.execute(schema_version.insert().values(version=version))
+
+# Застосовує всі міграції, новіші за поточну версію схеми.
+# Для SQLite на час міграцій вимикається перевірка зовнішніх ключів (інакше перебудова таблиці
+# запустила б каскадні видалення), а після них перевіряється, що всі ключі коректні.
+def upgrade(bind=engine):
+    with bind.connect() as connection:
+        sqlite = connection.dialect.name == "sqlite"
+
+        if sqlite:
+            connection.exec_driver_sql("PRAGMA foreign_keys = OFF")
+
+        try:
+            version = current_version(connection)
+            connection.commit()
+
+            for number, migration in MIGRATIONS:
+                if number <= version:
+                    continue
+
+                logger.info("Міграція %d: %s", number, migration.__name__)
+                migration(connection)
+                _set_version(connection, number)
+                connection.commit()
+
+            if sqlite:
+                problems = connection.exec_driver_sql("PRAGMA foreign_key_check").fetchall()
+
+                if problems:
+                    raise RuntimeError("Порушені зовнішні ключі після міграції: %r" % problems[:10])
+        finally:
+            # PRAGMA foreign_keys не діє всередині транзакції, тому незавершена транзакція
+            # (після помилки) спочатку відкочується
+            connection.rollback()
+
+            if sqlite:
+                connection.exec_driver_sql("PRAGMA foreign_keys = ON")
+
+#-----------------------------------------------------------------------------------------------#
+
+# Видаляє треки без автора і плейлисти без користувача - те, що залишилось після видалень
+# без каскаду. Лише явно: python migrations.py --prune-orphans. Зв'язки з плейлистами і
+# прослуховування видаляються каскадом, а аудіофайли (якщо на них більше не посилається
+# жоден трек) і файли хвиль - тут же. Повертає {таблиця: видалено рядків, "files": файлів}.
+def prune_orphans(bind=engine) -> dict:
+    with bind.connect() as connection:
+        tracks = connection.execute(text("SELECT id, file_name FROM tracks WHERE author_id IS NULL")).all()
+
+        removed = {
+            "tracks": _log_rows(connection, "tracks: видалено треків без автора", "DELETE FROM tracks WHERE author_id IS NULL"),
+            "playlists": _log_rows(connection, "playlists: видалено плейлистів без користувача", "DELETE FROM playlists WHERE user_id IS NULL"),
+            "files": 0,
+        }
+        used = {row.file_name for row in connection.execute(text("SELECT DISTINCT file_name FROM tracks"))}
+        connection.commit()
+
+    for track_id, file_name in tracks:
+        paths = [sidecar_path(track_id, file_name)]
+
+        if file_name not in used:
+            paths.append(track_file_path(file_name))
+
+        for path in paths:
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+                removed["files"] += 1
+                logger.info("Видалено файл %s", path)
+
+    if removed["tracks"]:
+        cache.invalidate_all("tracks")
+
+    if removed["playlists"]:
+        cache.invalidate_all("playlists")
+
+    return removed
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    upgrade()
+
+    if "--prune-orphans" in sys.argv[1:]:
+        print("Видалено: %s" % ", ".join("%s - %d" % item for item in prune_orphans().items()))
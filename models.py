@@ -1,6 +1,6 @@
 # Моделі - те, як дані зберігаються в базі даних. Тут у вигляді класів потрібно описати структуру таблиць.
 
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from database import Base
     
@@ -9,8 +9,13 @@ class Author(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     nickname = Column(String, index=True, unique=True)
+    # Кількість треків і їхня сумарна тривалість, підтримуються тригерами (aggregates.py)
+    track_count = Column(Integer, nullable=False, default=0, server_default="0")
+    total_duration = Column(Integer, nullable=False, default=0, server_default="0")
     
-    tracks_connection = relationship("Track", back_populates="authors_connection")
+    # passive_deletes - видалення залежних рядків виконує сама БД (ON DELETE CASCADE),
+    # ORM не завантажує їх лише для того, щоб видалити чи обнулити зовнішній ключ
+    tracks_connection = relationship("Track", back_populates="authors_connection", passive_deletes=True)
     
 class Track(Base):
     __tablename__ = "tracks"
@@ -18,11 +23,18 @@ class Track(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True, unique=True)
     duration = Column(Integer)
-    author_id = Column(Integer, ForeignKey("authors.id"))
+    author_id = Column(Integer, ForeignKey("authors.id", ondelete="CASCADE"), index=True)
     file_name = Column(String)
+    # Метадані аудіофайлу (audio_meta.py): бітрейт в кбіт/с, частота в Гц, sha256 вмісту
+    bitrate = Column(Integer)
+    sample_rate = Column(Integer)
+    content_hash = Column(String, index=True)
+    # Лічильники прослуховувань, оновлюються пачками (plays.py)
+    play_count = Column(Integer, nullable=False, default=0, server_default="0")
+    listen_ms = Column(Integer, nullable=False, default=0, server_default="0")
     
     authors_connection = relationship("Author", back_populates="tracks_connection")
-    playlisttracks_connection = relationship("PlaylistTrack", back_populates="track_connection")
+    playlisttracks_connection = relationship("PlaylistTrack", back_populates="track_connection", passive_deletes=True)
 
 class User(Base):
     __tablename__ = "users"
@@ -31,24 +43,59 @@ class User(Base):
     login = Column(String, unique=True, index=True)
     password = Column(String)
     
-    playlist_connection = relationship("PlayList", back_populates="user_connection")
+    playlist_connection = relationship("PlayList", back_populates="user_connection", passive_deletes=True)
     
 class PlayList(Base):
     __tablename__ = "playlists"
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    # Кількість треків і їхня сумарна тривалість, підтримуються тригерами (aggregates.py)
+    track_count = Column(Integer, nullable=False, default=0, server_default="0")
+    total_duration = Column(Integer, nullable=False, default=0, server_default="0")
     
-    playlisttracks_connection = relationship("PlaylistTrack", back_populates="playlist_connection")
+    playlisttracks_connection = relationship("PlaylistTrack", back_populates="playlist_connection", order_by="[PlaylistTrack.position, PlaylistTrack.id]", passive_deletes=True)
     user_connection = relationship("User", back_populates="playlist_connection")
     
 class PlaylistTrack(Base):
     __tablename__ = "playlisttracks"
+    __table_args__ = (
+        Index("ix_playlisttracks_playlist_position", "playlist_id", "position"),
+        UniqueConstraint("playlist_id", "track_id", name="uq_playlisttracks_playlist_track"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    playlist_id = Column(Integer, ForeignKey("playlists.id"))
-    track_id = Column(Integer, ForeignKey("tracks.id"))
+    playlist_id = Column(Integer, ForeignKey("playlists.id", ondelete="CASCADE"))
+    track_id = Column(Integer, ForeignKey("tracks.id", ondelete="CASCADE"), index=True)
+    # Розріджений ключ порядку: між сусідніми треками залишається проміжок (POSITION_GAP),
+    # тому переміщення треку змінює лише один рядок, а не перенумеровує весь плейлист
+    position = Column(Integer)
     
     playlist_connection = relationship("PlayList", back_populates="playlisttracks_connection")
-    track_connection = relationship("Track", back_populates="playlisttracks_connection")
\ No newline at end of file
+    track_connection = relationship("Track", back_populates="playlisttracks_connection")
+
+# Завантаження аудіофайлу частинами (uploads.py). Скільки байт вже отримано - це розмір файлу
+# <id>.part у папці завантажень, тому в БД зберігається лише те, що не змінюється під час завантаження.
+class Upload(Base):
+    __tablename__ = "uploads"
+    
+    id = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    file_name = Column(String)
+    size = Column(Integer)
+    sha256 = Column(String)
+    created_at = Column(Float)
+    # Трек, до якого прив'язано файл після завершення завантаження
+    track_id = Column(Integer, ForeignKey("tracks.id", ondelete="SET NULL"), index=True)
+
+# Одне прослуховування треку. Записуються пачками з буфера в пам'яті (plays.py).
+class PlayEvent(Base):
+    __tablename__ = "play_events"
+    
+    id = Column(Integer, primary_key=True)
+    track_id = Column(Integer, ForeignKey("tracks.id", ondelete="CASCADE"), index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    listened_ms = Column(Integer)
+    created_at = Column(Float)
+
@@ -0,0 +1,54 @@
+# Посторінкова видача списків за курсором (keyset pagination).
+# Замість OFFSET запам'ятовуємо id останнього запису сторінки і наступну сторінку починаємо з
+# WHERE id > last_id ORDER BY id. Тому будь-яка сторінка коштує стільки ж, скільки й перша.
+# Курсор для клієнта непрозорий - це просто закодоване в base64 значення.
+
+import base64
+
+from sqlalchemy import select
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 500
+
+def encode_cursor(value: int) -> str:
+    return base64.urlsafe_b64encode(str(value).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> int:
+    padded = cursor + "=" * (-len(cursor) % 4)
+
+    try:
+        return int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Некоректний курсор")
+
+# Вибирає одну сторінку запиту, відсортованого за column.
+# Береться limit + 1 запис, щоб дізнатися, чи є наступна сторінка, без окремого COUNT.
+def paginate(query, column, limit: int = DEFAULT_LIMIT, after_id: int = None):
+    if after_id is not None:
+        query = query.filter(column > after_id)
+
+    items = query.order_by(column).limit(limit + 1).all()
+    next_cursor = None
+
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(getattr(items[-1], column.key))
+
+    return {"items": items, "next_cursor": next_cursor}
+
+# Те саме, але без ORM: вибираються лише колонки columns, і кожен рядок повертається як словник
+# {назва колонки: значення}, готовий до серіалізації в JSON (див. fast_json.py).
+def paginate_rows(db, columns, column, limit: int = DEFAULT_LIMIT, after_id: int = None, *where):
+    statement = select(*columns).where(*where)
+
+    if after_id is not None:
+        statement = statement.where(column > after_id)
+
+    items = [dict(row) for row in db.execute(statement.order_by(column).limit(limit + 1)).mappings()]
+    next_cursor = None
+
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1][column.key])
+
+    return {"items": items, "next_cursor": next_cursor}
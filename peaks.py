@@ -0,0 +1,279 @@
+# Хвильова форма треку (waveform) для перемотування в плеєрі без завантаження всього файлу.
+# Файл декодується один раз, і для кожного блоку з PEAKS_BASE_SAMPLES семплів рахуються
+# мінімум, максимум і RMS (NumPy, векторно, блоками - без завантаження всього аудіо в пам'ять).
+# З цього рівня будується піраміда: кожен наступний рівень удвічі грубіший, аж до PEAKS_MIN_COUNT
+# точок. Результат зберігається поруч у бінарному файлі PEAKS_DIR/<track_id>-<хеш file_name>.peaks
+# (id треку SQLite може видати повторно після видалення, тому лише id недостатньо):
+#
+#   заголовок  <4sBBBxIIQ  b"PEAK", версія, біти (8/16), кількість рівнів, частота, семплів на точку
+#                          (найдрібніший рівень), всього семплів
+#   рівні      <I * levels кількість точок на кожному рівні
+#   дані       для кожного рівня: трійки (min, max, rms) як int8 або int16, little-endian
+#
+# /tracks/{id}/peaks?resolution=N віддає один рівень (найгрубший, у якому не менше N точок),
+# тобто для хвилі шириною 1000 пікселів - кілька КБ замість усього аудіофайлу.
+# WAV декодується засобами Python, інші формати - через ffmpeg, якщо він встановлений.
+#
+# Побудувати хвилі для всіх треків: python peaks.py
+
+# pip install numpy
+
+import os
+import hashlib
+import shutil
+import struct
+import subprocess
+import tempfile
+import wave
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from sqlalchemy import select
+
+import models
+
+from streaming import track_file_path
+
+PEAKS_DIR = os.getenv("PEAKS_DIR", "peaks")
+PEAKS_BITS = int(os.getenv("PEAKS_BITS", 8))                   # 8 або 16
+PEAKS_BASE_SAMPLES = int(os.getenv("PEAKS_BASE_SAMPLES", 256))  # семплів на точку на найдрібнішому рівні
+PEAKS_MIN_COUNT = int(os.getenv("PEAKS_MIN_COUNT", 256))         # точок на найгрубшому рівні
+# Частота, до якої ffmpeg передискретизує аудіо (для хвилі вистачає і меншої, ніж 44.1 кГц)
+PEAKS_SAMPLE_RATE = int(os.getenv("PEAKS_SAMPLE_RATE", 22050))
+DECODE_BLOCK = 1024 * 1024                                       # семплів за один крок
+FFMPEG = shutil.which("ffmpeg")
+
+HEADER = struct.Struct("<4sBBBxIIQ")
+MAGIC = b"PEAK"
+VERSION = 1
+
+#-----------------------------------------------------------------------------------------------#
+
+# Декодування - генератори блоків моно семплів float32 в діапазоні [-1, 1]
+
+def _wav_blocks(reader):
+    try:
+        channels = reader.getnchannels()
+        width = reader.getsampwidth()
+
+        while True:
+            frames = reader.readframes(DECODE_BLOCK // channels)
+
+            if not frames:
+                return
+
+            if width == 1:
+                samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) / 128
+            elif width == 3:
+                raw = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3)
+                values = raw[:, 0].astype(np.int32) | (raw[:, 1].astype(np.int32) << 8) | (raw[:, 2].astype(np.int32) << 16)
+                samples = (np.where(values & 0x800000, values - 0x1000000, values)).astype(np.float32) / 0x800000
+            else:
+                dtype = {2: "<i2", 4: "<i4"}[width]
+                samples = np.frombuffer(frames, dtype=dtype).astype(np.float32) / float(2 ** (8 * width - 1))
+
+            yield samples.reshape(-1, channels).mean(axis=1)
+    finally:
+        reader.close()
+
+def _ffmpeg_blocks(process):
+    try:
+        while True:
+            data = process.stdout.read(DECODE_BLOCK * 4)
+
+            if not data:
+                return
+
+            yield np.frombuffer(data[:len(data) // 4 * 4], dtype="<f4")
+    finally:
+        process.stdout.close()
+        process.wait()
+
+# Повертає (частота, генератор блоків) або None, якщо файл не вдається декодувати
+def decode(path: str):
+    try:
+        reader = wave.open(path, "rb")
+    except (wave.Error, EOFError):
+        reader = None
+
+    if reader is not None:
+        return reader.getframerate(), _wav_blocks(reader)
+
+    if FFMPEG is None:
+        return None
+
+    process = subprocess.Popen(
+        [FFMPEG, "-v", "error", "-i", path, "-f", "f32le", "-ac", "1", "-ar", str(PEAKS_SAMPLE_RATE), "-"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    return PEAKS_SAMPLE_RATE, _ffmpeg_blocks(process)
+
+#-----------------------------------------------------------------------------------------------#
+
+# min, max і середній квадрат для кожних size семплів
+def _reduce(samples, size: int):
+    frames = samples.reshape(-1, size)
+    return frames.min(axis=1), frames.max(axis=1), np.einsum("ij,ij->i", frames, frames) / size
+
+# Найдрібніший рівень: потоково, з залишком, який переноситься в наступний блок
+def base_level(blocks, size: int = PEAKS_BASE_SAMPLES):
+    mins, maxs, squares = [], [], []
+    rest = np.empty(0, dtype=np.float32)
+    total = 0
+
+    for block in blocks:
+        total += len(block)
+        data = np.concatenate((rest, block)) if len(rest) else block
+        full = len(data) // size * size
+
+        if full:
+            level = _reduce(data[:full], size)
+            mins.append(level[0])
+            maxs.append(level[1])
+            squares.append(level[2])
+
+        rest = data[full:]
+
+    if len(rest):
+        level = _reduce(np.pad(rest, (0, size - len(rest)), mode="edge"), size)
+        mins.append(level[0])
+        maxs.append(level[1])
+        squares.append(level[2])
+
+    if not mins:
+        return None, 0
+
+    return (np.concatenate(mins), np.concatenate(maxs), np.concatenate(squares)), total
+
+# Наступний рівень піраміди - пари сусідніх точок об'єднуються в одну
+def _halve(level):
+    mins, maxs, squares = level
+
+    if len(mins) % 2:
+        mins, maxs, squares = (np.append(array, array[-1]) for array in (mins, maxs, squares))
+
+    return (
+        np.minimum(mins[0::2], mins[1::2]),
+        np.maximum(maxs[0::2], maxs[1::2]),
+        (squares[0::2] + squares[1::2]) / 2,
+    )
+
+def pyramid(level, min_count: int = PEAKS_MIN_COUNT) -> list:
+    levels = [level]
+
+    while len(levels[-1][0]) > min_count:
+        levels.append(_halve(levels[-1]))
+
+    return levels
+
+def _quantize(level, bits: int) -> bytes:
+    scale = 2 ** (bits - 1) - 1
+    mins, maxs, squares = level
+    values = np.stack((mins, maxs, np.sqrt(squares)), axis=1)
+
+    return np.clip(np.round(values * scale), -scale, scale).astype("<i%d" % (bits // 8)).tobytes()
+
+#-----------------------------------------------------------------------------------------------#
+
+def encode(levels: list, sample_rate: int, total_samples: int, bits: int = PEAKS_BITS) -> bytes:
+    header = HEADER.pack(MAGIC, VERSION, bits, len(levels), sample_rate, PEAKS_BASE_SAMPLES, total_samples)
+    counts = struct.pack("<%dI" % len(levels), *(len(level[0]) for level in levels))
+
+    return header + counts + b"".join(_quantize(level, bits) for level in levels)
+
+def sidecar_path(track_id: int, file_name: str) -> str:
+    key = hashlib.sha1((file_name or "").encode("utf-8")).hexdigest()[:16]
+    return os.path.join(PEAKS_DIR, "%d-%s.peaks" % (track_id, key))
+
+def remove_peaks(track_id: int, file_name: str) -> bool:
+    try:
+        os.remove(sidecar_path(track_id, file_name))
+    except FileNotFoundError:
+        return False
+
+    return True
+
+# Будує файл хвилі, якщо його немає або аудіофайл новіший. Повертає шлях або None,
+# якщо аудіо не вдалося декодувати. Виконується в пулі процесів (audio_meta.run_in_pool).
+def ensure_peaks(track_id: int, file_name: str):
+    path = track_file_path(file_name)
+
+    if path is None:
+        return None
+
+    sidecar = sidecar_path(track_id, file_name)
+
+    if os.path.exists(sidecar) and os.path.getmtime(sidecar) >= os.path.getmtime(path):
+        return sidecar
+
+    decoded = decode(path)
+
+    if decoded is None:
+        return None
+
+    sample_rate, blocks = decoded
+    level, total = base_level(blocks)
+
+    if level is None:
+        return None
+
+    os.makedirs(PEAKS_DIR, exist_ok=True)
+
+    # Запис у тимчасовий файл і перейменування - читачі ніколи не бачать недописаний файл
+    fd, temp = tempfile.mkstemp(dir=PEAKS_DIR, suffix=".tmp")
+
+    with os.fdopen(fd, "wb") as file:
+        file.write(encode(pyramid(level), sample_rate, total))
+
+    os.replace(temp, sidecar)
+    return sidecar
+
+#-----------------------------------------------------------------------------------------------#
+
+# Читає з файлу лише один рівень - найгрубший, у якому не менше resolution точок.
+# Повертає (дані, опис рівня).
+def read_level(sidecar: str, resolution: int):
+    with open(sidecar, "rb") as file:
+        magic, version, bits, level_count, sample_rate, base_samples, total = HEADER.unpack(file.read(HEADER.size))
+
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Некоректний файл хвилі: %s" % sidecar)
+
+        counts = struct.unpack("<%dI" % level_count, file.read(4 * level_count))
+        point_size = 3 * bits // 8
+
+        index = 0
+
+        for number, count in enumerate(counts):
+            if count >= resolution:
+                index = number
+
+        file.seek(HEADER.size + 4 * level_count + sum(counts[:index]) * point_size)
+        data = file.read(counts[index] * point_size)
+
+    return data, {
+        "level": index,
+        "bits": bits,
+        "count": counts[index],
+        "samples_per_peak": base_samples * 2 ** index,
+        "sample_rate": sample_rate,
+        "total_samples": total,
+    }
+
+#-----------------------------------------------------------------------------------------------#
+
+def build_all(db) -> int:
+    rows = db.execute(select(models.Track.id, models.Track.file_name).order_by(models.Track.id)).all()
+
+    with ProcessPoolExecutor() as executor:
+        built = executor.map(ensure_peaks, [row.id for row in rows], [row.file_name for row in rows])
+        return sum(1 for sidecar in built if sidecar is not None)
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    with SessionLocal() as db:
+        print("Хвилі побудовано: %d" % build_all(db))
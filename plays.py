@@ -0,0 +1,141 @@
+# Прослуховування треків (POST /tracks/{id}/play) з відкладеним записом у БД.
+# Окремий INSERT + commit на кожну подію означав би fsync на кожне прослуховування, тому маршрут
+# лише кладе подію в буфер у пам'яті і одразу відповідає 202. Фонова задача (запускається в
+# lifespan) кожні PLAYS_FLUSH_MS мілісекунд або щойно набралося PLAYS_FLUSH_EVENTS подій записує їх
+# пачкою: журнал play_events + лічильники play_count / listen_ms на треках (crud.record_plays).
+# Буфер обмежений PLAYS_BUFFER_MAX подіями: якщо БД не встигає, нові події відхиляються (503),
+# а пам'ять не росте. При зупинці сервера все, що залишилося в буфері, записується.
+
+import os
+import time
+import asyncio
+import logging
+import threading
+
+from collections import deque
+
+import async_crud
+
+from database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+PLAYS_FLUSH_MS = int(os.getenv("PLAYS_FLUSH_MS", 1000))
+PLAYS_FLUSH_EVENTS = int(os.getenv("PLAYS_FLUSH_EVENTS", 1000))
+PLAYS_BUFFER_MAX = int(os.getenv("PLAYS_BUFFER_MAX", 100000))
+
+class PlayBufferFull(Exception):
+    pass
+
+#-----------------------------------------------------------------------------------------------#
+
+class PlayBuffer:
+    def __init__(self, max_size: int = PLAYS_BUFFER_MAX):
+        self.max_size = max_size
+        self._events = deque()
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.rejected = 0
+        self.flushed = 0
+        self.errors = 0
+
+    def __len__(self):
+        return len(self._events)
+
+    def add(self, track_id: int, user_id: int, listened_ms: int):
+        with self._lock:
+            if len(self._events) >= self.max_size:
+                self.rejected += 1
+                raise PlayBufferFull()
+
+            self._events.append({"track_id": track_id, "user_id": user_id, "listened_ms": listened_ms, "created_at": time.time()})
+            self.accepted += 1
+
+    def take(self, limit: int) -> list:
+        with self._lock:
+            return [self._events.popleft() for _ in range(min(limit, len(self._events)))]
+
+    # Невдало записана пачка повертається на початок буфера - наскільки дозволяє місце
+    def put_back(self, events: list):
+        with self._lock:
+            room = self.max_size - len(self._events)
+            self._events.extendleft(reversed(events[:room]))
+            self.rejected += max(0, len(events) - room)
+
+    def stats(self) -> dict:
+        return {
+            "buffered": len(self._events),
+            "max": self.max_size,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "flushed": self.flushed,
+            "flush_errors": self.errors,
+        }
+
+buffer = PlayBuffer()
+
+_wakeup = None
+_task = None
+
+#-----------------------------------------------------------------------------------------------#
+
+# Приймає подію, не чекаючи на БД. PlayBufferFull - якщо буфер заповнений.
+def record(track_id: int, user_id: int, listened_ms: int):
+    buffer.add(track_id, user_id, listened_ms)
+
+    if _wakeup is not None and len(buffer) >= PLAYS_FLUSH_EVENTS:
+        _wakeup.set()
+
+# Записує все, що є в буфері, пачками по PLAYS_FLUSH_EVENTS
+async def flush():
+    while True:
+        events = buffer.take(PLAYS_FLUSH_EVENTS)
+
+        if not events:
+            return
+
+        try:
+            async with AsyncSessionLocal() as db:
+                await async_crud.record_plays(db, events)
+        except asyncio.CancelledError:
+            # Зупинка сервера посеред запису - пачка дозапишеться в stop()
+            buffer.put_back(events)
+            raise
+        except Exception:
+            buffer.errors += 1
+            buffer.put_back(events)
+            logger.exception("Не вдалося записати %d прослуховувань", len(events))
+            return
+
+        buffer.flushed += len(events)
+
+async def _run():
+    while True:
+        try:
+            await asyncio.wait_for(_wakeup.wait(), PLAYS_FLUSH_MS / 1000)
+        except asyncio.TimeoutError:
+            pass
+
+        _wakeup.clear()
+        await flush()
+
+def start():
+    global _wakeup, _task
+
+    _wakeup = asyncio.Event()
+    _task = asyncio.create_task(_run())
+
+async def stop():
+    global _wakeup, _task
+
+    if _task is not None:
+        _task.cancel()
+
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+
+    _wakeup = None
+    _task = None
+    await flush()
@@ -0,0 +1,435 @@
+# Схожі треки (/tracks/{id}/related) за тим, які треки користувачі складають в одні плейлисти.
+#
+# З таблиці playlisttracks будується розріджена матриця A (плейлист x трек), а з неї - матриця
+# спільних появ C = A^T A: C[i, j] - у скількох плейлистах є і трек i, і трек j, а на діагоналі -
+# у скількох плейлистах є сам трек. Схожість - косинусна: C[i, j] / sqrt(C[i, i] * C[j, j]),
+# тобто популярні треки не стають "схожими" на все підряд. Для кожного треку зберігаються лише
+# RELATED_TOP_K найсхожіших сусідів у файлі RELATED_DIR/index.npy - масиві (трек x K) пар
+# (track_id, score), де номер рядка - це id треку. Файл відкривається через mmap, тому
+# відповідь на запит - це читання одного рядка з K елементів, без БД і без завантаження індексу
+# в пам'ять процесу.
+#
+# Перебудова інкрементальна: тригери на playlisttracks записують id змінених плейлистів у таблицю
+# related_changes. Поруч з індексом зберігаються A і C (state.npz), тому для змінених плейлистів
+# достатньо відняти їхній старий внесок у C і додати новий, а сусідів перерахувати лише для
+# треків, яких це стосується. Повна перебудова потрібна лише вперше (або якщо state.npz немає),
+# а для інших СУБД, де журналу змін немає, - щоразу.
+# Плейлисти, довші за RELATED_MAX_PLAYLIST треків, не враховуються: вони дають квадратичну
+# кількість пар і майже нічого не кажуть про схожість ("вся моя музика").
+#
+# Фонова задача (запускається в lifespan) оновлює індекс кожні RELATED_REFRESH_S секунд.
+# З RELATED_REFRESH_S=0 індекс сам не оновлюється - тоді python related.py --update треба
+# запускати за розкладом (cron), інакше схожі треки не бачать нових плейлистів.
+#
+#   python related.py            # повна перебудова
+#   python related.py --update   # лише зміни з моменту останньої перебудови
+
+# pip install numpy scipy
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import tempfile
+
+import numpy as np
+import scipy.sparse as sp
+
+from sqlalchemy import select, text
+
+import models
+
+logger = logging.getLogger(__name__)
+
+RELATED_DIR = os.getenv("RELATED_DIR", "related")
+RELATED_TOP_K = int(os.getenv("RELATED_TOP_K", 20))
+RELATED_MAX_PLAYLIST = int(os.getenv("RELATED_MAX_PLAYLIST", 500))
+# Пара треків має зустрітися хоча б у стількох плейлистах, щоб вважатися схожою
+RELATED_MIN_COOCCURRENCE = int(os.getenv("RELATED_MIN_COOCCURRENCE", 1))
+RELATED_REFRESH_S = float(os.getenv("RELATED_REFRESH_S", 300))      # 0 - не оновлювати у фоні (лише cron)
+RELATED_BATCH = int(os.getenv("RELATED_BATCH", 100000))             # зв'язків за один SELECT
+RELATED_ROW_BATCH = int(os.getenv("RELATED_ROW_BATCH", 10000))      # треків за один крок top-K
+
+INDEX_DTYPE = np.dtype([("track", "<i4"), ("score", "<f4")])
+EMPTY = -1
+SCORE_SCALE = 1 << 24
+
+_stats = {"built_at": 0.0, "last_seconds": 0.0, "last_playlists": 0, "errors": 0}
+_index = None
+_task = None
+
+#-----------------------------------------------------------------------------------------------#
+
+# Журнал змінених плейлистів. Тригери видаляються разом з таблицею, тому міграція, яка
+# перебудовує playlisttracks, має викликати цю функцію ще раз (як і create_search_index).
+# На кожен плейлист у журналі не більше одного рядка: попередній запис видаляється, а новий
+# отримує новий id (більший за позначку, до якої update() вже прочитав журнал). Тому журнал
+# не більший за кількість плейлистів, навіть якщо update() довго не запускається.
+_CHANGE_TRIGGERS = ("related_changes_ai", "related_changes_ad", "related_changes_au")
+
+def _log_change(expression: str) -> str:
+    return (
+        "DELETE FROM related_changes WHERE playlist_id = {id}; "
+        "INSERT INTO related_changes (playlist_id) VALUES ({id}); ".format(id=expression)
+    )
+
+def create_change_log(connection):
+    if connection.dialect.name != "sqlite":
+        return
+
+    statements = [
+        "CREATE TABLE IF NOT EXISTS related_changes (id INTEGER PRIMARY KEY AUTOINCREMENT, playlist_id INTEGER NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS ix_related_changes_playlist_id ON related_changes (playlist_id)",
+
+        "CREATE TRIGGER IF NOT EXISTS related_changes_ai AFTER INSERT ON playlisttracks BEGIN "
+        + _log_change("new.playlist_id") + "END",
+
+        "CREATE TRIGGER IF NOT EXISTS related_changes_ad AFTER DELETE ON playlisttracks BEGIN "
+        + _log_change("old.playlist_id") + "END",
+
+        "CREATE TRIGGER IF NOT EXISTS related_changes_au AFTER UPDATE OF playlist_id, track_id ON playlisttracks BEGIN "
+        + _log_change("old.playlist_id") + _log_change("new.playlist_id") + "END",
+    ]
+
+    for statement in statements:
+        connection.execute(text(statement))
+
+# Журнал без повторів для БД, де тригери створені раніше (по рядку на кожну зміну)
+def compact_change_log(connection):
+    if connection.dialect.name != "sqlite":
+        return
+
+    for name in _CHANGE_TRIGGERS:
+        connection.execute(text("DROP TRIGGER IF EXISTS %s" % name))
+
+    create_change_log(connection)
+    connection.execute(text(
+        "DELETE FROM related_changes WHERE id NOT IN (SELECT MAX(id) FROM related_changes GROUP BY playlist_id)"
+    ))
+
+def _has_change_log(db) -> bool:
+    return db.get_bind().dialect.name == "sqlite"
+
+def _last_change(db) -> int:
+    return db.scalar(text("SELECT COALESCE(MAX(id), 0) FROM related_changes")) if _has_change_log(db) else 0
+
+def _changed_playlists(db, last: int):
+    return np.array(db.scalars(text("SELECT DISTINCT playlist_id FROM related_changes WHERE id <= :last"), {"last": last}).all(), dtype=np.int64)
+
+def _clear_changes(db, last: int):
+    if _has_change_log(db):
+        db.execute(text("DELETE FROM related_changes WHERE id <= :last"), {"last": last})
+        db.commit()
+
+#-----------------------------------------------------------------------------------------------#
+
+# Зв'язки (playlist_id, track_id) пачками по RELATED_BATCH - лише двома масивами int
+def _read_links(db, playlist_ids=None):
+    links = models.PlaylistTrack
+    playlists, tracks = [], []
+
+    def read(statement):
+        result = db.execute(statement.execution_options(yield_per=RELATED_BATCH))
+
+        for rows in result.partitions():
+            batch = np.array(rows, dtype=np.int64).reshape(-1, 2)
+            playlists.append(batch[:, 0])
+            tracks.append(batch[:, 1])
+
+    statement = select(links.playlist_id, links.track_id).where(links.playlist_id.is_not(None), links.track_id.is_not(None))
+
+    if playlist_ids is None:
+        read(statement)
+    else:
+        # IN з тисячами параметрів SQLite не прийме - змінені плейлисти читаються частинами
+        for start in range(0, len(playlist_ids), 500):
+            read(statement.where(links.playlist_id.in_(playlist_ids[start:start + 500].tolist())))
+
+    if not playlists:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    return np.concatenate(playlists), np.concatenate(tracks)
+
+# Матриця плейлист x трек з одиницями. Занадто довгі плейлисти відкидаються.
+def _membership(playlists, tracks, shape):
+    if len(playlists):
+        keep = np.bincount(playlists)[playlists] <= RELATED_MAX_PLAYLIST
+        playlists, tracks = playlists[keep], tracks[keep]
+
+    return sp.csr_matrix((np.ones(len(playlists), dtype=np.int32), (playlists, tracks)), shape=shape)
+
+def _grow(matrix, shape):
+    shape = tuple(max(a, b) for a, b in zip(matrix.shape, shape))
+
+    if shape != matrix.shape:
+        matrix = matrix.copy()
+        matrix.resize(shape)
+
+    return matrix
+
+#-----------------------------------------------------------------------------------------------#
+
+# Сусіди для треків rows за матрицею спільних появ: масив (len(rows), K) з INDEX_DTYPE.
+# Усе векторно: кандидати сортуються за (рядок, -схожість, id), і з кожного рядка беруться перші K.
+# Замість lexsort за трьома ключами - один стабільний argsort за цілим ключем (рядок, схожість,
+# округлена до 2^-24 - тоді однакові схожості, пораховані з різною похибкою, справді однакові),
+# а id вже йдуть за зростанням у кожному рядку CSR матриці.
+def _top_k(cooccurrence, rows):
+    counts = cooccurrence.diagonal().astype(np.float64)
+    result = np.empty((len(rows), RELATED_TOP_K), dtype=INDEX_DTYPE)
+    result["track"] = EMPTY
+    result["score"] = 0
+
+    for start in range(0, len(rows), RELATED_ROW_BATCH):
+        batch = rows[start:start + RELATED_ROW_BATCH]
+        block = cooccurrence[batch].tocoo()
+        keep = (block.col != batch[block.row]) & (block.data >= RELATED_MIN_COOCCURRENCE)
+        row, col, shared = block.row[keep], block.col[keep], block.data[keep]
+
+        score = shared / np.sqrt(counts[batch[row]] * counts[col])
+        order = np.argsort(row.astype(np.int64) * (SCORE_SCALE + 1) + SCORE_SCALE - np.round(score * SCORE_SCALE).astype(np.int64), kind="stable")
+        row, col, score = row[order], col[order], score[order]
+
+        rank = np.arange(len(row)) - np.searchsorted(row, row)
+        keep = rank < RELATED_TOP_K
+        result["track"][start + row[keep], rank[keep]] = col[keep]
+        result["score"][start + row[keep], rank[keep]] = score[keep]
+
+    return result
+
+# Треки, чиї списки сусідів треба перерахувати після зміни плейлистів.
+# Пари змінились лише серед touched (треків змінених плейлистів), тому їхні рядки - завжди.
+# Але разом з C[j, j] змінюється схожість треку j з усіма його сусідами i. Рядок i від цього
+# зміниться, лише якщо j вже є в його списку або нова схожість не гірша за останню в списку -
+# решту рядків (а це зазвичай більшість каталогу) можна не чіпати.
+def _affected(cooccurrence, index, touched):
+    block = cooccurrence[touched].tocoo()
+    keep = (block.data >= RELATED_MIN_COOCCURRENCE) & ~np.isin(block.col, touched)
+    neighbor, track, shared = touched[block.row[keep]], block.col[keep], block.data[keep]
+
+    counts = cooccurrence.diagonal().astype(np.float64)
+    score = shared / np.sqrt(counts[track] * counts[neighbor])
+    listed = (index["track"][track] == neighbor[:, None]).any(axis=1)
+    # Схожості в індексі - float32, тому з запасом на округлення
+    affected = listed | (score >= index["score"][track, -1] - 1e-6)
+
+    return np.union1d(touched, track[affected])
+
+#-----------------------------------------------------------------------------------------------#
+
+def index_path() -> str:
+    return os.path.join(RELATED_DIR, "index.npy")
+
+def state_path() -> str:
+    return os.path.join(RELATED_DIR, "state.npz")
+
+# Запис у тимчасовий файл і перейменування - читачі (mmap) ніколи не бачать недописаний файл,
+# а вже відкритий старий файл залишається доступним, поки його не закриють
+def _atomic_write(path: str, write):
+    os.makedirs(RELATED_DIR, exist_ok=True)
+    fd, temp = tempfile.mkstemp(dir=RELATED_DIR, suffix=".tmp")
+
+    try:
+        with os.fdopen(fd, "wb") as file:
+            write(file)
+
+        os.replace(temp, path)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+def _save_index(index):
+    _atomic_write(index_path(), lambda file: np.save(file, index))
+
+# A і C в одному файлі, щоб вони ніколи не розходилися між собою
+def _save_state(membership, cooccurrence):
+    arrays = {}
+
+    for name, matrix in (("membership", membership), ("cooccurrence", cooccurrence)):
+        arrays.update({
+            name + "_data": matrix.data,
+            name + "_indices": matrix.indices,
+            name + "_indptr": matrix.indptr,
+            name + "_shape": np.array(matrix.shape),
+        })
+
+    _atomic_write(state_path(), lambda file: np.savez(file, **arrays))
+
+def _load_state():
+    if not os.path.exists(state_path()) or not os.path.exists(index_path()):
+        return None
+
+    with np.load(state_path()) as state:
+        return tuple(
+            sp.csr_matrix((state[name + "_data"], state[name + "_indices"], state[name + "_indptr"]), shape=tuple(state[name + "_shape"]))
+            for name in ("membership", "cooccurrence")
+        )
+
+#-----------------------------------------------------------------------------------------------#
+
+# Повна перебудова. Повертає кількість треків в індексі.
+def build(db) -> int:
+    last = _last_change(db)
+    playlists, tracks = _read_links(db)
+    shape = (int(playlists.max(initial=-1)) + 1, int(tracks.max(initial=-1)) + 1)
+
+    membership = _membership(playlists, tracks, shape)
+    cooccurrence = (membership.T @ membership).tocsr()
+    cooccurrence.eliminate_zeros()
+    cooccurrence.sort_indices()
+
+    _save_index(_top_k(cooccurrence, np.arange(shape[1])))
+    _save_state(membership, cooccurrence)
+    _clear_changes(db, last)
+
+    return shape[1]
+
+# Інкрементальне оновлення за журналом related_changes. Повертає кількість змінених плейлистів.
+# Якщо оновлення перервалося, журнал не очищується, і ті самі плейлисти будуть оброблені
+# наступного разу - повторне застосування змін дає той самий результат.
+def update(db) -> int:
+    state = _load_state() if _has_change_log(db) else None
+
+    if state is None:
+        build(db)
+        return -1
+
+    membership, cooccurrence = state
+    index = np.load(index_path())
+
+    # Змінився RELATED_TOP_K - старий індекс не підходить
+    if index.shape[1] != RELATED_TOP_K:
+        build(db)
+        return -1
+
+    last = _last_change(db)
+    changed = _changed_playlists(db, last)
+
+    if not len(changed):
+        return 0
+
+    playlists, tracks = _read_links(db, changed)
+    shape = (
+        max(membership.shape[0], int(playlists.max(initial=-1)) + 1, int(changed.max()) + 1),
+        max(membership.shape[1], int(tracks.max(initial=-1)) + 1),
+    )
+    membership = _grow(membership, shape)
+    cooccurrence = _grow(cooccurrence, (shape[1], shape[1]))
+
+    # Рядки змінених плейлистів: як було (зі збереженої A) і як стало (з БД)
+    current = _membership(playlists, tracks, shape)
+    unchanged = np.ones(shape[0], dtype=np.int32)
+    unchanged[changed] = 0
+    old = membership[changed]
+    new = current[changed]
+
+    cooccurrence = (cooccurrence - old.T @ old + new.T @ new).tocsr()
+    cooccurrence.eliminate_zeros()
+    cooccurrence.sort_indices()
+    membership = (sp.diags(unchanged, dtype=np.int32) @ membership + current).tocsr()
+
+    touched = np.union1d(old.indices, new.indices)
+
+    if len(index) < shape[1]:
+        grown = np.empty((shape[1], RELATED_TOP_K), dtype=INDEX_DTYPE)
+        grown["track"] = EMPTY
+        grown["score"] = 0
+        grown[:len(index)] = index
+        index = grown
+
+    affected = _affected(cooccurrence, index, touched)
+    index[affected] = _top_k(cooccurrence, affected)
+
+    _save_index(index)
+    _save_state(membership, cooccurrence)
+    _clear_changes(db, last)
+
+    return len(changed)
+
+#-----------------------------------------------------------------------------------------------#
+
+# Сусіди треку: список (track_id, score), не більше limit. Індекс відкривається через mmap
+# і перевідкривається, коли фонова задача записала новий файл.
+def lookup(track_id: int, limit: int = RELATED_TOP_K) -> list:
+    global _index
+
+    try:
+        mtime = os.stat(index_path()).st_mtime_ns
+    except FileNotFoundError:
+        return []
+
+    if _index is None or _index[0] != mtime:
+        _index = (mtime, np.load(index_path(), mmap_mode="r"))
+
+    index = _index[1]
+
+    if track_id < 0 or track_id >= len(index):
+        return []
+
+    row = index[track_id][:limit]
+    return [(int(neighbor), float(score)) for neighbor, score in zip(row["track"], row["score"]) if neighbor != EMPTY]
+
+def stats() -> dict:
+    try:
+        tracks = len(np.load(index_path(), mmap_mode="r"))
+    except FileNotFoundError:
+        tracks = 0
+
+    return {**_stats, "tracks": tracks}
+
+#-----------------------------------------------------------------------------------------------#
+
+def refresh() -> int:
+    from database import SessionLocal
+
+    start = time.perf_counter()
+
+    with SessionLocal() as db:
+        changed = update(db)
+
+    if changed:
+        _stats.update(built_at=time.time(), last_seconds=time.perf_counter() - start, last_playlists=changed)
+
+    return changed
+
+async def _run():
+    while True:
+        try:
+            # numpy/scipy відпускають GIL на важких операціях, тому окремого потоку досить
+            await asyncio.to_thread(refresh)
+        except Exception:
+            _stats["errors"] += 1
+            logger.exception("Не вдалося оновити індекс схожих треків")
+
+        await asyncio.sleep(RELATED_REFRESH_S)
+
+def start():
+    global _task
+
+    if RELATED_REFRESH_S > 0:
+        _task = asyncio.create_task(_run())
+
+async def stop():
+    global _task
+
+    if _task is not None:
+        _task.cancel()
+
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+
+    _task = None
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    logging.basicConfig(level=logging.INFO)
+
+    with SessionLocal() as db:
+        if "--update" in sys.argv[1:]:
+            print("Змінених плейлистів: %d" % update(db))
+        else:
+            print("Треків в індексі: %d" % build(db))
@@ -1,71 +1,132 @@
 # Існуючі шляхи на сторінки додатку. Можуть бути й повноцінні сторінки, так й сторінки для обробки запитів.
 
+import os
+
 import models
 import schemas
-import crud
-
-from fastapi import HTTPException, APIRouter, Depends, Request
+import async_crud
+import uploads
+import peaks
+import metrics
+import plays
+import related
+import compression
+import cache
+import hashing
+
+from typing import Literal
+
+from fastapi import HTTPException, APIRouter, BackgroundTasks, Depends, Request, Query
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from database import get_db
-from hashing import hash_password, verify_password
+from database import get_async_db
+from hashing import hash_password_async, verify_and_update_async, HashPoolSaturated
+from crud import AlreadyExists, MissingReference
 from tokens import create_access_token, decode_access_token
+from streaming import track_file_path, file_response
+from pagination import encode_cursor, decode_cursor, DEFAULT_LIMIT, MAX_LIMIT
+from cache import token_cache
+from http_cache import HTTP_CACHE_CONTROL, etag_matches
+from bulk import run_import
+from audio_meta import probe_track_file_async, probe_track_files_async, probe_file_async, file_sha256_async, run_in_pool
+from fast_json import FastJSONResponse
+from export import ndjson_response, tracks_query, authors_query, playlist_query
 
 main_router = APIRouter()
 templates = Jinja2Templates(directory="templates")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
+# Зовнішній ключ запиту вказує на запис, якого немає
+def missing_reference(error: MissingReference) -> HTTPException:
+    return HTTPException(status_code=400, detail="Не існує запису, на який посилається %s=%s!" % (error.column, error.value))
+
 #-----------------------------------------------------------------------------------------------#
 
 # Функція, яка отримує дані користувача з токена
 # Вона використовується для перевірки токена при доступі до захищених маршрутів
 # Сторінки, які вимагають авторизації використовують аргумент
-# current_user: models.User = Depends(get_current_user)
-# для отримання даних користувача
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+# current_user: schemas.CurrentUser = Depends(get_current_user)
+# для отримання даних користувача.
+# Вже перевірений токен береться з token_cache до закінчення його терміну дії,
+# тобто без повторної перевірки підпису і без запиту до БД.
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+    cached = token_cache.get(token)
+    
+    if cached is not None:
+        return cached[1]
+    
     payload = decode_access_token(token)
     
     if payload is None:
         raise HTTPException(status_code=401, detail="Недійсний токен")
     
     user_id = int(payload.get("sub"))
-    user = crud.get_user(db, user_id)
+    user = await async_crud.get_user_cached(db, user_id)
     
     if user is None:
         raise HTTPException(status_code=401, detail="Користувач не знайдений")
     
+    user = schemas.CurrentUser.model_validate(user)
+    token_cache.set(token, payload, user)
+    
     return user
 
+# Параметри сторінки для списків: ?limit=...&cursor=...
+# Курсор береться з поля next_cursor попередньої відповіді
+class PageParams:
+    def __init__(self, limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), cursor: str | None = None):
+        self.limit = limit
+        self.after_id = None
+        
+        if cursor is not None:
+            try:
+                self.after_id = decode_cursor(cursor)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Некоректний курсор!")
+
 #-----------------------------------------------------------------------------------------------#
 
 @main_router.get("/", response_class=HTMLResponse)
-def home(request: Request, db: Session = Depends(get_db)):
+async def home(request: Request, db: AsyncSession = Depends(get_async_db)):
     return templates.TemplateResponse("index.html", {"request": request})
 
 #-----------------------------------------------------------------------------------------------#
 
 @main_router.post("/register", response_model=schemas.User)
-def register(request: Request, user: schemas.UserCreate, db: Session = Depends(get_db)):
-    user.password = hash_password(user.password)
-    result = crud.create_user(db, user)
-    
-    if result is None:
+async def register(request: Request, user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    try:
+        user.password = await hash_password_async(user.password)
+    except HashPoolSaturated:
+        raise HTTPException(status_code=503, detail="Сервер перевантажений, спробуйте пізніше", headers={"Retry-After": "1"})
+    
+    try:
+        result = await async_crud.create_user(db, user)
+    except AlreadyExists:
         raise HTTPException(status_code=400, detail="Користувач вже існує!")
     
     return result
 
 @main_router.post("/login")
-def login(request: Request, db: Session = Depends(get_db), form_data: OAuth2PasswordRequestForm = Depends()):
-    result = crud.get_user_by_login(db, form_data.username)
+async def login(request: Request, db: AsyncSession = Depends(get_async_db), form_data: OAuth2PasswordRequestForm = Depends()):
+    result = await async_crud.get_user_by_login(db, form_data.username)
     
     if result is None:
         raise HTTPException(status_code=400, detail="Невірний логін або пароль!")
     
-    if not verify_password(form_data.password, result.password):
+    try:
+        verified, new_hash = await verify_and_update_async(form_data.password, result.password)
+    except HashPoolSaturated:
+        raise HTTPException(status_code=503, detail="Сервер перевантажений, спробуйте пізніше", headers={"Retry-After": "1"})
+    
+    if not verified:
         raise HTTPException(status_code=400, detail="Невірний логін або пароль!")
+    
+    # Хеш зі старою вартістю bcrypt - непомітно для користувача замінюємо його новим
+    if new_hash is not None:
+        await async_crud.update_user(db, result.id, schemas.UserUpdate(password=new_hash))
 
     access_token = create_access_token(data={"sub": str(result.id)})
     
@@ -74,21 +135,24 @@ def login(request: Request, db: Session = Depends(get_db), form_data: OAuth2Pass
 #-----------------------------------------------------------------------------------------------#
 
 @main_router.post("/add_author", response_model=schemas.Author)
-def add_author(request: Request, author: schemas.AuthorCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    result = crud.create_author(db, author)
-    
-    if result is None:
+async def add_author(request: Request, author: schemas.AuthorCreate, db: AsyncSession = Depends(get_async_db), current_user: schemas.CurrentUser = Depends(get_current_user)):
+    try:
+        result = await async_crud.create_author(db, author)
+    except AlreadyExists:
         raise HTTPException(status_code=400, detail="Автор вже існує!")
     
     return result
 
-@main_router.get("/get_authors", response_model=list[schemas.Author])
-def get_authors(request: Request, db: Session = Depends(get_db)):
-    return crud.get_authors(db)
+# Списки віддаються через FastJSONResponse: crud повертає словники лише з потрібних колонок,
+# і вони одразу серіалізуються, без перевірки кожного рядка через response_model.
+# response_model залишається для документації (OpenAPI).
+@main_router.get("/get_authors", response_model=schemas.Page[schemas.Author])
+async def get_authors(request: Request, page: PageParams = Depends(), db: AsyncSession = Depends(get_async_db)):
+    return FastJSONResponse(await async_crud.get_authors(db, page.limit, page.after_id))
 
 @main_router.get("/get_author/{author_id}", response_model=schemas.Author)
-def get_author(author_id: int, db: Session = Depends(get_db)):
-    author = crud.get_author_by_id(db, author_id)
+async def get_author(author_id: int, db: AsyncSession = Depends(get_async_db)):
+    author = await async_crud.get_author_cached(db, author_id)
     
     if not author:
         raise HTTPException(status_code=404, detail="Автор не найден!")
@@ -96,8 +160,12 @@ def get_author(author_id: int, db: Session = Depends(get_db)):
     return author
 
 @main_router.put("/update_author/{author_id}", response_model=schemas.Author)
-def update_author(author_id: int, author: schemas.AuthorUpdate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    result = crud.update_author(db, author_id, author)
+@main_router.patch("/update_author/{author_id}", response_model=schemas.Author)
+async def update_author(author_id: int, author: schemas.AuthorUpdate, db: AsyncSession = Depends(get_async_db), current_user: schemas.CurrentUser = Depends(get_current_user)):
+    try:
+        result = await async_crud.update_author(db, author_id, author)
+    except AlreadyExists:
+        raise HTTPException(status_code=400, detail="Автор вже існує!")
     
     if result is None:
         raise HTTPException(status_code=400, detail="Автор не найден!")
@@ -105,8 +173,8 @@ def update_author(author_id: int, author: schemas.AuthorUpdate, db: Session = De
     return result
 
 @main_router.delete("/del_author/{author_id}")
-def del_author(request: Request, author_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    result = crud.delete_author(db, author_id)
+async def del_author(request: Request, author_id: int, db: AsyncSession = Depends(get_async_db), current_user: schemas.CurrentUser = Depends(get_current_user)):
+    result = await async_crud.delete_author(db, author_id)
     
     if result is None:
         raise HTTPException(status_code=400, detail="Автор не найден!")
@@ -116,34 +184,126 @@ def del_author(request: Request, author_id: int, db: Session = Depends(get_db),
 #-----------------------------------------------------------------------------------------------#
     
 @main_router.post("/add_track", response_model=schemas.Track)
-def add_track(request: Request, track: schemas.TrackCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    result = crud.create_track(db, track)
+async def add_track(request: Request, track: schemas.TrackCreate, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_async_db), current_user: schemas.CurrentUser = Depends(get_current_user)):
+    # Тривалість, бітрейт і т.д. беруться із самого файлу, якщо він вже є в static/tracks
+    meta = await probe_track_file_async(track.file_name)
     
-    if result is None:
+    if meta is None and track.duration is None:
+        raise HTTPException(status_code=400, detail="Не вдалося визначити тривалість треку!")
+    
+    try:
+        result = await async_crud.create_track(db, track, meta)
+    except AlreadyExists:
         raise HTTPException(status_code=400, detail="Трек вже існує!")
+    except MissingReference as error:
+        raise missing_reference(error)
+    
+    # Хвиля будується одразу після відповіді, щоб перший /peaks не чекав на декодування
+    if meta is not None:
+        background_tasks.add_task(run_in_pool, peaks.ensure_peaks, result.id, result.file_name)
     
     return result
 
-@main_router.get("/get_tracks", response_model=list[schemas.Track])
-def get_tracks(request: Request, db: Session = Depends(get_db)):
-    return crud.get_tracks(db)
+@main_router.get("/get_tracks", response_model=schemas.Page[schemas.Track])
+async def get_tracks(request: Request, page: PageParams = Depends(), db: AsyncSession = Depends(get_async_db)):
+    return FastJSONResponse(await async_crud.get_tracks(db, page.limit, page.after_id))
 
 @main_router.get("/get_track/{track_id}", response_model=schemas.Track)
-def get_track(request: Request, track_id: int, db: Session = Depends(get_db)):
-    result = crud.get_track(db, track_id)
+async def get_track(request: Request, track_id: int, db: AsyncSession = Depends(get_async_db)):
+    result = await async_crud.get_track_cached(db, track_id)
     
     if result is None:
         raise HTTPException(status_code=404, detail="Трек не найден!")
     
     return result 
 
-@main_router.get("/get_tracks_by_author/{author_id}", response_model=list[schemas.Track])
-def get_tracks_by_author(request: Request, author_id: int, db: Session = Depends(get_db)):
-    return crud.get_tracks_by_author(db, author_id)
+@main_router.get("/get_tracks_by_author/{author_id}", response_model=schemas.Page[schemas.Track])
+async def get_tracks_by_author(request: Request, author_id: int, page: PageParams = Depends(), db: AsyncSession = Depends(get_async_db)):
+    return FastJSONResponse(await async_crud.get_tracks_by_author(db, author_id, page.limit, page.after_id))
+
+@main_router.get("/tracks/{track_id}/stream")
+async def stream_track(request: Request, track_id: int, db: AsyncSession = Depends(get_async_db)):
+    track = await async_crud.get_track_cached(db, track_id)
+    
+    if track is None:
+        raise HTTPException(status_code=404, detail="Трек не найден!")
+    
+    path = track_file_path(track.file_name)
+    
+    if path is None:
+        raise HTTPException(status_code=404, detail="Файл треку не знайдено!")
+    
+    return file_response(request, path)
+
+# Хвильова форма треку: трійки (min, max, rms) як int8/int16 little-endian.
+# resolution - скільки точок потрібно (наприклад, ширина хвилі в пікселях); віддається
+# найгрубший рівень, у якому точок не менше. Опис рівня - в заголовках X-Peaks-*.
+@main_router.get("/tracks/{track_id}/peaks")
+async def get_track_peaks(request: Request, track_id: int, resolution: int = Query(1024, ge=1, le=1 << 20), db: AsyncSession = Depends(get_async_db)):
+    track = await async_crud.get_track_cached(db, track_id)
+    
+    if track is None:
+        raise HTTPException(status_code=404, detail="Трек не найден!")
+    
+    sidecar = await run_in_pool(peaks.ensure_peaks, track.id, track.file_name)
+    
+    if sidecar is None:
+        raise HTTPException(status_code=404, detail="Не вдалося побудувати хвилю треку!")
+    
+    data, info = peaks.read_level(sidecar, resolution)
+    stat = os.stat(sidecar)
+    headers = {
+        "ETag": '"%x-%x-%d"' % (stat.st_mtime_ns, stat.st_size, info["level"]),
+        "Cache-Control": HTTP_CACHE_CONTROL,
+        "X-Peaks-Format": "min,max,rms",
+        "X-Peaks-Bits": str(info["bits"]),
+        "X-Peaks-Count": str(info["count"]),
+        "X-Peaks-Samples-Per-Peak": str(info["samples_per_peak"]),
+        "X-Peaks-Sample-Rate": str(info["sample_rate"]),
+        "X-Peaks-Total-Samples": str(info["total_samples"]),
+    }
+    
+    if etag_matches(request.headers.get("if-none-match", ""), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    
+    return Response(data, media_type="application/octet-stream", headers=headers)
+
+# Схожі треки за спільними плейлистами (related.py) - від найсхожішого. Сусіди читаються
+# з індексу на диску, з БД вибираються лише самі треки (один запит).
+@main_router.get("/tracks/{track_id}/related", response_model=list[schemas.RelatedTrack])
+async def get_related_tracks(track_id: int, limit: int = Query(related.RELATED_TOP_K, ge=1, le=related.RELATED_TOP_K), db: AsyncSession = Depends(get_async_db)):
+    if await async_crud.get_track_cached(db, track_id) is None:
+        raise HTTPException(status_code=404, detail="Трек не найден!")
+    
+    neighbors = related.lookup(track_id, limit)
+    tracks = await async_crud.get_tracks_by_ids(db, [neighbor for neighbor, score in neighbors])
+    scores = dict(neighbors)
+    
+    return FastJSONResponse([{**track, "score": scores[track["id"]]} for track in tracks])
+
+# Прослуховування треку. Подія лише потрапляє в буфер (див. plays.py) - у БД вона з'явиться
+# пачкою протягом PLAYS_FLUSH_MS, тому відповідь 202 Accepted.
+@main_router.post("/tracks/{track_id}/play", status_code=202)
+async def play_track(track_id: int, play: schemas.PlayEventCreate | None = None, db: AsyncSession = Depends(get_async_db), current_user: schemas.CurrentUser = Depends(get_current_user)):
+    if await async_crud.get_track_cached(db, track_id) is None:
+        raise HTTPException(status_code=404, detail="Трек не найден!")
+    
+    try:
+        plays.record(track_id, current_user.id, play.listened_ms if play is not None else 0)
+    except plays.PlayBufferFull:
+        raise HTTPException(status_code=503, detail="Сервер перевантажений, спробуйте пізніше", headers={"Retry-After": "1"})
+    
+    return {"detail": "Прийнято"}
 
 @main_router.put("/update_track/{track_id}", response_model=schemas.Track)
-def update_track(track_id: int, track: schemas.TrackUpdate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    result = crud.update_track(db, track_id, track)
+@main_router.patch("/update_track/{track_id}", response_model=schemas.Track)
+async def update_track(track_id: int, track: schemas.TrackUpdate, db: AsyncSession = Depends(get_async_db), current_user: schemas.CurrentUser = Depends(get_current_user)):
+    try:
+        result = await async_crud.update_track(db, track_id, track)
+    except AlreadyExists:
+        raise HTTPException(status_code=400, detail="Трек вже існує!")
+    except MissingReference as error:
+        raise missing_reference(error)
 
     if result is None:
         raise HTTPException(status_code=404, detail="Трек не найден!")
@@ -151,45 +311,51 @@ def update_track(track_id: int, track: schemas.TrackUpdate, db: Session = Depend
     return result
 
 @main_router.delete("/del_track/{track_id}")
-def delete_track(request: Request, track_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    result = crud.delete_track(db, track_id)
+async def delete_track(request: Request, track_id: int, db: AsyncSession = Depends(get_async_db), current_user: schemas.CurrentUser = Depends(get_current_user)):
+    result = await async_crud.delete_track(db, track_id)
     
     if result is None:
         raise HTTPException(status_code=404, detail="Трек не найден!")
     
+    peaks.remove_peaks(result.id, result.file_name)
+    
     return result
 
 #-----------------------------------------------------------------------------------------------#
 
 @main_router.post("/add_playlist", response_model=schemas.PlayList)
-def add_playlist(playlist: schemas.PlayListCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    result = crud.create_playlist(db, playlist)
-    
-    if result is None:
-        raise HTTPException(status_code=400, detail="Нема такого користувача!")
+async def add_playlist(playlist: schemas.PlayListCreate, db: AsyncSession = Depends(get_async_db), current_user: schemas.CurrentUser = Depends(get_current_user)):
+    try:
+        result = await async_crud.create_playlist(db, playlist)
+    except MissingReference as error:
+        raise missing_reference(error)
     
     return result
 
-@main_router.get("/get_playlists", response_model=list[schemas.PlayList])
-def get_playlists(db: Session = Depends(get_db)):
-    return crud.get_playlists(db)
+@main_router.get("/get_playlists", response_model=schemas.Page[schemas.PlayList])
+async def get_playlists(page: PageParams = Depends(), db: AsyncSession = Depends(get_async_db)):
+    return FastJSONResponse(await async_crud.get_playlists(db, page.limit, page.after_id))
 
 @main_router.get("/get_playlist/{playlist_id}", response_model=schemas.PlayList)
-def get_playlist(playlist_id: int, db: Session = Depends(get_db)):
-    result = crud.get_playlist(db, playlist_id)
+async def get_playlist(playlist_id: int, db: AsyncSession = Depends(get_async_db)):
+    result = await async_crud.get_playlist_cached(db, playlist_id)
     
     if not result:
         raise HTTPException(status_code=404, detail="Плейлист не найден!")
     
     return result
 
-@main_router.get("/get_playlists_by_user/{user_id}", response_model=list[schemas.PlayList])
-def get_playlists_by_user(user_id: int, db: Session = Depends(get_db)):
-    return crud.get_user_playlists(db, user_id)
+@main_router.get("/get_playlists_by_user/{user_id}", response_model=schemas.Page[schemas.PlayList])
+async def get_playlists_by_user(user_id: int, page: PageParams = Depends(), db: AsyncSession = Depends(get_async_db)):
+    return FastJSONResponse(await async_crud.get_user_playlists(db, user_id, page.limit, page.after_id))
 
 @main_router.put("/update_playlist/{playlist_id}", response_model=schemas.PlayList)
-def update_playlist(playlist_id: int, playlist: schemas.PlayListUpdate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    result = crud.update_playlist(db, playlist_id, playlist)
+@main_router.patch("/update_playlist/{playlist_id}", response_model=schemas.PlayList)
+async def update_playlist(playlist_id: int, playlist: schemas.PlayListUpdate, db: AsyncSession = Depends(get_async_db), current_user: schemas.CurrentUser = Depends(get_current_user)):
+    try:
+        result = await async_crud.update_playlist(db, playlist_id, playlist)
+    except MissingReference as error:
+        raise missing_reference(error)
     
     if result is None:
         raise HTTPException(status_code=404, detail="Плейлист не найден!")
@@ -197,8 +363,8 @@ def update_playlist(playlist_id: int, playlist: schemas.PlayListUpdate, db: Sess
     return result
 
 @main_router.delete("/del_playlist/{playlist_id}")
-def delete_playlist(playlist_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    result = crud.delete_playlist(db, playlist_id)
+async def delete_playlist(playlist_id: int, db: AsyncSession = Depends(get_async_db), current_user: schemas.CurrentUser = Depends(get_current_user)):
+    result = await async_crud.delete_playlist(db, playlist_id)
     
     if result is None:
         raise HTTPException(status_code=404, detail="Плейлист не найден!")
@@ -208,25 +374,195 @@ def delete_playlist(playlist_id: int, db: Session = Depends(get_db), current_use
 #-----------------------------------------------------------------------------------------------#
 
 @main_router.post("/add_track_to_playlist", response_model=schemas.PlaylistTrack)
-def add_track_to_playlist(link: schemas.PlaylistTrackCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    result = crud.add_track_to_playlist(db, link.playlist_id, link.track_id)
+async def add_track_to_playlist(link: schemas.PlaylistTrackCreate, db: AsyncSession = Depends(get_async_db), current_user: schemas.CurrentUser = Depends(get_current_user)):
+    result = await async_crud.add_track_to_playlist(db, link.playlist_id, link.track_id)
     
     if result is None:
         raise HTTPException(status_code=400, detail="Невозможно добавить трек.")
     
     return result
 
-@main_router.get("/get_playlist_tracks/{playlist_id}", response_model=list[schemas.PlaylistTrack])
-def get_playlist_tracks(playlist_id: int, db: Session = Depends(get_db)):
-    return crud.get_playlist_tracks(db, playlist_id)
+@main_router.get("/get_playlist_tracks/{playlist_id}", response_model=schemas.Page[schemas.PlaylistTrack])
+async def get_playlist_tracks(playlist_id: int, page: PageParams = Depends(), db: AsyncSession = Depends(get_async_db)):
+    return FastJSONResponse(await async_crud.get_playlist_tracks(db, playlist_id, page.limit, page.after_id))
+
+@main_router.get("/get_playlist_detail/{playlist_id}", response_model=schemas.PlaylistDetail)
+async def get_playlist_detail(playlist_id: int, db: AsyncSession = Depends(get_async_db)):
+    result = await async_crud.get_playlist_detail(db, playlist_id)
+    
+    if result is None:
+        raise HTTPException(status_code=404, detail="Плейлист не найден!")
+    
+    return result
 
 @main_router.delete("/remove_from_playlist/{link_id}")
-def remove_from_playlist(link_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    result = crud.remove_from_playlist(db, link_id)
+async def remove_from_playlist(link_id: int, db: AsyncSession = Depends(get_async_db), current_user: schemas.CurrentUser = Depends(get_current_user)):
+    result = await async_crud.remove_from_playlist(db, link_id)
+    
+    if result is None:
+        raise HTTPException(status_code=404, detail="Связь плейлиста и трека не найдена!")
+    
+    return result
+
+# Пачка змін плейлиста (додати / видалити / перемістити треки) в одній транзакції.
+# Повертає всі зв'язки плейлиста в новому порядку.
+@main_router.post("/edit_playlist_tracks/{playlist_id}", response_model=list[schemas.PlaylistTrack])
+async def edit_playlist_tracks(playlist_id: int, ops: list[schemas.PlaylistTrackOp], db: AsyncSession = Depends(get_async_db), current_user: schemas.CurrentUser = Depends(get_current_user)):
+    try:
+        result = await async_crud.apply_playlist_ops(db, playlist_id, ops)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     if result is None:
-        return HTTPException(status_code=404, detail="Связь плейлиста и трека не найдена!")
+        raise HTTPException(status_code=404, detail="Плейлист не найден!")
+    
+    return result
+
+#-----------------------------------------------------------------------------------------------#
+
+# Масовий імпорт: JSON масив або NDJSON потік (Content-Type: application/x-ndjson).
+# Відповідь містить статус для кожного рядка в порядку надходження.
+@main_router.post("/bulk/authors", response_model=schemas.BulkResult)
+async def bulk_authors(request: Request, db: AsyncSession = Depends(get_async_db), current_user: schemas.CurrentUser = Depends(get_current_user)):
+    return await run_import(request, schemas.AuthorCreate, async_crud.bulk_create_authors, db)
+
+@main_router.post("/bulk/tracks", response_model=schemas.BulkResult)
+async def bulk_tracks(request: Request, db: AsyncSession = Depends(get_async_db), current_user: schemas.CurrentUser = Depends(get_current_user)):
+    async def import_chunk(db, tracks):
+        metas = await probe_track_files_async([track.file_name for track in tracks])
+        return await async_crud.bulk_create_tracks(db, tracks, metas)
+    
+    return await run_import(request, schemas.TrackCreate, import_chunk, db)
+
+#-----------------------------------------------------------------------------------------------#
+
+# Завантаження файлу треку частинами (див. uploads.py)
+async def get_own_upload(upload_id: str, db: AsyncSession = Depends(get_async_db), current_user: schemas.CurrentUser = Depends(get_current_user)):
+    db_upload = await async_crud.get_upload(db, upload_id)
+    
+    if db_upload is None or db_upload.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Завантаження не знайдено!")
+    
+    return db_upload
+
+@main_router.post("/uploads", response_model=schemas.Upload)
+async def create_upload(upload: schemas.UploadCreate, db: AsyncSession = Depends(get_async_db), current_user: schemas.CurrentUser = Depends(get_current_user)):
+    uploads.check_new_upload(upload)
+    
+    db_upload = await async_crud.create_upload(db, uploads.new_upload_id(), current_user.id, upload)
+    uploads.start(db_upload.id)
+    
+    return uploads.to_schema(db_upload)
+
+@main_router.get("/uploads/{upload_id}", response_model=schemas.Upload)
+async def get_upload(db_upload = Depends(get_own_upload)):
+    return uploads.to_schema(db_upload)
+
+@main_router.patch("/uploads/{upload_id}", response_model=schemas.Upload)
+async def upload_chunk(request: Request, db_upload = Depends(get_own_upload)):
+    offset = await uploads.receive(request, db_upload)
+    
+    return FastJSONResponse(uploads.to_schema(db_upload).model_dump(), headers={"Upload-Offset": str(offset)})
+
+@main_router.post("/uploads/{upload_id}/complete", response_model=schemas.Track)
+async def complete_upload(track: schemas.UploadComplete, background_tasks: BackgroundTasks, db_upload = Depends(get_own_upload), db: AsyncSession = Depends(get_async_db)):
+    if db_upload.track_id is not None:
+        raise HTTPException(status_code=409, detail="Завантаження вже завершене!")
+    
+    if uploads.current_offset(db_upload.id) != db_upload.size:
+        raise HTTPException(status_code=409, detail="Файл завантажено не повністю!")
+    
+    path = uploads.part_path(db_upload.id)
+    meta = await probe_file_async(path)
+    content_hash = meta["content_hash"] if meta is not None else await file_sha256_async(path)
+    
+    # Пошкоджений файл вже не докачати - лише почати заново
+    if db_upload.sha256 is not None and content_hash != db_upload.sha256.lower():
+        uploads.discard(db_upload.id)
+        await async_crud.delete_upload(db, db_upload.id)
+        raise HTTPException(status_code=422, detail="sha256 файлу не збігається!")
+    
+    if meta is None and track.duration is None:
+        raise HTTPException(status_code=400, detail="Не вдалося визначити тривалість треку!")
+    
+    target = uploads.publish(db_upload)
+    track_create = schemas.TrackCreate(name=track.name, author_id=track.author_id, duration=track.duration, file_name=db_upload.file_name)
+    try:
+        result = await async_crud.create_track_from_upload(db, db_upload.id, track_create, meta or {"content_hash": content_hash})
+    except AlreadyExists:
+        uploads.unpublish(target)
+        raise HTTPException(status_code=400, detail="Трек вже існує!")
+    except MissingReference as error:
+        uploads.unpublish(target)
+        raise missing_reference(error)
+    
+    uploads.discard(db_upload.id)
+    background_tasks.add_task(run_in_pool, peaks.ensure_peaks, result.id, result.file_name)
     
     return result
 
-#-----------------------------------------------------------------------------------------------#
\ No newline at end of file
+@main_router.delete("/uploads/{upload_id}")
+async def delete_upload(db_upload = Depends(get_own_upload), db: AsyncSession = Depends(get_async_db)):
+    uploads.discard(db_upload.id)
+    await async_crud.delete_upload(db, db_upload.id)
+    
+    return {"detail": "Завантаження скасовано"}
+
+#-----------------------------------------------------------------------------------------------#
+
+# Повне вивантаження в NDJSON потоком (з gzip, якщо клієнт надіслав Accept-Encoding: gzip)
+@main_router.get("/export/tracks")
+async def export_tracks(request: Request):
+    return ndjson_response(request, tracks_query(), "tracks")
+
+@main_router.get("/export/authors")
+async def export_authors(request: Request):
+    return ndjson_response(request, authors_query(), "authors")
+
+@main_router.get("/export/playlists/{playlist_id}")
+async def export_playlist(request: Request, playlist_id: int, db: AsyncSession = Depends(get_async_db)):
+    if await async_crud.get_playlist_cached(db, playlist_id) is None:
+        raise HTTPException(status_code=404, detail="Плейлист не найден!")
+    
+    return ndjson_response(request, playlist_query(playlist_id), "playlist_%d" % playlist_id)
+
+#-----------------------------------------------------------------------------------------------#
+
+# Пошук по назвах треків і нікнеймах авторів: /search?q=beat&kind=tracks
+# Курсор тут кодує зсув у списку результатів, упорядкованому за релевантністю.
+@main_router.get("/search", response_model=schemas.Page[schemas.SearchHit])
+async def search(q: str = Query(min_length=1, max_length=200), kind: Literal["all", "tracks", "authors"] = "all", limit: int = Query(20, ge=1, le=MAX_LIMIT), cursor: str | None = None, db: AsyncSession = Depends(get_async_db)):
+    try:
+        offset = decode_cursor(cursor) if cursor is not None else 0
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некоректний курсор!")
+    
+    rows = await async_crud.search_catalog(db, q, kind, limit, offset)
+    next_cursor = encode_cursor(offset + limit) if len(rows) > limit else None
+    
+    return {"items": rows[:limit], "next_cursor": next_cursor}
+
+#-----------------------------------------------------------------------------------------------#
+
+# Метрики для Prometheus (див. metrics.py)
+@main_router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    gauges = {
+        **metrics.flatten("cache", cache.stats()),
+        **metrics.flatten("hash_pool", hashing.pool_stats()),
+        **metrics.flatten("plays", plays.buffer.stats()),
+        **metrics.flatten("related", related.stats()),
+        **metrics.flatten("compression", compression.stats()),
+    }
+    return PlainTextResponse(metrics.render(gauges), media_type="text/plain; version=0.0.4")
+
+# Результат профілювання запиту з X-Profile: 1 (лише якщо METRICS_PROFILE=1)
+@main_router.get("/debug/profiles/{profile_id}", response_class=PlainTextResponse)
+async def get_profile(profile_id: str):
+    profile = metrics.get_profile(profile_id) if metrics.METRICS_PROFILE else None
+    
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Профіль не знайдено!")
+    
+    return profile
+
@@ -2,8 +2,18 @@
 # Простими словами - як ви побачите дані після запиту до API. Тобто не у вигляді словника,
 # а у вигляді об'єкта з атрибутами. Також корисно для валідації даних.
 
+from typing import Generic, Literal, TypeVar
+
 from pydantic import BaseModel, Field
 
+T = TypeVar("T")
+
+# Одна сторінка списку. next_cursor передається в наступний запит як ?cursor=...
+# Якщо next_cursor == None - це остання сторінка.
+class Page(BaseModel, Generic[T]):
+    items: list[T]
+    next_cursor: str | None = None
+
 class AuthorBase(BaseModel):
     nickname: str
     
@@ -13,11 +23,14 @@ class AuthorCreate(AuthorBase):
 class AuthorDelete(AuthorBase):
     pass
 
-class AuthorUpdate(AuthorBase):
-    pass
+# Update схеми - для PATCH: передаються лише поля, які треба змінити
+class AuthorUpdate(BaseModel):
+    nickname: str | None = None
 
 class Author(AuthorBase):
     id: int
+    track_count: int = 0
+    total_duration: int = 0
     
     class Config:
         from_attributes = True
@@ -28,17 +41,26 @@ class TrackBase(BaseModel):
     author_id: int
     file_name: str
     
+# duration можна не передавати - тоді вона визначається з файлу static/tracks/<file_name>
 class TrackCreate(TrackBase):
-    pass
+    duration: int | None = None
 
 class TrackDelete(TrackBase):
     pass
 
-class TrackUpdate(TrackBase):
-    pass
+class TrackUpdate(BaseModel):
+    name: str | None = None
+    duration: int | None = None
+    author_id: int | None = None
+    file_name: str | None = None
 
 class Track(TrackBase):
     id: int
+    bitrate: int | None = None
+    sample_rate: int | None = None
+    content_hash: str | None = None
+    play_count: int = 0
+    listen_ms: int = 0
     
     class Config:
         from_attributes = True
@@ -50,8 +72,9 @@ class UserBase(BaseModel):
 class UserCreate(UserBase):
     pass
 
-class UserUpdate(UserBase):
-    pass
+class UserUpdate(BaseModel):
+    login: str | None = None
+    password: str | None = None
 
 class UserLogin(UserBase):
     pass
@@ -61,6 +84,14 @@ class User(UserBase):
 
     class Config:
         from_attributes = True
+
+# Короткий знімок авторизованого користувача без хешу пароля - саме він кешується разом з токеном
+class CurrentUser(BaseModel):
+    id: int
+    login: str
+
+    class Config:
+        from_attributes = True
         
 class PlayListBase(BaseModel):
     name: str
@@ -69,11 +100,14 @@ class PlayListBase(BaseModel):
 class PlayListCreate(PlayListBase):
     pass
 
-class PlayListUpdate(PlayListBase):
-    pass
+class PlayListUpdate(BaseModel):
+    name: str | None = None
+    user_id: int | None = None
 
 class PlayList(PlayListBase):
     id: int
+    track_count: int = 0
+    total_duration: int = 0
 
     class Config:
         from_attributes = True
@@ -87,6 +121,81 @@ class PlaylistTrackCreate(PlaylistTrackBase):
 
 class PlaylistTrack(PlaylistTrackBase):
     id: int
+    position: int | None = None
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+# Одна операція зміни плейлиста:
+# add - додати трек track_id, remove - видалити зв'язок link_id, move - перемістити зв'язок link_id.
+# Для add і move місце задається after_link_id або before_link_id, без них - в кінець плейлиста.
+class PlaylistTrackOp(BaseModel):
+    op: Literal["add", "remove", "move"]
+    track_id: int | None = None
+    link_id: int | None = None
+    after_link_id: int | None = None
+    before_link_id: int | None = None
+
+# Трек всередині плейлиста разом з нікнеймом автора.
+# link_id - id зв'язку PlaylistTrack, щоб клієнт міг видалити саме цей запис з плейлиста.
+class PlaylistDetailTrack(Track):
+    link_id: int
+    author_nickname: str | None = None
+
+# Плейлист з усіма треками, які вже розгорнуті - клієнту не треба запитувати кожен трек окремо
+class PlaylistDetail(PlayList):
+    tracks: list[PlaylistDetailTrack]
+
+# Схожий трек (related.py): score - косинусна схожість за спільними плейлистами, від 0 до 1
+class RelatedTrack(Track):
+    score: float
+
+# Результат масового імпорту для одного рядка.
+# status: created - додано, exists - вже є в БД (id існуючого запису),
+# duplicate - повтор у самому запиті, invalid - рядок не пройшов валідацію, error - інша помилка
+class BulkRowResult(BaseModel):
+    index: int
+    status: str
+    id: int | None = None
+    detail: str | None = None
+
+class BulkResult(BaseModel):
+    created: int
+    skipped: int
+    failed: int
+    results: list[BulkRowResult]
+
+# Один результат пошуку: трек або автор. score - оцінка BM25 (чим менше, тим краще збіг).
+class SearchHit(BaseModel):
+    kind: Literal["track", "author"]
+    id: int
+    name: str
+    author_id: int | None = None
+    score: float
+
+# Початок завантаження файлу треку. size - повний розмір файлу в байтах,
+# sha256 - (необов'язково) хеш файлу, з яким звіряється завантажений файл.
+class UploadCreate(BaseModel):
+    file_name: str = Field(min_length=1, max_length=255, pattern=r"^[^/\\]+$")
+    size: int = Field(gt=0)
+    sha256: str | None = Field(default=None, pattern=r"^[0-9a-fA-F]{64}$")
+
+# offset - скільки байт вже отримано, з цього місця продовжується завантаження
+class Upload(BaseModel):
+    id: str
+    file_name: str
+    size: int
+    sha256: str | None = None
+    offset: int
+    track_id: int | None = None
+
+# Дані треку, який створюється із завантаженого файлу
+class UploadComplete(BaseModel):
+    name: str
+    author_id: int
+    duration: int | None = None
+
+# Прослуховування треку. listened_ms - скільки мілісекунд трек реально звучав.
+class PlayEventCreate(BaseModel):
+    listened_ms: int = Field(default=0, ge=0, le=24 * 60 * 60 * 1000)
+
@@ -0,0 +1,172 @@
+# Повнотекстовий пошук по назвах треків і нікнеймах авторів на SQLite FTS5.
+# Для кожної таблиці є два індекси:
+#   <table>_fts     - слова (unicode61, без урахування регістру і діакритики) + префіксний індекс,
+#                     по ньому шукається "як вводить користувач": "beat" знаходить "Beatles";
+#   <table>_trigram - триграми, по ньому виконується нечіткий пошук, коли точних збігів немає:
+#                     "beatls" все одно знаходить "Beatles" за спільними триграмами.
+# Індекси синхронізуються тригерами на INSERT/UPDATE/DELETE, тому їх не треба оновлювати
+# вручну в crud.py - навіть масовий імпорт (executemany) потрапляє в індекс автоматично.
+# Результати ранжуються за BM25. Для інших СУБД використовується простий пошук за префіксом (LIKE).
+
+import re
+import sqlite3
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+import models
+
+# таблиця -> колонка, яка індексується
+SEARCH_TABLES = {
+    "tracks": "name",
+    "authors": "nickname",
+}
+
+TRIGRAM_SUPPORTED = sqlite3.sqlite_version_info >= (3, 34, 0)
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+#-----------------------------------------------------------------------------------------------#
+
+def _table_ddl(table: str, column: str, suffix: str, tokenize: str, options: str = "") -> list:
+    index = "%s_%s" % (table, suffix)
+
+    return [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(%s, content='%s', content_rowid='id', tokenize=\"%s\"%s)"
+        % (index, column, table, tokenize, options),
+
+        # Індексація рядків, які вже є в таблиці
+        "INSERT INTO %s(%s) VALUES ('rebuild')" % (index, index),
+    ]
+
+def _trigger_ddl(table: str, column: str, suffix: str) -> list:
+    index = "%s_%s" % (table, suffix)
+
+    return [
+        "CREATE TRIGGER IF NOT EXISTS %s_ai AFTER INSERT ON %s BEGIN "
+        "INSERT INTO %s(rowid, %s) VALUES (new.id, new.%s); END"
+        % (index, table, index, column, column),
+
+        "CREATE TRIGGER IF NOT EXISTS %s_ad AFTER DELETE ON %s BEGIN "
+        "INSERT INTO %s(%s, rowid, %s) VALUES ('delete', old.id, old.%s); END"
+        % (index, table, index, index, column, column),
+
+        "CREATE TRIGGER IF NOT EXISTS %s_au AFTER UPDATE OF %s ON %s BEGIN "
+        "INSERT INTO %s(%s, rowid, %s) VALUES ('delete', old.id, old.%s); "
+        "INSERT INTO %s(rowid, %s) VALUES (new.id, new.%s); END"
+        % (index, column, table, index, index, column, column, index, column, column),
+    ]
+
+def _index_exists(connection, index: str) -> bool:
+    return connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": index}
+    ).first() is not None
+
+# Створює пошукові індекси і тригери, яких ще немає. Безпечно викликати повторно:
+# вже існуючий індекс не перебудовується, а тригери відновлюються (наприклад, після
+# перебудови таблиці в міграції, яка видаляє тригери разом зі старою таблицею).
+def create_search_index(connection):
+    if connection.dialect.name != "sqlite":
+        return
+
+    indexes = [("fts", "unicode61 remove_diacritics 2", ", prefix='2 3'")]
+
+    if TRIGRAM_SUPPORTED:
+        indexes.append(("trigram", "trigram", ""))
+
+    for table, column in SEARCH_TABLES.items():
+        for suffix, tokenize, options in indexes:
+            statements = _trigger_ddl(table, column, suffix)
+
+            if not _index_exists(connection, "%s_%s" % (table, suffix)):
+                statements = _table_ddl(table, column, suffix, tokenize, options) + statements
+
+            for statement in statements:
+                connection.execute(text(statement))
+
+#-----------------------------------------------------------------------------------------------#
+
+def _prefix_query(q: str):
+    tokens = _TOKEN_RE.findall(q.lower())
+    return " ".join('"%s"*' % token for token in tokens) or None
+
+def _trigram_query(q: str):
+    trigrams = set()
+
+    for token in _TOKEN_RE.findall(q.lower()):
+        trigrams.update(token[i:i + 3] for i in range(len(token) - 2))
+
+    return " OR ".join('"%s"' % trigram for trigram in sorted(trigrams)) or None
+
+def _fts_search(db: Session, suffix: str, match: str, kind: str, limit: int, offset: int):
+    parts = []
+
+    if kind in ("all", "tracks"):
+        parts.append(
+            "SELECT 'track' AS kind, tracks.id AS id, tracks.name AS name, tracks.author_id AS author_id, "
+            "bm25(tracks_{s}) AS score FROM tracks_{s} JOIN tracks ON tracks.id = tracks_{s}.rowid "
+            "WHERE tracks_{s} MATCH :q".format(s=suffix)
+        )
+
+    if kind in ("all", "authors"):
+        parts.append(
+            "SELECT 'author' AS kind, authors.id AS id, authors.nickname AS name, NULL AS author_id, "
+            "bm25(authors_{s}) AS score FROM authors_{s} JOIN authors ON authors.id = authors_{s}.rowid "
+            "WHERE authors_{s} MATCH :q".format(s=suffix)
+        )
+
+    sql = " UNION ALL ".join(parts) + " ORDER BY score, id LIMIT :limit OFFSET :offset"
+    rows = db.execute(text(sql), {"q": match, "limit": limit, "offset": offset}).mappings().all()
+
+    return [dict(row) for row in rows]
+
+# % і _ у запиті - звичайні символи, а не шаблони LIKE
+def _like_prefix(q: str) -> str:
+    return q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+def _like_search(db: Session, q: str, kind: str, limit: int, offset: int):
+    prefix = _like_prefix(q)
+    rows = []
+
+    if kind in ("all", "tracks"):
+        rows += [
+            {"kind": "track", "id": track.id, "name": track.name, "author_id": track.author_id, "score": 0.0}
+            for track in db.query(models.Track).filter(models.Track.name.ilike(prefix, escape="\\")).order_by(models.Track.name).limit(offset + limit)
+        ]
+
+    if kind in ("all", "authors"):
+        rows += [
+            {"kind": "author", "id": author.id, "name": author.nickname, "author_id": None, "score": 0.0}
+            for author in db.query(models.Author).filter(models.Author.nickname.ilike(prefix, escape="\\")).order_by(models.Author.nickname).limit(offset + limit)
+        ]
+
+    rows.sort(key=lambda row: row["name"])
+    return rows[offset:offset + limit]
+
+# Пошук треків і/або авторів (kind: all, tracks, authors).
+# Повертає до limit + 1 результатів, щоб викликач міг визначити, чи є наступна сторінка.
+# Нечіткий пошук по триграмах використовується лише тоді, коли за префіксами не знайдено нічого.
+def search(db: Session, q: str, kind: str = "all", limit: int = 20, offset: int = 0):
+    if db.get_bind().dialect.name != "sqlite":
+        return _like_search(db, q, kind, limit + 1, offset)
+
+    match = _prefix_query(q)
+
+    if match is None:
+        return []
+
+    rows = _fts_search(db, "fts", match, kind, limit + 1, offset)
+
+    if rows or not TRIGRAM_SUPPORTED:
+        return rows
+
+    # Порожня сторінка після першої - це просто кінець точних результатів
+    if offset > 0 and _fts_search(db, "fts", match, kind, 1, 0):
+        return rows
+
+    match = _trigram_query(q)
+
+    if match is None:
+        return rows
+
+    return _fts_search(db, "trigram", match, kind, limit + 1, offset)
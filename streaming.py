@@ -0,0 +1,195 @@
+# Віддача аудіофайлів треків частинами (HTTP Range / 206 Partial Content).
+# Плеєр постійно перемотує трек, тому замість повного файлу віддаємо лише запитаний шматок,
+# а також підтримуємо умовні запити (ETag / Last-Modified -> 304), щоб не пересилати файл повторно.
+
+import os
+import mimetypes
+
+from email.utils import formatdate, parsedate_to_datetime
+
+import anyio
+
+from fastapi import Request
+from fastapi.responses import Response
+
+TRACKS_DIR = os.path.join("static", "tracks")
+CHUNK_SIZE = 64 * 1024
+
+#-----------------------------------------------------------------------------------------------#
+
+# Повертає повний шлях до файлу треку або None, якщо файлу немає
+# чи ім'я файлу намагається вийти за межі папки з треками (../../etc/passwd)
+def track_file_path(file_name: str):
+    if not file_name:
+        return None
+
+    base = os.path.realpath(TRACKS_DIR)
+    path = os.path.realpath(os.path.join(base, file_name))
+
+    if os.path.commonpath([base, path]) != base:
+        return None
+
+    if not os.path.isfile(path):
+        return None
+
+    return path
+
+def make_etag(stat: os.stat_result) -> str:
+    return '"%x-%x"' % (stat.st_mtime_ns, stat.st_size)
+
+def make_last_modified(stat: os.stat_result) -> str:
+    return formatdate(stat.st_mtime, usegmt=True)
+
+def _etag_matches(header: str, etag: str, weak: bool = True) -> bool:
+    if header.strip() == "*":
+        return True
+
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+
+        if weak and candidate.startswith("W/"):
+            candidate = candidate[2:]
+
+        if candidate == etag:
+            return True
+
+    return False
+
+def _not_modified_since(header: str, stat: os.stat_result) -> bool:
+    try:
+        since = parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+    return int(stat.st_mtime) <= since
+
+# Розбирає заголовок Range. Повертає (start, end) включно або None, якщо заголовок
+# треба проігнорувати (невідомі одиниці, кілька діапазонів) і віддати файл повністю.
+# Якщо діапазон не перетинається з файлом - ValueError (416).
+def parse_range(header: str, size: int):
+    unit, _, ranges = header.partition("=")
+
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+
+    start, sep, end = ranges.strip().partition("-")
+
+    if not sep:
+        return None
+
+    try:
+        if start == "":
+            # bytes=-500 - останні 500 байт
+            length = int(end)
+            if length <= 0:
+                raise ValueError("Порожній діапазон")
+            return max(size - length, 0), size - 1
+
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        raise ValueError("Некоректний діапазон")
+
+    if start < 0 or start > end or start >= size:
+        raise ValueError("Діапазон поза межами файлу")
+
+    return start, min(end, size - 1)
+
+#-----------------------------------------------------------------------------------------------#
+
+# Відповідь, яка віддає шматок файлу [start, end].
+# Якщо ASGI сервер підтримує розширення zerocopysend - файл віддається через sendfile
+# без копіювання в пам'ять процесу, інакше читаємо файл блоками по CHUNK_SIZE.
+class FileRangeResponse(Response):
+    def __init__(self, path: str, start: int, end: int, status_code: int = 200, headers: dict = None, media_type: str = None):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.end = end
+        self.headers["content-length"] = str(end - start + 1) if end >= start else "0"
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+
+        length = self.end - self.start + 1
+
+        if scope.get("method") == "HEAD" or length <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(self.path, "rb") as file:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file.fileno(),
+                    "offset": self.start,
+                    "count": length,
+                    "more_body": False,
+                })
+            return
+
+        async with await anyio.open_file(self.path, "rb") as file:
+            await file.seek(self.start)
+            remaining = length
+
+            while remaining > 0:
+                chunk = await file.read(min(CHUNK_SIZE, remaining))
+
+                if not chunk:
+                    break
+
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+
+            if remaining > 0:
+                # Файл обрізали під час віддачі - закриваємо тіло відповіді
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+# Будує відповідь для файлу з урахуванням заголовків запиту:
+# If-None-Match / If-Modified-Since -> 304, Range (+ If-Range) -> 206, інакше 200.
+def file_response(request: Request, path: str) -> Response:
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = make_etag(stat)
+    last_modified = make_last_modified(stat)
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+    headers = {
+        "accept-ranges": "bytes",
+        "etag": etag,
+        "last-modified": last_modified,
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if_modified_since = request.headers.get("if-modified-since")
+
+    if if_none_match is not None:
+        if _etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+    elif if_modified_since is not None and _not_modified_since(if_modified_since, stat):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+
+    if range_header is not None and if_range is not None:
+        # If-Range: діапазон віддаємо лише якщо файл не змінився, інакше - файл повністю
+        if if_range.strip().startswith('"') or if_range.strip().startswith("W/"):
+            if not _etag_matches(if_range, etag, weak=False):
+                range_header = None
+        elif if_range.strip() != last_modified:
+            range_header = None
+
+    if range_header is not None and size > 0:
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            headers["content-range"] = "bytes */%d" % size
+            return Response(status_code=416, headers=headers)
+
+        if byte_range is not None:
+            start, end = byte_range
+            headers["content-range"] = "bytes %d-%d/%d" % (start, end, size)
+            return FileRangeResponse(path, start, end, status_code=206, headers=headers, media_type=media_type)
+
+    return FileRangeResponse(path, 0, size - 1, status_code=200, headers=headers, media_type=media_type)
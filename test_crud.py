@@ -0,0 +1,62 @@
+# Перевірка того, як crud.py розрізняє порушення обмежень БД при записі:
+# унікальність -> AlreadyExists, неіснуючий зовнішній ключ -> MissingReference, немає запису -> None.
+# Запуск: python -m pytest test_crud.py
+
+import pytest
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+import crud
+import schemas
+
+from database import Base
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    event.listen(engine, "connect", lambda connection, record: connection.execute("PRAGMA foreign_keys = ON"))
+    Base.metadata.create_all(bind=engine)
+
+    with sessionmaker(bind=engine, expire_on_commit=False)() as session:
+        author = crud.create_author(session, schemas.AuthorCreate(nickname="author"))
+        crud.create_track(session, schemas.TrackCreate(name="first", duration=10, author_id=author.id, file_name="first.mp3"))
+        crud.create_track(session, schemas.TrackCreate(name="second", duration=10, author_id=author.id, file_name="second.mp3"))
+        yield session
+
+    engine.dispose()
+
+#-----------------------------------------------------------------------------------------------#
+
+def test_create_track_missing_author(db):
+    with pytest.raises(crud.MissingReference) as error:
+        crud.create_track(db, schemas.TrackCreate(name="third", duration=10, author_id=999, file_name="third.mp3"))
+
+    assert (error.value.column, error.value.value) == ("author_id", 999)
+
+def test_create_track_duplicate_name(db):
+    with pytest.raises(crud.AlreadyExists):
+        crud.create_track(db, schemas.TrackCreate(name="first", duration=10, author_id=1, file_name="other.mp3"))
+
+def test_create_author_duplicate(db):
+    with pytest.raises(crud.AlreadyExists):
+        crud.create_author(db, schemas.AuthorCreate(nickname="author"))
+
+def test_update_track_missing_author(db):
+    with pytest.raises(crud.MissingReference) as error:
+        crud.update_track(db, 1, schemas.TrackUpdate(author_id=2))
+
+    assert (error.value.column, error.value.value) == ("author_id", 2)
+
+def test_update_track_duplicate_name(db):
+    with pytest.raises(crud.AlreadyExists):
+        crud.update_track(db, 2, schemas.TrackUpdate(name="first"))
+
+def test_update_missing_track(db):
+    assert crud.update_track(db, 999, schemas.TrackUpdate(name="third")) is None
+
+def test_create_playlist_missing_user(db):
+    with pytest.raises(crud.MissingReference) as error:
+        crud.create_playlist(db, schemas.PlayListCreate(name="playlist", user_id=5))
+
+    assert error.value.column == "user_id"
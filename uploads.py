@@ -0,0 +1,294 @@
+# Завантаження аудіофайлів треків частинами з можливістю продовжити перерване завантаження.
+#
+#   POST   /uploads                 {file_name, size, sha256?}  -> {id, offset: 0, ...}
+#   PATCH  /uploads/{id}            Upload-Offset: <offset>, тіло - наступна частина файлу
+#   GET    /uploads/{id}            -> поточний offset (звідки продовжувати після обриву)
+#   POST   /uploads/{id}/complete   {name, author_id}  -> створений трек
+#   DELETE /uploads/{id}            скасувати завантаження
+#
+# Тіло запиту пишеться на диск потоком, блоками по UPLOAD_CHUNK_SIZE, тому в пам'яті ніколи
+# не буває більше одного блоку, незалежно від розміру файлу. Отримані байти дописуються у файл
+# <id>.part, і його розмір - це і є offset: навіть якщо з'єднання обірвалося посеред запиту,
+# уже записане не втрачається. Після завершення перевіряється розмір і sha256, а файл
+# атомарно з'являється в static/tracks (os.link - без перезапису чужого файлу).
+#
+# Поки PATCH дописує частину, файл <id>.part заблокований (flock), тому другий PATCH того ж
+# завантаження отримує 409 - і в іншому воркері (uvicorn --workers N) теж.
+# Незавершені завантаження, до яких ніхто не звертався UPLOAD_TTL секунд, видаляються
+# фоновою задачею (кожні UPLOAD_CLEANUP_S секунд) разом з їхніми .part файлами,
+# або вручну: python uploads.py
+
+import os
+import time
+import uuid
+import asyncio
+import logging
+
+import anyio
+
+from fastapi import HTTPException, Request
+from starlette.requests import ClientDisconnect
+
+import models
+import schemas
+
+from sqlalchemy import select
+
+from streaming import TRACKS_DIR
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Папка не повинна бути всередині static - незавершені файли не мають бути доступні за URL
+UPLOADS_DIR = os.getenv("UPLOADS_DIR", "uploads")
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+UPLOAD_MAX_SIZE = int(os.getenv("UPLOAD_MAX_SIZE", 2 * 1024 * 1024 * 1024))
+UPLOAD_TTL = float(os.getenv("UPLOAD_TTL", 24 * 3600))              # секунд без нових частин
+UPLOAD_CLEANUP_S = float(os.getenv("UPLOAD_CLEANUP_S", 3600))      # 0 - не прибирати у фоні
+
+# Без fcntl (Windows) - лише в межах процесу: завантаження, в які зараз пишеться частина
+_active = set()
+_task = None
+
+#-----------------------------------------------------------------------------------------------#
+
+def new_upload_id() -> str:
+    return uuid.uuid4().hex
+
+def part_path(upload_id: str) -> str:
+    return os.path.join(UPLOADS_DIR, upload_id + ".part")
+
+def target_path(file_name: str) -> str:
+    return os.path.join(TRACKS_DIR, file_name)
+
+def current_offset(upload_id: str) -> int:
+    try:
+        return os.path.getsize(part_path(upload_id))
+    except FileNotFoundError:
+        return 0
+
+def to_schema(db_upload) -> schemas.Upload:
+    return schemas.Upload(
+        id=db_upload.id,
+        file_name=db_upload.file_name,
+        size=db_upload.size,
+        sha256=db_upload.sha256,
+        offset=db_upload.size if db_upload.track_id is not None else current_offset(db_upload.id),
+        track_id=db_upload.track_id,
+    )
+
+def check_new_upload(upload: schemas.UploadCreate):
+    if upload.file_name in (".", "..") or upload.file_name.startswith("."):
+        raise HTTPException(status_code=400, detail="Некоректне ім'я файлу!")
+
+    if upload.size > UPLOAD_MAX_SIZE:
+        raise HTTPException(status_code=413, detail="Файл завеликий!")
+
+    if os.path.exists(target_path(upload.file_name)):
+        raise HTTPException(status_code=409, detail="Файл з таким ім'ям вже існує!")
+
+def start(upload_id: str):
+    os.makedirs(UPLOADS_DIR, exist_ok=True)
+    open(part_path(upload_id), "wb").close()
+
+# Неблокуюче виключне блокування відкритого файлу. Знімається разом із закриттям файлу.
+def _try_lock(file, upload_id: str) -> bool:
+    if fcntl is None:
+        if upload_id in _active:
+            return False
+
+        _active.add(upload_id)
+        return True
+
+    try:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+
+    return True
+
+def _unlock(upload_id: str):
+    if fcntl is None:
+        _active.discard(upload_id)
+
+def discard(upload_id: str):
+    try:
+        os.remove(part_path(upload_id))
+    except FileNotFoundError:
+        pass
+
+#-----------------------------------------------------------------------------------------------#
+
+# Дописує тіло запиту в <id>.part, починаючи з offset. Повертає новий offset.
+async def receive(request: Request, db_upload) -> int:
+    upload_id = db_upload.id
+
+    if db_upload.track_id is not None:
+        raise HTTPException(status_code=409, detail="Завантаження вже завершене!")
+
+    try:
+        offset = int(request.headers["upload-offset"])
+    except (KeyError, ValueError):
+        raise HTTPException(status_code=400, detail="Потрібен заголовок Upload-Offset!")
+
+    async with await anyio.open_file(part_path(upload_id), "ab") as file:
+        # Два PATCH одночасно зіпсували б файл
+        if not _try_lock(file.wrapped, upload_id):
+            raise HTTPException(status_code=409, detail="Частина цього файлу вже завантажується!")
+
+        try:
+            received = current_offset(upload_id)
+
+            # Клієнт не знає, скільки дійшло до сервера - нехай запитає GET /uploads/{id}
+            if offset != received:
+                raise HTTPException(status_code=409, detail="Невірний Upload-Offset, очікується %d" % received, headers={"Upload-Offset": str(received)})
+
+            remaining = db_upload.size - received
+            buffer = bytearray()
+            too_large = False
+
+            try:
+                async for chunk in request.stream():
+                    if len(chunk) > remaining - len(buffer):
+                        chunk = chunk[:remaining - len(buffer)]
+                        too_large = True
+
+                    buffer += chunk
+
+                    if len(buffer) >= UPLOAD_CHUNK_SIZE:
+                        await file.write(buffer)
+                        remaining -= len(buffer)
+                        buffer.clear()
+
+                    if too_large:
+                        break
+            except ClientDisconnect:
+                pass
+            finally:
+                # Навіть якщо з'єднання обірвалося, отримане зберігається - з цього місця й продовжимо
+                if buffer:
+                    await file.write(buffer)
+        finally:
+            _unlock(upload_id)
+
+    if too_large:
+        raise HTTPException(status_code=413, detail="Отримано більше даних, ніж size!")
+
+    return current_offset(upload_id)
+
+#-----------------------------------------------------------------------------------------------#
+
+# Переносить готовий файл у static/tracks. Повертає шлях до нього.
+# os.link не перезаписує існуючий файл (на відміну від os.replace) і виконується атомарно:
+# інші запити бачать або повний файл, або ніякого.
+def publish(db_upload) -> str:
+    os.makedirs(TRACKS_DIR, exist_ok=True)
+    target = target_path(db_upload.file_name)
+
+    try:
+        os.link(part_path(db_upload.id), target)
+    except FileExistsError:
+        raise HTTPException(status_code=409, detail="Файл з таким ім'ям вже існує!")
+
+    return target
+
+def unpublish(target: str):
+    try:
+        os.remove(target)
+    except FileNotFoundError:
+        pass
+
+#-----------------------------------------------------------------------------------------------#
+
+# Коли до завантаження зверталися востаннє: час створення або останньої записаної частини
+def _last_activity(upload_id: str, created_at: float) -> float:
+    try:
+        return max(created_at or 0, os.path.getmtime(part_path(upload_id)))
+    except FileNotFoundError:
+        return created_at or 0
+
+# Видаляє .part файл, якщо в нього зараз ніхто не пише. False - файл зайнятий.
+def _remove_idle_part(upload_id: str) -> bool:
+    try:
+        file = open(part_path(upload_id), "rb")
+    except FileNotFoundError:
+        return True
+
+    with file:
+        if not _try_lock(file, upload_id):
+            return False
+
+        try:
+            os.remove(part_path(upload_id))
+        finally:
+            _unlock(upload_id)
+
+    return True
+
+# Видаляє незавершені завантаження, старші за ttl, і .part файли, для яких немає запису в БД.
+# Повертає кількість видалених завантажень.
+def cleanup(db, ttl: float = UPLOAD_TTL) -> int:
+    deadline = time.time() - ttl
+    rows = db.execute(select(models.Upload.id, models.Upload.created_at).where(models.Upload.track_id.is_(None))).all()
+    known = {row.id for row in db.execute(select(models.Upload.id))}
+    removed = 0
+
+    for upload_id, created_at in rows:
+        if _last_activity(upload_id, created_at) < deadline and _remove_idle_part(upload_id):
+            db.execute(models.Upload.__table__.delete().where(models.Upload.id == upload_id))
+            db.commit()
+            removed += 1
+
+    if os.path.isdir(UPLOADS_DIR):
+        for name in os.listdir(UPLOADS_DIR):
+            upload_id, extension = os.path.splitext(name)
+
+            if extension == ".part" and upload_id not in known and _last_activity(upload_id, 0) < deadline:
+                _remove_idle_part(upload_id)
+
+    return removed
+
+def _cleanup_once() -> int:
+    from database import SessionLocal
+
+    with SessionLocal() as db:
+        return cleanup(db)
+
+async def _run():
+    while True:
+        try:
+            removed = await asyncio.to_thread(_cleanup_once)
+
+            if removed:
+                logger.info("Видалено незавершених завантажень: %d", removed)
+        except Exception:
+            logger.exception("Не вдалося прибрати незавершені завантаження")
+
+        await asyncio.sleep(UPLOAD_CLEANUP_S)
+
+def start_cleanup():
+    global _task
+
+    if UPLOAD_CLEANUP_S > 0:
+        _task = asyncio.create_task(_run())
+
+async def stop_cleanup():
+    global _task
+
+    if _task is not None:
+        _task.cancel()
+
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+
+    _task = None
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print("Видалено незавершених завантажень: %d" % _cleanup_once())